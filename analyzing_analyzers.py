@@ -2,6 +2,7 @@ from functools import reduce
 import pandas as pd
 import json
 from packaging import version
+from filtering_fixable_diagnostics import write_fixable_diagnostics
 
 IRRELEVANT_PRINT_COLS = ['DiagnosticTitle', 'DiagnosticDescription', 'DiagnosticCategory', 'DiagnosticDefaultSeverity',
                          'DiagnosticCustomTags', 'ContainsFixAllProvider', 'Type', 'FixAllProviderSupportedScopes', 'RefactoringName']
@@ -413,6 +414,17 @@ def create_relevant_source_package_list(df):
             f.write("%s\n" % package)
 
 
+def create_fixable_diagnostics_file(df):
+    """
+    Creates fixable_diagnostics.json, the lookup of das_cps_intersections used to
+    skip diagnostics without CodeFixProvider (see filtering_fixable_diagnostics.py)
+    """
+
+    _, intersection, _, _ = das_cps_intersections(df, False)
+    analyzer_packages = list(df.groupby(['NuGetAnalyzerPackage']).groups.keys())
+    write_fixable_diagnostics(analyzer_packages, intersection)
+
+
 def availability_fix_all_provider(df):
     """
     How many of our code fixers can be applied to an entire solution?
@@ -460,6 +472,7 @@ def calculate_analyzer_statistics(csv_file="analyzer_package_details.csv"):
 
     # duplicate_diagnostic_ids(df)
     # create_relevant_source_package_list(df)
+    # create_fixable_diagnostics_file(df)
 
     ###### Requires *filtered* dataframe ######
 
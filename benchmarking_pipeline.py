@@ -0,0 +1,354 @@
+"""
+This file benchmarks the hot spots of the pipeline on synthetic inputs, so that
+optimizations can be compared with their previous implementations.
+
+"""
+
+import random
+import bisect
+import time
+import glob
+import os
+import tempfile
+from unidiff import PatchSet
+from pygments.token import Name
+from parsing_diffs import parse_hunk, iter_parsed_patched_files, DiffActionArrays
+from generating_synthetic_inputs import git_diff_of_file, random_edit, load_csharp_corpus, ANALYZED_REPOS_DIR
+from unifying_raw_dataset import match_diff_actions_to_diagnostics, compute_required_lines
+from regex_lexer import CSharpAndCommentsLexer
+from regex_lexer_camelcase import CSharpAndCommentsCamelcaseLexer
+from compiling_regex_lexers import get_compiled_lexer
+
+# Files of the analysed repos lexed by benchmark_compiled_lexers
+BENCHMARK_CORPUS_MAX_FILES = 500
+
+
+def time_function(func, *args, repeat=3):
+    """Returns the best wall-clock time in seconds out of `repeat` runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def match_diff_batches_to_diagnostics(diagnostics, all_added_lines, all_removed_lines, all_replaced_lines):
+    """
+        Previous implementation of unifying_raw_dataset.match_diff_actions_to_diagnostics, on the
+        diff batches of parse_hunk. The diff batches are indexed once (a dict of REPLACE source lines,
+        sorted REMOVE ranges for bisection and a dict of ADD PreviousSourceLocations), so matching
+        takes O((D + B) log B) instead of O(D x B).
+    """
+
+    replaced_line_to_batch = {}
+    for count, value in enumerate(all_replaced_lines):
+        for source_location in value["SourceLocations"]:
+            # First batch wins, as in a linear scan
+            if source_location not in replaced_line_to_batch:
+                replaced_line_to_batch[source_location] = count
+
+    removed_ranges = sorted([(value["SourceLocationStart"], value["SourceLocationEnd"], count)
+                             for count, value in enumerate(all_removed_lines)])
+    removed_range_starts = [removed_range[0] for removed_range in removed_ranges]
+
+    previous_line_to_add_batches = {}
+    for count, value in enumerate(all_added_lines):
+        if value["PreviousSourceLocation"] not in previous_line_to_add_batches:
+            previous_line_to_add_batches[value["PreviousSourceLocation"]] = []
+        previous_line_to_add_batches[value["PreviousSourceLocation"]].append(count)
+
+    add_batch_is_above_diagnostic_position = {}
+    diff_batch_to_diagnostics = {}
+    for diagnostic_occurance in diagnostics:
+        line = diagnostic_occurance["Line"]
+
+        diff_key = None
+        if line in replaced_line_to_batch:
+            diff_key = f"REPLACE-{replaced_line_to_batch[line]}"
+
+        if not diff_key:
+            # Last REMOVE range starting at or before the line
+            idx = bisect.bisect_right(removed_range_starts, line) - 1
+            if idx >= 0 and line <= removed_ranges[idx][1]:
+                diff_key = f"REMOVE-{removed_ranges[idx][2]}"
+
+        # Do added_lines last, since intuitively, finding deleted lines is easier; diagnostic
+        # will probably be inside one of the deleted/replaced lines?
+        # Adding lines on the other hand is evenly likely to happen before
+        # or after the diagnostic. Here we are prioritising ADD batches that happen above
+        # the diagnostics, unless these already have diagnostics above them.
+
+        if not diff_key:
+            # If added lines are above diagnostic
+            for count in previous_line_to_add_batches.get(line - 1, []):
+                diff_key = f"ADD-{count}"
+
+                # If a ADD diff batch already has diagnostics above it, then it more
+                # likely to find the correct diff batch underneath the current diagnostic.
+                if diff_key in add_batch_is_above_diagnostic_position:
+                    if not add_batch_is_above_diagnostic_position[diff_key]:
+                        diff_key = None
+                        continue
+                else:
+                    add_batch_is_above_diagnostic_position[diff_key] = True
+
+                break
+
+        if not diff_key and line in previous_line_to_add_batches:
+            # If added lines are beneath diagnostic
+            diff_key = f"ADD-{previous_line_to_add_batches[line][0]}"
+            add_batch_is_above_diagnostic_position[diff_key] = False
+
+        # Diagnostic occurance leads to no obvious diff batch
+        if not diff_key:
+            continue
+
+        if diff_key not in diff_batch_to_diagnostics:
+            diff_batch_to_diagnostics[diff_key] = []
+        diff_batch_to_diagnostics[diff_key].append(
+            diagnostic_occurance)
+
+    return diff_batch_to_diagnostics
+
+
+def benchmark_match_diff_batches_to_diagnostics(num_source_lines=20000, num_diagnostics=5000, seed=0):
+    """
+    Worst case of the unification: a large generated file with a rule like SA1101,
+    which fires on almost every line and is fixed in thousands of places.
+    """
+
+    rng = random.Random(seed)
+
+    all_replaced_lines = []
+    all_added_lines = []
+    all_removed_lines = []
+    for line in range(1, num_source_lines + 1, 5):
+        action = rng.random()
+        if action < 0.6:
+            all_replaced_lines.append({"SourceLocations": [line], "TargetLines": ["this.x\n"]})
+        elif action < 0.8:
+            all_removed_lines.append({"SourceLocationStart": line, "SourceLocationEnd": line + 1})
+        else:
+            all_added_lines.append(
+                {"PreviousSourceLocation": line, "TargetStartLocation": line + 1, "TargetLines": ["x\n"]})
+
+    diagnostics = [{"Message": "Prefix local calls with this", "Line": rng.randint(1, num_source_lines), "Character": 1}
+                   for _ in range(num_diagnostics)]
+
+    args = (diagnostics, all_added_lines, all_removed_lines, all_replaced_lines)
+    print(f"match_diff_batches_to_diagnostics: {num_diagnostics} diagnostics, "
+          f"{len(all_replaced_lines) + len(all_added_lines) + len(all_removed_lines)} diff batches")
+    indexed_seconds = time_function(match_diff_batches_to_diagnostics, *args)
+    print(f"    indexed: {indexed_seconds:.4f}s")
+
+    def match_with_diff_actions():
+        diff_actions = DiffActionArrays.from_batches(all_replaced_lines, all_added_lines, all_removed_lines)
+        diagnostic_lines = [diagnostic["Line"] for diagnostic in diagnostics]
+        matched_actions = match_diff_actions_to_diagnostics(diagnostic_lines, diff_actions)
+        compute_required_lines(diagnostic_lines, matched_actions, diff_actions)
+
+    columnar_seconds = time_function(match_with_diff_actions)
+    print(f"    columnar (incl. building arrays & required lines): {columnar_seconds:.4f}s "
+          f"({indexed_seconds / max(columnar_seconds, 1e-9):.1f}x)")
+
+
+def parse_diff_with_unidiff(diff_filepath):
+    for patched_file in PatchSet.from_filename(diff_filepath):
+        for hunk in patched_file:
+            parse_hunk(hunk)
+
+
+def parse_diff_streaming(diff_filepath):
+    for _ in iter_parsed_patched_files(diff_filepath):
+        pass
+
+
+def benchmark_parse_diff(num_patched_files=2000, seed=0):
+    """A whole-solution diff, generated from the C# files of this repository"""
+
+    rng = random.Random(seed)
+    source_filepaths = sorted(glob.glob("SourceCodeTokenizer/*.cs") + glob.glob("AssemblyAnalysis/*/*.cs"))
+    sources = []
+    for source_filepath in source_filepaths:
+        with open(source_filepath, encoding='utf-8-sig') as f:
+            sources.append(f.read().replace("\r\n", "\n").splitlines(keepends=True))
+
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix=".diff", delete=False) as f:
+        diff_filepath = f.name
+        for num in range(num_patched_files):
+            lines = sources[num % len(sources)]
+            f.write(git_diff_of_file(f"src/{num}/File.cs", lines, random_edit(rng, lines), 3))
+
+    print(f"Diff parsing: {num_patched_files} patched files, {os.path.getsize(diff_filepath) / 2**20:.1f} MB")
+    unidiff_seconds = time_function(parse_diff_with_unidiff, diff_filepath)
+    streaming_seconds = time_function(parse_diff_streaming, diff_filepath)
+    print(f"    unidiff + parse_hunk: {unidiff_seconds:.4f}s")
+    print(f"    streaming:            {streaming_seconds:.4f}s ({unidiff_seconds / max(streaming_seconds, 1e-9):.1f}x)")
+    os.remove(diff_filepath)
+
+
+def index_identifier_token_uncached(token_type, value, index_dict):
+    """Previous CSharpAndCommentsLexer.index_identifier_token, listing the Name types on every call"""
+
+    all_name_types = [Name] + [getattr(Name, attribute) for attribute in dir(
+        Name) if not attribute.startswith("_") and not attribute.islower()]
+    if token_type not in all_name_types:
+        return token_type, value
+
+    if value in index_dict:
+        return token_type, index_dict[value]
+
+    new_index_name = f"VAR-{len(index_dict.keys())}"
+    index_dict[value] = new_index_name
+    return token_type, new_index_name
+
+
+def detokenize(tokens):
+    special_tokens = {"WHITESPACE": " ", "NEWLINE": "\n", "TAB": "\t"}
+    return "".join([special_tokens.get(token, token) for token in tokens])
+
+
+def load_experiment_code(experiment_dir="experiment", max_datapoints=3000):
+    """
+    The messages and file contexts of the standard tokenized experiments, detokenized again,
+    as a stand-in for the code & messages tokenize_datapoint lexes in zero_index_vars mode
+    """
+    texts = []
+    for src_filepath in sorted(glob.glob(f"{experiment_dir}/*standard*/src-*.txt")):
+        with open(src_filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                message, _, file_content = line.rstrip("\n").partition(" FILE_CONTENT ")
+                texts.append(detokenize(message.split(" ")[3:]))
+                texts.append(detokenize(file_content.split(" ")))
+                if len(texts) >= 2 * max_datapoints:
+                    return texts
+    return texts
+
+
+def index_per_token(index_func, token_lists):
+    for tokens in token_lists:
+        index_dict = {}
+        [index_func(token[0], token[1], index_dict) for token in tokens]
+
+
+def index_batched(token_lists):
+    for tokens in token_lists:
+        CSharpAndCommentsLexer.index_identifier_tokens(tokens, {})
+
+
+def lex_and_index(lexer, texts):
+    for text in texts:
+        CSharpAndCommentsLexer.index_identifier_tokens(lexer.get_tokens(text), {})
+
+
+def benchmark_index_identifier_tokens(max_datapoints=3000):
+    """
+    Identifier indexing of the zero_index_vars tokenization, on the experiment corpus
+    """
+    texts = load_experiment_code(max_datapoints=max_datapoints)
+    if not texts:
+        print("Identifier indexing: no standard experiment in experiment/, skipped")
+        return
+    lexer = CSharpAndCommentsLexer()
+    token_lists = [list(lexer.get_tokens(text)) for text in texts]
+
+    # Same VAR-n remapping as before
+    for tokens in token_lists[:100]:
+        index_dict = {}
+        assert CSharpAndCommentsLexer.index_identifier_tokens(tokens, {}) == \
+            [index_identifier_token_uncached(token[0], token[1], index_dict) for token in tokens]
+
+    print(f"Identifier indexing: {len(texts)} messages & file contexts, {sum(map(len, token_lists))} tokens")
+    uncached_seconds = time_function(index_per_token, index_identifier_token_uncached, token_lists, repeat=1)
+    cached_seconds = time_function(index_per_token, CSharpAndCommentsLexer.index_identifier_token, token_lists)
+    batched_seconds = time_function(index_batched, token_lists)
+    print(f"    per token, dir(Name) per call: {uncached_seconds:.4f}s")
+    print(f"    per token, NAME_TOKEN_TYPES:   {cached_seconds:.4f}s ({uncached_seconds / max(cached_seconds, 1e-9):.1f}x)")
+    print(f"    batched:                       {batched_seconds:.4f}s ({uncached_seconds / max(batched_seconds, 1e-9):.1f}x)")
+    lexing_seconds = time_function(lex_and_index, lexer, texts, repeat=1)
+    print(f"    lexing + batched indexing:     {lexing_seconds:.4f}s")
+
+
+def lex_with_pygments(lexer_class, texts):
+    # A new lexer per text, as in the pipeline
+    for text in texts:
+        list(lexer_class().get_tokens(text))
+
+
+def lex_compiled(compiled_lexer, texts):
+    for text in texts:
+        compiled_lexer.get_tokens(text)
+
+
+def benchmark_compiled_lexers(seed=0):
+    """
+    Pygments RegexLexer vs the compiled lexers, on a sample of the analysed repos if they are
+    checked out, else on the C# files of this repo. Files on which the Pygments lexer loops
+    forever (the compiled lexer raises RuntimeError) are left out.
+    """
+    if glob.glob(os.path.join(ANALYZED_REPOS_DIR, "*", "*")):
+        texts = load_csharp_corpus(ANALYZED_REPOS_DIR, BENCHMARK_CORPUS_MAX_FILES, random.Random(seed))
+        corpus_name = ANALYZED_REPOS_DIR
+    else:
+        texts = load_csharp_corpus()
+        corpus_name = "this repo"
+    print(f"Compiled lexers: {len(texts)} C# files of {corpus_name}, {sum(map(len, texts))} characters")
+    for lexer_class in (CSharpAndCommentsLexer, CSharpAndCommentsCamelcaseLexer):
+        compiled_lexer = get_compiled_lexer(lexer_class)
+        lexed_texts = []
+        for text in texts:
+            try:
+                compiled_tokens = compiled_lexer.get_tokens(text)
+            except RuntimeError:
+                continue
+            assert compiled_tokens == list(lexer_class().get_tokens(text))
+            lexed_texts.append(text)
+        pygments_seconds = time_function(lex_with_pygments, lexer_class, lexed_texts)
+        compiled_seconds = time_function(lex_compiled, compiled_lexer, lexed_texts)
+        print(f"    {lexer_class.__name__} ({len(texts) - len(lexed_texts)} looping files left out): "
+              f"Pygments {pygments_seconds:.4f}s, compiled {compiled_seconds:.4f}s "
+              f"({pygments_seconds / max(compiled_seconds, 1e-9):.1f}x)")
+
+
+def lex_with_checkpoints(compiled_lexer, texts):
+    for text in texts:
+        compiled_lexer.get_tokens_and_checkpoints(text)
+
+
+def relex_all(compiled_lexer, lexed_texts, new_texts):
+    for (text, tokens, checkpoints), new_text in zip(lexed_texts, new_texts):
+        compiled_lexer.relex(text, tokens, checkpoints, new_text)
+
+
+def benchmark_relex(seed=0):
+    """Lexing a file with a few lines replaced (like a diff hunk) from scratch vs relexing it"""
+    rng = random.Random(seed)
+    texts = load_csharp_corpus()
+    new_texts = []
+    for text in texts:
+        lines = text.splitlines(keepends=True)
+        line_num = rng.randrange(len(lines))
+        lines[line_num:line_num + rng.randint(1, 3)] = ["    this.x = 0; // replaced\n"] * rng.randint(1, 3)
+        new_texts.append("".join(lines))
+
+    print(f"Relexing: {len(texts)} C# files, a few lines replaced in each")
+    for lexer_class in (CSharpAndCommentsLexer, CSharpAndCommentsCamelcaseLexer):
+        compiled_lexer = get_compiled_lexer(lexer_class)
+        lexed_texts = [(text,) + compiled_lexer.get_tokens_and_checkpoints(text) for text in texts]
+        for lexed_text, new_text in zip(lexed_texts, new_texts):
+            assert compiled_lexer.relex(*lexed_text, new_text) == compiled_lexer.get_tokens_and_checkpoints(new_text)
+        lex_seconds = time_function(lex_compiled, compiled_lexer, new_texts)
+        checkpoints_seconds = time_function(lex_with_checkpoints, compiled_lexer, new_texts)
+        relex_seconds = time_function(relex_all, compiled_lexer, lexed_texts, new_texts)
+        print(f"    {lexer_class.__name__}: lex {lex_seconds:.4f}s, with checkpoints {checkpoints_seconds:.4f}s, "
+              f"relex {relex_seconds:.4f}s ({lex_seconds / max(relex_seconds, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+
+    benchmark_match_diff_batches_to_diagnostics()
+    benchmark_parse_diff()
+    benchmark_index_identifier_tokens()
+    benchmark_compiled_lexers()
+    benchmark_relex()
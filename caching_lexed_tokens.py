@@ -0,0 +1,261 @@
+"""
+This file caches the tokens of lexed source code on disk, so that a file is lexed once
+instead of once per datapoint and tokenization config (e.g. 100_tokens__standard and
+115_tokens__standard lex the same files, and so do standard and zero_index_vars).
+
+Entries are keyed by the SHA-256 of the text, the lexer class, whether it was compiled and
+the version of the lexer, a hash of the Pygments version and the source of the lexer's modules
+(and of compiling_regex_lexers.py for the compiled lexers), so that changing a lexer or the
+compiler invalidates its entries. An entry stores the distinct (token type, value) pairs of the
+text, plus the token ids and line offsets (index of the first token of each line) as zlib
+compressed arrays. Texts lexed by a compiled lexer also have its checkpoints, so that another
+version of the text (e.g. with a diff applied) is relexed from the cached tokens.
+
+All entries are in one SQLite database, shared by the worker processes and by later runs of
+tokenizing_unified_dataset.py. Once the entries are larger than the size cap in total, the
+least recently used ones are evicted.
+
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import inspect
+from array import array
+from collections import namedtuple
+import pygments
+from pygments.token import string_to_tokentype
+from compiling_regex_lexers import CompiledRegexLexer, Checkpoint
+
+
+# Increase whenever the tables or the encoding of the tokens change, forces the cache to be recreated
+CACHE_SCHEMA_VERSION = 3
+
+# Summing up the size is a scan of the table, so it's only checked every few insertions
+EVICTION_CHECK_INTERVAL = 64
+# Evicts down to this fraction of the size cap, instead of evicting again on the next check
+EVICTION_TARGET = 0.9
+# LastUsed of a cache hit is only written if it's older than this, most hits don't write
+LAST_USED_RESOLUTION_SECONDS = 60
+
+# Token ids, line offsets & checkpoints
+ARRAY_TYPECODE = 'I'
+
+# Tokens as returned by lexer.get_tokens(text), LineOffsets as by get_line_offsets(tokens),
+# Checkpoints as by CompiledRegexLexer.get_tokens_and_checkpoints(text) (None for other lexers)
+LexedText = namedtuple("LexedText", ["Tokens", "LineOffsets", "Checkpoints"])
+
+lexer_versions = {}
+token_caches = {}
+
+
+def get_lexer_version(lexer_class, compiled=False):
+    """
+    Hash of the Pygments version and the source of the modules of the lexer class and its (non-Pygments) bases,
+    and of the module of CompiledRegexLexer if compiled
+    """
+
+    if (lexer_class, compiled) not in lexer_versions:
+        sha256 = hashlib.sha256(pygments.__version__.encode('utf-8'))
+        module_names = sorted(set([cls.__module__ for cls in lexer_class.__mro__]))
+        if compiled:
+            module_names.append(CompiledRegexLexer.__module__)
+        for module_name in module_names:
+            if module_name != "builtins" and not module_name.startswith("pygments"):
+                sha256.update(inspect.getsource(sys.modules[module_name]).encode('utf-8'))
+        lexer_versions[(lexer_class, compiled)] = sha256.hexdigest()
+    return lexer_versions[(lexer_class, compiled)]
+
+
+def get_lexer_name(lexer_class, compiled=False):
+    return f"{lexer_class.__module__}.{lexer_class.__qualname__}" + (" (compiled)" if compiled else "")
+
+
+def get_line_offsets(tokens):
+    """Index of the first token of every line, the lines of Pipeline.split_tokens_by_line"""
+    return [0] + [idx + 1 for idx, (_, value) in enumerate(tokens) if value == "NEWLINE"]
+
+
+def lex_text(lexer, text, previous=None):
+    """
+    LexedText of lexer.get_tokens(text). A compiled lexer relexes only the changed part of the text
+    if previous, the (text, LexedText) of another version of it, has checkpoints.
+    """
+
+    if not isinstance(lexer, CompiledRegexLexer):
+        tokens = list(lexer.get_tokens(text))
+        return LexedText(tokens, get_line_offsets(tokens), None)
+
+    if previous is not None and previous[1].Checkpoints is not None:
+        previous_text, (previous_tokens, _, previous_checkpoints) = previous
+        tokens, checkpoints = lexer.relex(previous_text, previous_tokens, previous_checkpoints, text)
+    else:
+        tokens, checkpoints = lexer.get_tokens_and_checkpoints(text)
+    return LexedText(tokens, get_line_offsets(tokens), checkpoints)
+
+
+def encode_array(values):
+    return zlib.compress(array(ARRAY_TYPECODE, values).tobytes())
+
+
+def decode_array(encoded_values):
+    values = array(ARRAY_TYPECODE)
+    values.frombytes(zlib.decompress(encoded_values))
+    return values
+
+
+def encode_tokens(tokens, line_offsets, checkpoints):
+    token_ids = {}
+    ids = [token_ids.setdefault(token, len(token_ids)) for token in tokens]
+    vocabulary = [[str(token_type), value] for token_type, value in token_ids]
+    return (zlib.compress(json.dumps(vocabulary, ensure_ascii=False).encode('utf-8')),
+            encode_array(ids),
+            encode_array(line_offsets),
+            None if checkpoints is None else encode_array([value for checkpoint in checkpoints for value in checkpoint]))
+
+
+def decode_tokens(encoded_vocabulary, encoded_token_ids, encoded_line_offsets, encoded_checkpoints):
+    vocabulary = [(string_to_tokentype(token_type), value)
+                  for token_type, value in json.loads(zlib.decompress(encoded_vocabulary).decode('utf-8'))]
+    checkpoints = None
+    if encoded_checkpoints is not None:
+        values = decode_array(encoded_checkpoints)
+        checkpoints = list(map(Checkpoint, values[::2], values[1::2]))
+    return LexedText(list(map(vocabulary.__getitem__, decode_array(encoded_token_ids))),
+                     decode_array(encoded_line_offsets).tolist(), checkpoints)
+
+
+class TokenCache:
+
+    def __init__(self, cache_path, max_bytes):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.num_insertions = 0
+
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Transactions are explicit, several processes use the cache at the same time
+        self.connection = sqlite3.connect(cache_path, timeout=60, isolation_level=None)
+        # Readers and the writer don't block each other
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        if self.get_schema_version() != CACHE_SCHEMA_VERSION:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process might have created the tables in the meantime
+                if self.get_schema_version() != CACHE_SCHEMA_VERSION:
+                    self.create_tables()
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def get_schema_version(self):
+        try:
+            schema_version = self.connection.execute(
+                "SELECT Value FROM metadata WHERE Key = 'SchemaVersion'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return None if schema_version is None else int(schema_version[0])
+
+    def create_tables(self):
+        for table in ("metadata", "tokens"):
+            self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        self.connection.execute("CREATE TABLE metadata (Key TEXT PRIMARY KEY, Value TEXT)")
+        self.connection.execute(
+            "CREATE TABLE tokens (ContentHash TEXT, Lexer TEXT, LexerVersion TEXT, Vocabulary BLOB, TokenIds BLOB, "
+            "LineOffsets BLOB, Checkpoints BLOB, Size INTEGER, LastUsed REAL, "
+            "PRIMARY KEY (ContentHash, Lexer, LexerVersion))")
+        self.connection.execute("CREATE INDEX tokens_last_used ON tokens (LastUsed)")
+        self.connection.execute("INSERT INTO metadata VALUES (?, ?)", ("SchemaVersion", str(CACHE_SCHEMA_VERSION)))
+
+    @staticmethod
+    def get_key(lexer_class, text, compiled=False):
+        return (hashlib.sha256(text.encode('utf-8')).hexdigest(), get_lexer_name(lexer_class, compiled),
+                get_lexer_version(lexer_class, compiled))
+
+    def get(self, lexer_class, text, compiled=False):
+        """
+        The cached LexedText, None if the text was not lexed by (this version of) the lexer class yet,
+        or by its compiled version if compiled
+        """
+
+        key = TokenCache.get_key(lexer_class, text, compiled)
+        row = self.connection.execute(
+            "SELECT Vocabulary, TokenIds, LineOffsets, Checkpoints, LastUsed FROM tokens "
+            "WHERE ContentHash = ? AND Lexer = ? AND LexerVersion = ?", key).fetchone()
+        if row is None:
+            return None
+
+        now = time.time()
+        if now - row[4] > LAST_USED_RESOLUTION_SECONDS:
+            self.connection.execute(
+                "UPDATE tokens SET LastUsed = ? WHERE ContentHash = ? AND Lexer = ? AND LexerVersion = ?", (now,) + key)
+        return decode_tokens(*row[:4])
+
+    def put(self, lexer_class, text, lexed_text, compiled=False):
+        encoded = encode_tokens(*lexed_text)
+        self.connection.execute("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                TokenCache.get_key(lexer_class, text, compiled) + encoded +
+                                (sum([len(blob) for blob in encoded if blob is not None]), time.time()))
+
+        self.num_insertions += 1
+        if self.num_insertions % EVICTION_CHECK_INTERVAL == 0:
+            self.evict()
+
+    def lex(self, lexer, lexer_class, text, previous=None):
+        """
+        LexedText of lexer.get_tokens(text), only lexed if it's not cached (see lex_text for previous).
+        The lexer can be an instance of the lexer class or its compiled version (see compiling_regex_lexers.py),
+        which have separate entries.
+        """
+
+        compiled = isinstance(lexer, CompiledRegexLexer)
+        lexed_text = self.get(lexer_class, text, compiled)
+        if lexed_text is None:
+            lexed_text = lex_text(lexer, text, previous)
+            self.put(lexer_class, text, lexed_text, compiled)
+        return lexed_text
+
+    def get_size(self):
+        return int(self.connection.execute("SELECT total(Size) FROM tokens").fetchone()[0])
+
+    def evict(self):
+        """Least recently used entries, if the cache is larger than max_bytes"""
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            size = self.get_size()
+            if size > self.max_bytes:
+                num_bytes_to_evict = size - self.max_bytes * EVICTION_TARGET
+                keys_to_evict = []
+                for row in self.connection.execute(
+                        "SELECT ContentHash, Lexer, LexerVersion, Size FROM tokens ORDER BY LastUsed"):
+                    if num_bytes_to_evict <= 0:
+                        break
+                    keys_to_evict.append(row[:3])
+                    num_bytes_to_evict -= row[3]
+                self.connection.executemany(
+                    "DELETE FROM tokens WHERE ContentHash = ? AND Lexer = ? AND LexerVersion = ?", keys_to_evict)
+                print(f"Evicted {len(keys_to_evict)} entries from the token cache {self.cache_path}")
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.connection.close()
+
+
+def get_token_cache(cache_path, max_bytes):
+    """One TokenCache per process, connections are not shared with forked worker processes"""
+
+    key = (cache_path, max_bytes, os.getpid())
+    if key not in token_caches:
+        token_caches[key] = TokenCache(cache_path, max_bytes)
+    return token_caches[key]
@@ -0,0 +1,90 @@
+import unittest
+import time
+import tempfile
+from regex_lexer import CSharpAndCommentsLexer, LanguageLexer
+from regex_lexer_camelcase import CSharpAndCommentsCamelcaseLexer
+from compiling_regex_lexers import get_compiled_lexer
+from generating_synthetic_inputs import load_csharp_corpus
+from caching_lexed_tokens import TokenCache, LexedText, get_line_offsets, lex_text, get_lexer_version
+
+
+class TestCachingLexedTokens(unittest.TestCase):
+
+    def test_cached_tokens(self):
+        code = load_csharp_corpus()[0]
+        tokens = list(CSharpAndCommentsLexer().get_tokens(code))
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TokenCache(f"{cache_dir}/cache/token_cache.sqlite", max_bytes=2**30)
+            self.assertIsNone(cache.get(CSharpAndCommentsLexer, code))
+            # Lexed, then loaded from the cache
+            for _ in range(2):
+                lexed_text = cache.lex(CSharpAndCommentsLexer(), CSharpAndCommentsLexer, code)
+                self.assertEqual(lexed_text, LexedText(tokens, get_line_offsets(tokens), None))
+                self.assertTrue(all([cached[0] is token[0] for cached, token in zip(lexed_text.Tokens, tokens)]))
+            self.assertEqual(len(lexed_text.LineOffsets), code.count("\n") + 1)
+
+            # The compiled lexer has its own entries, with checkpoints
+            self.assertIsNone(cache.get(CSharpAndCommentsLexer, code, compiled=True))
+            compiled_lexed_text = cache.lex(get_compiled_lexer(CSharpAndCommentsLexer), CSharpAndCommentsLexer, code)
+            self.assertEqual(compiled_lexed_text.Tokens, tokens)
+            self.assertIsNotNone(compiled_lexed_text.Checkpoints)
+            self.assertEqual(cache.get(CSharpAndCommentsLexer, code, compiled=True), compiled_lexed_text)
+            self.assertEqual(cache.get(CSharpAndCommentsLexer, code), lexed_text)
+
+            # Other lexers & texts are not
+            self.assertIsNone(cache.get(CSharpAndCommentsCamelcaseLexer, code))
+            self.assertIsNone(cache.get(CSharpAndCommentsLexer, code + " "))
+            cache.close()
+
+            # Shared with the next run
+            cache = TokenCache(f"{cache_dir}/cache/token_cache.sqlite", max_bytes=2**30)
+            self.assertEqual(cache.get(CSharpAndCommentsLexer, code).Tokens, tokens)
+            cache.close()
+
+    def test_relex_cached_tokens(self):
+        code = load_csharp_corpus()[0]
+        diffed_code = code.replace("\n", "\n/* added */ int x = 1;\n", 1)
+        compiled_lexer = get_compiled_lexer(CSharpAndCommentsLexer)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TokenCache(f"{cache_dir}/token_cache.sqlite", max_bytes=2**30)
+            lexed_text = cache.lex(compiled_lexer, CSharpAndCommentsLexer, code)
+            self.assertEqual(cache.get(CSharpAndCommentsLexer, code, compiled=True), lexed_text)
+            self.assertGreater(len(lexed_text.Checkpoints), 1)
+
+            diffed_lexed_text = cache.lex(compiled_lexer, CSharpAndCommentsLexer, diffed_code, (code, lexed_text))
+            self.assertEqual(diffed_lexed_text, lex_text(compiled_lexer, diffed_code))
+            self.assertEqual(diffed_lexed_text.Tokens, list(CSharpAndCommentsLexer().get_tokens(diffed_code)))
+            cache.close()
+
+    def test_lexer_version(self):
+        # The compiled lexers also change with compiling_regex_lexers.py
+        self.assertNotEqual(get_lexer_version(CSharpAndCommentsLexer),
+                            get_lexer_version(CSharpAndCommentsLexer, compiled=True))
+        self.assertNotEqual(TokenCache.get_key(CSharpAndCommentsLexer, "x")[1],
+                            TokenCache.get_key(CSharpAndCommentsLexer, "x", compiled=True)[1])
+
+    def test_evict_least_recently_used(self):
+        texts = [f"'message{i}' is never used" for i in range(4)]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TokenCache(f"{cache_dir}/token_cache.sqlite", max_bytes=2**30)
+            for text in texts:
+                cache.lex(LanguageLexer(), LanguageLexer, text)
+            # Used some minutes ago, in order
+            for i, text in enumerate(texts):
+                cache.connection.execute("UPDATE tokens SET LastUsed = ? WHERE ContentHash = ?",
+                                         (time.time() - 600 + i, TokenCache.get_key(LanguageLexer, text)[0]))
+            cache.get(LanguageLexer, texts[0])
+
+            # Down to 90% of the size cap
+            cache.max_bytes = cache.get_size() * 0.8
+            cache.evict()
+            self.assertEqual([cache.get(LanguageLexer, text) is not None for text in texts], [True, False, False, True])
+            self.assertLessEqual(cache.get_size(), cache.max_bytes)
+            cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
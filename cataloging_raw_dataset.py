@@ -0,0 +1,241 @@
+"""
+This file catalogs the raw dataset. The filenames of all diffs and analysis files are
+parsed once into a table, so that diffs and analysis files can be joined by key instead
+of comparing every filename with every other filename.
+
+The catalog is persisted as SQLite, so that later stages can query it as well, and
+reused as long as the raw dataset directories look unchanged (see load_or_build_catalog).
+
+Raw dataset files may be compressed (see compressing_raw_dataset.py). Filename is the
+name on disk, the other columns are parsed from the name without compression extension.
+
+"""
+
+import os
+import csv
+import json
+import sqlite3
+from collections import namedtuple
+from compressing_raw_dataset import get_compression_extension, strip_compression_extension
+
+
+# Increase whenever the tables change, forces the catalog to be rebuilt
+CATALOG_SCHEMA_VERSION = 1
+
+# $ANALYSIS_FILEPATH = "${Using:REPO_NAME}__${SOLUTION_FILENAME}__${Using:LAST_COMMIT}__${NUGET_FULL_NAME}.xml"
+AnalysisFileEntry = namedtuple("AnalysisFileEntry", [
+    "Filename", "Repo", "SolutionFile", "Commit", "AnalyzerNuGet", "Size"])
+
+# $DIFF_FILENAME = "${OUTPUT_FILENAME}__${DIAGNOSTIC_ID}.diff"
+DiffFileEntry = namedtuple("DiffFileEntry", [
+    "Filename", "Repo", "SolutionFile", "Commit", "AnalyzerNuGet", "DiagnosticID", "Size"])
+
+RepoEntry = namedtuple("RepoEntry", ["RepoName", "RepoURL"])
+
+
+def scan_raw_dataset_dir(raw_dataset_dir, extension, num_name_parts):
+    """
+    Yields (filename, name_parts, size) of all files with a valid raw dataset filename,
+    compressed or not. If a file exists both compressed and uncompressed (e.g. while
+    converting), the uncompressed one is used.
+    """
+
+    scanned_files = {}
+    for f in os.scandir(raw_dataset_dir):
+        uncompressed_name = strip_compression_extension(f.name)
+        if not f.is_file() or not uncompressed_name.endswith(extension):
+            continue
+
+        name_parts = uncompressed_name[:-len(extension)].split("__")
+        if len(name_parts) != num_name_parts:
+            print(f"Unexpected filename in raw dataset: {f.name}")
+            continue
+
+        if uncompressed_name in scanned_files:
+            print(f"Raw dataset file exists compressed & uncompressed: {uncompressed_name}")
+            if get_compression_extension(f.name) != "":
+                continue
+        scanned_files[uncompressed_name] = (f.name, name_parts, f.stat().st_size)
+
+    yield from scanned_files.values()
+
+
+def get_raw_dataset_fingerprint(diff_dir, analysis_dir, repos_csv):
+    """
+    Changes when files are added to, removed from or renamed in the directories, or github_repos.csv
+    changes. Listing the directories doesn't stat nor parse their files, unlike scanning them.
+    """
+    directory_fingerprints = [(os.stat(directory).st_mtime_ns, len(os.listdir(directory)))
+                              for directory in (diff_dir, analysis_dir)]
+    repos_csv_stat = os.stat(repos_csv)
+    return json.dumps(directory_fingerprints + [(repos_csv_stat.st_mtime_ns, repos_csv_stat.st_size)])
+
+
+class RawDatasetCatalog:
+
+    def __init__(self, analysis_files, diff_files, repos, fingerprint=None):
+        self.analysis_files = sorted(analysis_files)
+        self.diff_files = sorted(diff_files)
+        self.repos = {repo.RepoName: repo for repo in repos}
+        # Of the raw dataset when it was scanned, see get_raw_dataset_fingerprint
+        self.fingerprint = fingerprint
+
+        self.analysis_files_by_key = {}
+        for analysis_file in self.analysis_files:
+            key = (analysis_file.Repo, analysis_file.SolutionFile,
+                   analysis_file.AnalyzerNuGet)
+            if key not in self.analysis_files_by_key:
+                self.analysis_files_by_key[key] = []
+            self.analysis_files_by_key[key].append(analysis_file)
+
+    @staticmethod
+    def from_raw_dataset(diff_dir, analysis_dir, repos_csv):
+
+        # Before scanning, so that changes while scanning show up next time
+        fingerprint = get_raw_dataset_fingerprint(diff_dir, analysis_dir, repos_csv)
+        analysis_files = [AnalysisFileEntry(filename, *name_parts, size)
+                          for filename, name_parts, size in scan_raw_dataset_dir(analysis_dir, ".xml", 4)]
+        diff_files = [DiffFileEntry(filename, *name_parts, size)
+                      for filename, name_parts, size in scan_raw_dataset_dir(diff_dir, ".diff", 5)]
+
+        with open(repos_csv, newline='') as f:
+            repos = [RepoEntry(row["RepoName"], row["RepoURL"])
+                     for row in csv.DictReader(f)]
+
+        return RawDatasetCatalog(analysis_files, diff_files, repos, fingerprint)
+
+    def get_analysis_file_for_diff(self, diff_file):
+        """
+        Prefers the analysis file of the same commit; otherwise LAST_COMMIT is disregarded,
+        as it always has been.
+        """
+        analysis_files_for_diff = self.analysis_files_by_key.get(
+            (diff_file.Repo, diff_file.SolutionFile, diff_file.AnalyzerNuGet), [])
+        if len(analysis_files_for_diff) == 0:
+            print(f"No analysis_file_for_diff! diff_file: {diff_file.Filename}")
+            return None
+
+        if len(analysis_files_for_diff) != 1:
+            print(
+                f"More than one analysis_file_for_diff! diff_file: {diff_file.Filename}")
+            for analysis_file in analysis_files_for_diff:
+                if analysis_file.Commit == diff_file.Commit:
+                    return analysis_file
+
+        return analysis_files_for_diff[0]
+
+    def group_diff_files_by_analysis_file(self):
+        """
+        One group per analysis file, i.e. per (repo, solution, nuget):
+        [(AnalysisFileEntry, [DiffFileEntry, ...]), ...], sorted for a deterministic order.
+        """
+        diff_file_groups = {}
+        for diff_file in self.diff_files:
+            analysis_file = self.get_analysis_file_for_diff(diff_file)
+            if analysis_file is None:
+                continue
+            if analysis_file not in diff_file_groups:
+                diff_file_groups[analysis_file] = []
+            diff_file_groups[analysis_file].append(diff_file)
+
+        return sorted(diff_file_groups.items())
+
+    def get_repo_urls(self):
+        return {repo_name: repo.RepoURL for repo_name, repo in self.repos.items()}
+
+    def save(self, catalog_path):
+
+        tmp_catalog_path = f"{catalog_path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_catalog_path):
+            os.remove(tmp_catalog_path)
+
+        connection = sqlite3.connect(tmp_catalog_path)
+        with connection:
+            connection.execute("CREATE TABLE metadata (Key TEXT PRIMARY KEY, Value TEXT)")
+            connection.execute(
+                "CREATE TABLE analysis_files (Filename TEXT PRIMARY KEY, Repo TEXT, SolutionFile TEXT, "
+                "\"Commit\" TEXT, AnalyzerNuGet TEXT, Size INTEGER)")
+            connection.execute(
+                "CREATE TABLE diff_files (Filename TEXT PRIMARY KEY, Repo TEXT, SolutionFile TEXT, "
+                "\"Commit\" TEXT, AnalyzerNuGet TEXT, DiagnosticID TEXT, Size INTEGER)")
+            connection.execute("CREATE TABLE repos (RepoName TEXT PRIMARY KEY, RepoURL TEXT)")
+            connection.execute(
+                "CREATE INDEX analysis_files_key ON analysis_files (Repo, SolutionFile, AnalyzerNuGet)")
+            connection.execute(
+                "CREATE INDEX diff_files_key ON diff_files (Repo, SolutionFile, AnalyzerNuGet)")
+
+            connection.execute("INSERT INTO metadata VALUES (?, ?)",
+                               ("SchemaVersion", str(CATALOG_SCHEMA_VERSION)))
+            if self.fingerprint is not None:
+                connection.execute("INSERT INTO metadata VALUES (?, ?)", ("Fingerprint", self.fingerprint))
+            connection.executemany(
+                "INSERT INTO analysis_files VALUES (?, ?, ?, ?, ?, ?)", self.analysis_files)
+            connection.executemany(
+                "INSERT INTO diff_files VALUES (?, ?, ?, ?, ?, ?, ?)", self.diff_files)
+            connection.executemany(
+                "INSERT OR REPLACE INTO repos VALUES (?, ?)", self.repos.values())
+        connection.close()
+
+        os.replace(tmp_catalog_path, catalog_path)
+
+    @staticmethod
+    def load(catalog_path):
+        """Returns None if there is no catalog of the current CATALOG_SCHEMA_VERSION"""
+
+        if not os.path.isfile(catalog_path):
+            return None
+
+        connection = sqlite3.connect(catalog_path)
+        try:
+            schema_version = connection.execute(
+                "SELECT Value FROM metadata WHERE Key = 'SchemaVersion'").fetchone()
+            if schema_version is None or int(schema_version[0]) != CATALOG_SCHEMA_VERSION:
+                return None
+            fingerprint = connection.execute(
+                "SELECT Value FROM metadata WHERE Key = 'Fingerprint'").fetchone()
+
+            analysis_files = [AnalysisFileEntry(*row) for row in connection.execute(
+                "SELECT * FROM analysis_files")]
+            diff_files = [DiffFileEntry(*row) for row in connection.execute(
+                "SELECT * FROM diff_files")]
+            repos = [RepoEntry(*row) for row in connection.execute(
+                "SELECT * FROM repos")]
+        except sqlite3.DatabaseError:
+            return None
+        finally:
+            connection.close()
+
+        return RawDatasetCatalog(analysis_files, diff_files, repos, fingerprint and fingerprint[0])
+
+
+def load_or_build_catalog(diff_dir, analysis_dir, repos_csv, catalog_path, rescan=False):
+    """
+    Returns the saved catalog if the raw dataset's fingerprint didn't change since it was scanned.
+    Otherwise, or if `rescan`, scans the raw dataset, and rewrites the catalog if it differs from the
+    saved one. Directory mtimes don't change when a file is rewritten in place, so the Size of
+    rewritten files is only updated by a rescan.
+    """
+
+    saved_catalog = RawDatasetCatalog.load(catalog_path)
+    if not rescan and saved_catalog is not None and saved_catalog.fingerprint is not None and \
+            saved_catalog.fingerprint == get_raw_dataset_fingerprint(diff_dir, analysis_dir, repos_csv):
+        return saved_catalog
+
+    catalog = RawDatasetCatalog.from_raw_dataset(diff_dir, analysis_dir, repos_csv)
+    saved_catalog = RawDatasetCatalog.load(catalog_path)
+    if saved_catalog is None or (saved_catalog.analysis_files, saved_catalog.diff_files, saved_catalog.repos,
+                                 saved_catalog.fingerprint) != \
+            (catalog.analysis_files, catalog.diff_files, catalog.repos, catalog.fingerprint):
+        print(f"Writing raw dataset catalog {catalog_path}")
+        catalog.save(catalog_path)
+    return catalog
+
+
+if __name__ == "__main__":
+
+    catalog = load_or_build_catalog(
+        "raw_dataset/diffs", "raw_dataset/analysis_files", "github_repos.csv", "raw_dataset/catalog.sqlite",
+        rescan=True)
+    print(f"Num analysis files: {len(catalog.analysis_files)}")
+    print(f"Num diff files: {len(catalog.diff_files)}")
+    print(f"Num repos: {len(catalog.repos)}")
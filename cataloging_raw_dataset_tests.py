@@ -0,0 +1,92 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from cataloging_raw_dataset import RawDatasetCatalog, load_or_build_catalog
+
+
+def write_file(filepath, content):
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+class TestCatalogingRawDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.diff_dir = f"{self.tmp_dir.name}/diffs"
+        self.analysis_dir = f"{self.tmp_dir.name}/analysis_files"
+        self.repos_csv = f"{self.tmp_dir.name}/github_repos.csv"
+        self.catalog_path = f"{self.tmp_dir.name}/catalog.sqlite"
+        os.makedirs(self.diff_dir)
+        os.makedirs(self.analysis_dir)
+        write_file(self.repos_csv, "RepoName,RepoURL\nacat,https://github.com/a/acat\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build_catalog(self, rescan=False):
+        return load_or_build_catalog(self.diff_dir, self.analysis_dir, self.repos_csv, self.catalog_path, rescan)
+
+    def test_group_diff_files_by_analysis_file(self):
+        for name in ("acat__Acat.sln__abc123__Nuget.1.0", "acat__Acat.sln__def456__Nuget.1.0",
+                     "acat__Acat.sln__abc123__Other.2.0"):
+            write_file(f"{self.analysis_dir}/{name}.xml", "<Roslynator />")
+        for name in ("acat__Acat.sln__def456__Nuget.1.0__SA1101", "acat__Acat.sln__abc123__Nuget.1.0__SA1101",
+                     "acat__Acat.sln__abc123__Other.2.0__RCS1001", "acat__Acat.sln__fff000__Other.2.0__RCS1002",
+                     "acat__Missing.sln__abc123__Nuget.1.0__SA1101"):
+            write_file(f"{self.diff_dir}/{name}.diff", "")
+        write_file(f"{self.diff_dir}/not_a_raw_dataset_file.diff", "")
+
+        groups = self.build_catalog().group_diff_files_by_analysis_file()
+        self.assertEqual([(analysis_file.Filename, [diff_file.Filename for diff_file in diff_files])
+                          for analysis_file, diff_files in groups], [
+            # The analysis file of the same commit
+            ("acat__Acat.sln__abc123__Nuget.1.0.xml", ["acat__Acat.sln__abc123__Nuget.1.0__SA1101.diff"]),
+            # The only one of the (repo, solution, nuget), whatever its commit
+            ("acat__Acat.sln__abc123__Other.2.0.xml", ["acat__Acat.sln__abc123__Other.2.0__RCS1001.diff",
+                                                       "acat__Acat.sln__fff000__Other.2.0__RCS1002.diff"]),
+            ("acat__Acat.sln__def456__Nuget.1.0.xml", ["acat__Acat.sln__def456__Nuget.1.0__SA1101.diff"])])
+
+    def test_rebuild_stale_catalog(self):
+        analysis_filepath = f"{self.analysis_dir}/acat__Acat.sln__abc123__Nuget.1.0.xml"
+        diff_filepath = f"{self.diff_dir}/acat__Acat.sln__abc123__Nuget.1.0__SA1101.diff"
+        write_file(analysis_filepath, "<Roslynator />")
+        write_file(diff_filepath, "")
+        self.build_catalog()
+        self.assertEqual(RawDatasetCatalog.load(self.catalog_path).diff_files[0].Size, 0)
+
+        # Rewritten in place, the directory mtimes don't change: only a rescan notices
+        directory_stats = [os.stat(path) for path in (self.diff_dir, self.analysis_dir)]
+        write_file(diff_filepath, "diff --git a/A.cs b/A.cs\n")
+        for path, stat in zip((self.diff_dir, self.analysis_dir), directory_stats):
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(self.build_catalog().diff_files[0].Size, 0)
+        catalog = self.build_catalog(rescan=True)
+        self.assertEqual(catalog.diff_files[0].Size, os.stat(diff_filepath).st_size)
+        self.assertEqual(RawDatasetCatalog.load(self.catalog_path).diff_files, catalog.diff_files)
+
+        # Added files & repos
+        write_file(f"{self.diff_dir}/acat__Acat.sln__abc123__Nuget.1.0__SA1102.diff", "")
+        write_file(self.repos_csv, "RepoName,RepoURL\nacat,https://github.com/a/acat\nbcat,https://github.com/b/bcat\n")
+        self.build_catalog()
+        saved_catalog = RawDatasetCatalog.load(self.catalog_path)
+        self.assertEqual(len(saved_catalog.diff_files), 2)
+        self.assertEqual(sorted(saved_catalog.get_repo_urls()), ["acat", "bcat"])
+
+        # Neither rescanned nor rewritten if nothing changed
+        catalog_mtime = os.stat(self.catalog_path).st_mtime_ns
+        os.utime(self.catalog_path, ns=(catalog_mtime - 10**9, catalog_mtime - 10**9))
+        with mock.patch.object(RawDatasetCatalog, "from_raw_dataset") as from_raw_dataset:
+            self.assertEqual(len(self.build_catalog().diff_files), 2)
+        from_raw_dataset.assert_not_called()
+        self.build_catalog(rescan=True)
+        self.assertEqual(os.stat(self.catalog_path).st_mtime_ns, catalog_mtime - 10**9)
+
+        # Removed files, the entry count changes even within the directory mtime resolution
+        os.remove(diff_filepath)
+        self.assertEqual(len(self.build_catalog().diff_files), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
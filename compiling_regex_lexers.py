@@ -0,0 +1,864 @@
+"""
+This file compiles the Pygments lexers of regex_lexer.py and regex_lexer_camelcase.py into
+a faster backend, which emits exactly the same (token_type, value) stream.
+
+Pygments' RegexLexer tries the regexes of the current state one after another at every
+position, and creates a new lexer instance for every using(...), i.e. every comment and
+string. Here, the regexes of each state are joined into one master regex,
+"(rule 1)|(rule 2)|...", so that the regex engine tries them in the same order in a single
+call, and `match.lastindex` tells which rule matched. Since most rules can only start with a
+few characters (e.g. operators, keywords), each state has one master regex per first
+character, with only the rules that can start with it. If that is a single rule matching
+only this one character (e.g. whitespace, most punctuation), its token is emitted without
+any regex, for a whole run of such characters at once. using(...) lexes the group with the
+compiled version of the other lexer, without creating a lexer.
+
+The rules are read from the lexer itself (its processed `_tokens`), so changes to the lexers
+are picked up automatically. Only plain token types, bygroups(...) and using(...) are
+supported as actions, which is everything these lexers use.
+
+While lexing, checkpoints can be recorded: the starts of lines where the lexer is in the root
+state (i.e. outside of strings and comments), before which no match attempt examined any
+character at or after the checkpoint. The tokens before a checkpoint can't change when the
+text after it is edited, so `relex` lexes an edited text from the last checkpoint before the
+edit, until it reaches a checkpoint after the edit that was also one before (the rest of the
+tokens are the same again). How far a match attempt examines the text is bounded from the
+rules, see get_rule_reach: most rules never look beyond the end of their line, the others
+(e.g. strings, block comments) are bounded by the characters they can match or by their end.
+
+The rules are analysed on the parse trees of the re module's private parser (sre_parse), and
+the actions on the closures of Pygments' callbacks. Both can change between releases, so the
+lexers are only compiled on the Python and Pygments versions that compiling_regex_lexers_tests.py
+was run on (see get_lexer), and the Pygments lexers are used on any other version.
+
+"""
+
+import re
+import sys
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+import pygments
+from pygments.lexer import RegexLexer, this
+from pygments.token import Text, Error, _TokenType
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # Before Python 3.11
+    import sre_parse
+
+
+# Same replacement as UnprocessedTokensMixin
+FORMATTING_TOKENS = {" ": "WHITESPACE", "\n": "NEWLINE", "\t": "TAB"}
+
+TOKEN_ACTION, GROUPS_ACTION, USING_ACTION = range(3)
+
+# How far a match attempt of a rule can examine the text (besides the rest of its line), see get_rule_reach
+WIDTH_REACH, RUN_REACH, GREEDY_SCAN_REACH, LAZY_SCAN_REACH, UNKNOWN_REACH = range(5)
+
+ZERO_WIDTH_OPS = (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+REPEAT_OPS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None))
+SINGLE_CHARACTER_OPS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+# Zero-width assertions that look at the previous character, and the ones that look at the next one
+LOOKBEHIND_AT_CODES = (sre_parse.AT_BEGINNING, sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY)
+LOOKAHEAD_AT_CODES = (sre_parse.AT_END, sre_parse.AT_END_STRING, sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY)
+CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: r"\d", sre_parse.CATEGORY_NOT_DIGIT: r"\D",
+    sre_parse.CATEGORY_SPACE: r"\s", sre_parse.CATEGORY_NOT_SPACE: r"\S",
+    sre_parse.CATEGORY_WORD: r"\w", sre_parse.CATEGORY_NOT_WORD: r"\W",
+}
+
+
+class _EmptyRegexLexer(RegexLexer):
+    tokens = {'root': []}
+
+
+# What RegexLexer yields for a newline no rule matched (Text before Pygments 2.11, Whitespace since)
+UNMATCHED_NEWLINE_TOKEN = next(_EmptyRegexLexer().get_tokens_unprocessed("\n"))[1]
+
+CompiledRule = namedtuple("CompiledRule", ["Regex", "ActionType", "Action", "NewState", "FirstCharacterMatch",
+                                           "Nullable", "LineStartOnly", "SingleCharacter", "Reach",
+                                           "LookbehindWidth"])
+
+# Position in the preprocessed text, index of the first token lexed from there
+Checkpoint = namedtuple("Checkpoint", ["Position", "TokenIndex"])
+
+# (major, minor) ranges, inclusive, on which compiling_regex_lexers_tests.py passes. Widen them only after
+# running it on the new version.
+SUPPORTED_PYTHON_VERSIONS = ((3, 7), (3, 13))
+SUPPORTED_PYGMENTS_VERSIONS = ((2, 9), (2, 19))
+
+compiled_lexers = {}
+unsupported_version_warnings = set()
+
+
+def get_major_minor_version(version):
+    """(major, minor) of a version string like "2.19.2" """
+    match = re.match(r"(\d+)\.(\d+)", version)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def is_supported_version(python_version=None, pygments_version=None):
+    """Whether the lexers can be compiled with these (major, minor) versions, by default the running ones"""
+    python_version = tuple(sys.version_info[:2]) if python_version is None else python_version
+    pygments_version = get_major_minor_version(pygments.__version__) if pygments_version is None else pygments_version
+    return (SUPPORTED_PYTHON_VERSIONS[0] <= python_version <= SUPPORTED_PYTHON_VERSIONS[1] and
+            pygments_version is not None and
+            SUPPORTED_PYGMENTS_VERSIONS[0] <= pygments_version <= SUPPORTED_PYGMENTS_VERSIONS[1])
+
+
+def get_lexer(lexer_class, compiled=True):
+    """
+    The compiled lexer if `compiled` and the running versions are supported, otherwise an instance of
+    the lexer class (same tokens, but neither checkpoints nor relexing)
+    """
+    if compiled and is_supported_version():
+        return get_compiled_lexer(lexer_class)
+    if compiled and lexer_class not in unsupported_version_warnings:
+        unsupported_version_warnings.add(lexer_class)
+        print(f"WARNING: Lexers are not compiled on Python {sys.version_info[0]}.{sys.version_info[1]} with "
+              f"Pygments {pygments.__version__}, lexing with {lexer_class.__name__} instead")
+    return lexer_class()
+
+
+def get_compiled_lexer(lexer_class, **options):
+    """One CompiledRegexLexer per lexer class & options, compiled on first use"""
+    key = (lexer_class, tuple(sorted(options.items())))
+    if key not in compiled_lexers:
+        compiled_lexers[key] = CompiledRegexLexer(lexer_class, **options)
+    return compiled_lexers[key]
+
+
+def get_callback_variables(callback):
+    """The closure variables of a pygments callback, e.g. {'args': ...} for bygroups"""
+    if callback.__closure__ is None:
+        return {}
+    return dict(zip(callback.__code__.co_freevars, [cell.cell_contents for cell in callback.__closure__]))
+
+
+def get_character_class(items):
+    """The regex of a parsed character class, None if it cannot be written back"""
+    negate = False
+    parts = []
+    for op, av in items:
+        if op == sre_parse.NEGATE:
+            negate = True
+        elif op == sre_parse.LITERAL:
+            parts.append(re.escape(chr(av)))
+        elif op == sre_parse.RANGE:
+            parts.append(f"{re.escape(chr(av[0]))}-{re.escape(chr(av[1]))}")
+        elif op == sre_parse.CATEGORY and av in CATEGORIES:
+            parts.append(CATEGORIES[av])
+        else:
+            return None
+    return f"[{'^' if negate else ''}{''.join(parts)}]"
+
+
+def get_first_characters(items):
+    """
+    (regexes of the characters a match of the parsed pattern can start with, whether it can match
+    the empty string). The regexes are None if any character is possible, or not known.
+    """
+    first_characters = []
+    for op, av in items:
+        if op in ZERO_WIDTH_OPS:
+            continue
+
+        if op == sre_parse.LITERAL:
+            return first_characters + [re.escape(chr(av))], False
+        if op == sre_parse.NOT_LITERAL:
+            return first_characters + [f"[^{re.escape(chr(av))}]"], False
+        if op == sre_parse.IN:
+            character_class = get_character_class(av)
+            return (None, True) if character_class is None else (first_characters + [character_class], False)
+
+        if op == sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            # (group, added flags, removed flags, pattern)
+            sub_first_characters, nullable = get_first_characters(av[-1])
+        elif op == sre_parse.BRANCH:
+            sub_first_characters, nullable = [], False
+            for branch in av[1]:
+                branch_first_characters, branch_nullable = get_first_characters(branch)
+                if branch_first_characters is None:
+                    return None, True
+                sub_first_characters += branch_first_characters
+                nullable = nullable or branch_nullable
+        elif op in REPEAT_OPS:
+            # (min, max, pattern)
+            sub_first_characters, nullable = get_first_characters(av[2])
+            nullable = nullable or av[0] == 0
+        else:
+            # Any character, back references, ...
+            return None, True
+
+        if sub_first_characters is None:
+            return None, True
+        first_characters += sub_first_characters
+        if not nullable:
+            return first_characters, False
+
+    return first_characters, True
+
+
+def is_line_start_only(items):
+    """Whether the parsed pattern starts with "^", i.e. only matches at the start of a line or the text"""
+    for op, av in items:
+        if op == sre_parse.AT and av in (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING):
+            return True
+        if op not in ZERO_WIDTH_OPS:
+            return False
+    return False
+
+
+def is_single_character(items):
+    """Whether the parsed pattern matches exactly one character, which is in its first characters"""
+    if len(items) != 1:
+        return False
+    op, av = items[0]
+    if op == sre_parse.SUBPATTERN and not av[1] and not av[2]:
+        return is_single_character(av[-1])
+    return op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL) or (op == sre_parse.IN and get_character_class(av) is not None)
+
+
+def get_widths(items):
+    """
+    (most characters a match of the parsed pattern consumes, most characters a match attempt examines),
+    counted from the start of the attempt, None if unbounded
+    """
+    consumed, examined = 0, 0
+    for op, av in items:
+        if op in SINGLE_CHARACTER_OPS:
+            widths = (1, 1)
+        elif op == sre_parse.AT:
+            widths = (0, 1 if av in LOOKAHEAD_AT_CODES else 0)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            # (direction, pattern), lookbehinds only examine characters before the attempt
+            assertion_widths = get_widths(av[1]) if av[0] > 0 else (0, 0)
+            widths = None if assertion_widths is None else (0, assertion_widths[1])
+        elif op == sre_parse.SUBPATTERN:
+            widths = get_widths(av[-1])
+        elif op == sre_parse.BRANCH:
+            branch_widths = [get_widths(branch) for branch in av[1]]
+            widths = None if None in branch_widths else (max([branch[0] for branch in branch_widths]),
+                                                         max([branch[1] for branch in branch_widths]))
+        elif op in REPEAT_OPS and av[1] != sre_parse.MAXREPEAT:
+            body_widths = get_widths(av[2])
+            widths = None if body_widths is None else (
+                av[1] * body_widths[0], (av[1] - 1) * body_widths[0] + body_widths[1] if av[1] else 0)
+        else:
+            return None
+
+        if widths is None:
+            return None
+        examined = max(examined, consumed + widths[1])
+        consumed += widths[0]
+    return consumed, examined
+
+
+def get_lookbehind_width(items):
+    """Most characters before the start of a match attempt that the parsed pattern examines"""
+    width = 0
+    for op, av in items:
+        if op == sre_parse.AT and av in LOOKBEHIND_AT_CODES:
+            width = max(width, 1)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            width = max(width, (av[1].getwidth()[1] if av[0] < 0 else 0) + get_lookbehind_width(av[1]))
+        elif op == sre_parse.SUBPATTERN:
+            width = max(width, get_lookbehind_width(av[-1]))
+        elif op == sre_parse.BRANCH:
+            width = max([width] + [get_lookbehind_width(branch) for branch in av[1]])
+        elif op in REPEAT_OPS:
+            width = max(width, get_lookbehind_width(av[2]))
+    return width
+
+
+def can_match_newline(items, flags):
+    """Whether a match of the parsed pattern, or of one of its lookaheads, can contain a newline"""
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            if av == ord('\n'):
+                return True
+        elif op == sre_parse.NOT_LITERAL:
+            if av != ord('\n'):
+                return True
+        elif op == sre_parse.ANY:
+            if flags & re.DOTALL:
+                return True
+        elif op == sre_parse.IN:
+            character_class = get_character_class(av)
+            if character_class is None or re.match(character_class, '\n', flags):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if av[0] > 0 and can_match_newline(av[1], flags):
+                return True
+        elif op == sre_parse.SUBPATTERN:
+            if can_match_newline(av[-1], flags):
+                return True
+        elif op == sre_parse.BRANCH:
+            if any([can_match_newline(branch, flags) for branch in av[1]]):
+                return True
+        elif op in REPEAT_OPS:
+            if can_match_newline(av[2], flags):
+                return True
+        elif op != sre_parse.AT:
+            return True
+    return False
+
+
+def is_line_local(items, flags):
+    """
+    Whether a match attempt of the parsed pattern examines at most the rest of its line, i.e. it can't
+    match a newline, except as its very last character
+    """
+    items = list(items)
+    while items and items[-1][0] == sre_parse.SUBPATTERN and not items[-1][1][1] and not items[-1][1][2]:
+        items = items[:-1] + list(items[-1][1][-1])
+    if items and items[-1] == (sre_parse.LITERAL, ord('\n')):
+        items = items[:-1]
+    return not can_match_newline(items, flags)
+
+
+def get_matched_characters(items):
+    """
+    The content of a character class of all characters a match of the parsed pattern (or its lookaheads)
+    can contain, None if that's not a (non-negated) character class
+    """
+    characters = ""
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            characters += re.escape(chr(av))
+            continue
+        if op == sre_parse.IN:
+            character_class = get_character_class(av)
+            if character_class is None or character_class.startswith("[^"):
+                return None
+            characters += character_class[1:-1]
+            continue
+
+        if op == sre_parse.AT or (op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT) and av[0] < 0):
+            continue
+        if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            sub_characters = get_matched_characters(av[1])
+        elif op == sre_parse.SUBPATTERN:
+            sub_characters = get_matched_characters(av[-1])
+        elif op == sre_parse.BRANCH:
+            branch_characters = [get_matched_characters(branch) for branch in av[1]]
+            sub_characters = None if None in branch_characters else "".join(branch_characters)
+        elif op in REPEAT_OPS:
+            sub_characters = get_matched_characters(av[2])
+        else:
+            # Any character, negated characters, back references, ...
+            return None
+        if sub_characters is None:
+            return None
+        characters += sub_characters
+    return characters
+
+
+def get_character_sequences(items):
+    """
+    The alternatives of the parsed pattern, as lists of single character (op, av), None if it has any
+    other elements (e.g. repeats)
+    """
+    sequences = [[]]
+    for op, av in items:
+        if op in SINGLE_CHARACTER_OPS:
+            sequences = [sequence + [(op, av)] for sequence in sequences]
+            continue
+
+        if op == sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            sub_sequences = get_character_sequences(av[-1])
+        elif op == sre_parse.BRANCH:
+            branch_sequences = [get_character_sequences(branch) for branch in av[1]]
+            sub_sequences = None if None in branch_sequences else sum(branch_sequences, [])
+        else:
+            return None
+        if sub_sequences is None:
+            return None
+        sequences = [sequence + sub_sequence for sequence in sequences for sub_sequence in sub_sequences]
+    return sequences
+
+
+def get_character_regex(item):
+    """The regex of a single character (op, av), None if it cannot be written back"""
+    op, av = item
+    if op == sre_parse.LITERAL:
+        return re.escape(chr(av))
+    if op == sre_parse.NOT_LITERAL:
+        return f"[^{re.escape(chr(av))}]"
+    if op == sre_parse.IN:
+        return get_character_class(av)
+    return "."
+
+
+def are_exclusive(sequences, flags):
+    """Whether at most one of the character sequences can match at any position (so there's no backtracking)"""
+    for i, sequence in enumerate(sequences):
+        for other_sequence in sequences[i + 1:]:
+            # Exclusive if they differ in a character, i.e. one is a literal the other can't match
+            for item, other_item in zip(sequence, other_sequence):
+                literal, other = (item, other_item) if item[0] == sre_parse.LITERAL else (other_item, item)
+                other_regex = get_character_regex(other)
+                if (literal[0] == sre_parse.LITERAL and other_regex is not None
+                        and not re.match(other_regex, chr(literal[1]), flags)):
+                    break
+            else:
+                return False
+    return True
+
+
+def get_scan(items):
+    """
+    (repeat op, (min, max, repeated pattern), tail pattern) if the parsed pattern is an unbounded repeat
+    (after lookbehinds), followed by a tail, like strings and comments up to their end. None otherwise.
+    """
+    for i, (op, av) in enumerate(items):
+        if op == sre_parse.AT and av not in LOOKAHEAD_AT_CODES:
+            continue
+        if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT) and av[0] < 0:
+            continue
+
+        while op == sre_parse.SUBPATTERN and not av[1] and not av[2] and len(av[-1]) == 1:
+            op, av = av[-1][0]
+        if op not in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) or av[1] != sre_parse.MAXREPEAT:
+            return None
+        return op, av, items[i + 1:]
+    return None
+
+
+def get_rule_reach(items, flags):
+    """
+    None if a match attempt of the parsed pattern at a position examines at most the rest of its line,
+    otherwise (reach type, value) to bound the last position it examines, which is one of:
+    - WIDTH_REACH, most characters examined: the pattern has a bounded width (e.g. character literals)
+    - RUN_REACH, match function of the characters the pattern can match: it can't examine further than
+      the first other character (e.g. identifiers and whitespace)
+    - GREEDY_SCAN_REACH, (match function of the repeat, most characters examined by the repeated pattern and
+      the tail): the first time the repeat can't repeat, plus that, since only one of the alternatives of the
+      repeated pattern can match at every position (e.g. strings)
+    - LAZY_SCAN_REACH: the end of the match if the rule matched, since a lazy repeat of single characters stops
+      at the first match of the tail (e.g. block comments), anything otherwise
+    - UNKNOWN_REACH: anything
+    """
+    if is_line_local(items, flags):
+        return None
+
+    widths = get_widths(items)
+    if widths is not None:
+        return WIDTH_REACH, widths[1]
+
+    characters = get_matched_characters(items)
+    if characters is not None:
+        return RUN_REACH, re.compile(f"[{characters}]*" if characters else "", flags).match
+
+    scan = get_scan(items)
+    tail_widths = None if scan is None else get_widths(scan[2])
+    if tail_widths is not None:
+        repeat_op, (_, _, repeated_items), tail_items = scan
+        sequences = get_character_sequences(repeated_items)
+        if sequences is not None and repeat_op == sre_parse.MAX_REPEAT and are_exclusive(sequences, flags):
+            sequence_regexes = ["".join(map(get_character_regex, sequence)) for sequence in sequences]
+            if None not in sequence_regexes and all(sequences):
+                return GREEDY_SCAN_REACH, (re.compile(f"(?:{'|'.join(sequence_regexes)})*", flags).match,
+                                           max([len(sequence) for sequence in sequences] + [tail_widths[1]]))
+        if (sequences is not None and repeat_op == sre_parse.MIN_REPEAT and all([len(sequence) == 1 for sequence in sequences])
+                and tail_items.getwidth() == (tail_widths[0], tail_widths[0]) and tail_widths[0] == tail_widths[1]):
+            return LAZY_SCAN_REACH, None
+
+    return UNKNOWN_REACH, None
+
+
+def get_reach(crossing_rules, text, pos, m):
+    """
+    The last position examined by a match attempt at pos (at most), of the rules that can examine beyond
+    their line. crossing_rules are the (group, reach) of these rules in the master regex, m its match.
+    """
+    reach = -1
+    for group, (reach_type, value) in crossing_rules:
+        if m is not None and m.lastindex < group:
+            # An earlier rule matched, so this one was not tried
+            break
+        if reach_type == WIDTH_REACH:
+            reach = max(reach, pos + value - 1)
+        elif reach_type == RUN_REACH:
+            reach = max(reach, value(text, pos).end())
+        elif reach_type == GREEDY_SCAN_REACH:
+            reach = max(reach, value[0](text, pos).end() + value[1] - 1)
+        elif reach_type == LAZY_SCAN_REACH and m is not None and m.lastindex == group:
+            reach = max(reach, m.end() - 1)
+        else:
+            return len(text)
+    return reach
+
+
+def get_common_prefix_length(text, other_text):
+    length, max_length = 0, min(len(text), len(other_text))
+    # Binary search, comparing slices is a lot faster than comparing character by character
+    while length < max_length:
+        middle = (length + max_length + 1) // 2
+        if text[length:middle] == other_text[length:middle]:
+            length = middle
+        else:
+            max_length = middle - 1
+    return length
+
+
+def get_changed_range(text, new_text):
+    """(start, end in text, end in new_text) of the part of text that was replaced in new_text"""
+    start = get_common_prefix_length(text, new_text)
+    max_suffix_length = min(len(text), len(new_text)) - start
+    suffix_length = get_common_prefix_length(text[:start - 1:-1] if start else text[::-1],
+                                             new_text[:start - 1:-1] if start else new_text[::-1])
+    suffix_length = min(suffix_length, max_suffix_length)
+    return start, len(text) - suffix_length, len(new_text) - suffix_length
+
+
+class CompiledState:
+    """
+    The CompiledRules of one lexer state, with a master regex per first character (and whether it is
+    at the start of a line), compiled on first use. FirstCharacterMatch is None if a rule can start
+    with any character.
+    """
+
+    def __init__(self, rules, flags):
+        self.rules = rules
+        self.flags = flags
+        self.by_rules = {}
+        self.by_character = {}
+        self.by_character_at_line_start = {}
+        self.end_of_text = self.compile_rules(tuple([i for i, rule in enumerate(rules)
+                                                     if rule.Nullable or rule.FirstCharacterMatch is None]))
+        self.direct_tokens, self.direct_run_match = self.compile_direct_runs()
+
+    def compile_rules(self, rule_indices):
+        """
+        (master regex match function, (action type, action, new state) by the group of each rule). Instead of
+        group 0, the actions start with the (group, reach) of the rules that can examine beyond their line
+        (see get_reach), None if there are none.
+        """
+        if rule_indices in self.by_rules:
+            return self.by_rules[rule_indices]
+
+        patterns = []
+        crossing_rules = []
+        actions = [None]
+        for i in rule_indices:
+            rule = self.rules[i]
+            if rule.Reach is not None:
+                crossing_rules.append((len(actions), rule.Reach))
+            patterns.append(f"({rule.Regex.pattern})")
+            actions.append((rule.ActionType, rule.Action, rule.NewState))
+            # Placeholders for the rule's own groups
+            actions += [None] * rule.Regex.groups
+
+        # Never matches without rules
+        master_regex = re.compile("|".join(patterns) if patterns else "(?!)", self.flags)
+        assert master_regex.groups == len(actions) - 1
+        actions[0] = tuple(crossing_rules) or None
+        self.by_rules[rule_indices] = (master_regex.match, actions)
+        return self.by_rules[rule_indices]
+
+    def compile_direct_runs(self):
+        """
+        The tokens of the ASCII characters that are matched on their own, without a state transition,
+        and the match function of a run of them. Some are only matched on their own if not at the start
+        of a line, which the run checks with a lookbehind.
+        """
+        direct_tokens = {}
+        anywhere, not_at_line_start = [], []
+        for character in map(chr, range(128)):
+            match, actions = self.compile_for_character(character, False)
+            if match is not None or actions[0] is None or actions[1] is not None:
+                continue
+            token = actions[0]
+            direct_tokens[character] = token
+            if self.compile_for_character(character, True) == (None, (token, None)):
+                anywhere.append(re.escape(character))
+            else:
+                not_at_line_start.append(re.escape(character))
+
+        patterns = []
+        if anywhere:
+            patterns.append(f"[{''.join(anywhere)}]")
+        if not_at_line_start:
+            patterns.append(f"(?<=[^\\n])[{''.join(not_at_line_start)}]")
+        if not patterns:
+            return direct_tokens, None
+        return direct_tokens, re.compile(f"(?:{'|'.join(patterns)})+").match
+
+    def compile_for_character(self, character, at_line_start):
+        """
+        The master regex of the rules that can match at `character`, or (None, (token, new state))
+        if that is a single rule matching only this character
+        """
+        rule_indices = tuple([i for i, rule in enumerate(self.rules)
+                              if (at_line_start or not rule.LineStartOnly)
+                              and (rule.Nullable or rule.FirstCharacterMatch is None or rule.FirstCharacterMatch(character))])
+
+        rule = self.rules[rule_indices[0]] if len(rule_indices) == 1 else None
+        if rule is not None and rule.SingleCharacter and rule.ActionType == TOKEN_ACTION:
+            token = None
+            if rule.Action is not None:
+                token = (rule.Action, FORMATTING_TOKENS.get(character, character) if rule.Action is Text else character)
+            compiled = (None, (token, rule.NewState))
+        else:
+            compiled = self.compile_rules(rule_indices)
+
+        if at_line_start:
+            self.by_character_at_line_start[character] = compiled
+        else:
+            self.by_character[character] = compiled
+        return compiled
+
+
+class CompiledRegexLexer:
+    """
+    Lexes like `lexer_class(**options)`, for lexers that use UnprocessedTokensMixin
+    (i.e. all lexers of this repo). get_tokens returns a list instead of a generator.
+    """
+
+    def __init__(self, lexer_class, **options):
+        self.lexer_class = lexer_class
+        self.options = options
+        self.lexer = lexer_class(**options)
+
+        self.states = {}
+        for state_name, rules in self.lexer._tokens.items():
+            self.states[state_name] = CompiledState([self.compile_rule(*rule) for rule in rules], lexer_class.flags)
+        # Characters before a position that lexing from there can depend on (at least the previous one, for "^")
+        self.lookbehind_width = max([1] + [rule.LookbehindWidth for state in self.states.values() for rule in state.rules])
+
+    def compile_rule(self, rexmatch, action, new_state):
+        regex = rexmatch.__self__
+        parsed_pattern = sre_parse.parse(regex.pattern, regex.flags)
+        first_characters, nullable = get_first_characters(parsed_pattern)
+        first_character_match = None
+        if first_characters is not None:
+            first_character_match = re.compile("|".join(first_characters) or "(?!)", self.lexer_class.flags).match
+        return CompiledRule(regex, *self.compile_action(action), self.compile_new_state(new_state),
+                            first_character_match, nullable, is_line_start_only(parsed_pattern),
+                            first_character_match is not None and is_single_character(parsed_pattern),
+                            get_rule_reach(parsed_pattern, regex.flags), get_lookbehind_width(parsed_pattern))
+
+    def compile_action(self, action):
+        if action is None or type(action) is _TokenType:
+            return TOKEN_ACTION, action
+
+        callback_variables = get_callback_variables(action)
+        if "args" in callback_variables:
+            # bygroups(...): (group offset, action) per group
+            return GROUPS_ACTION, [(i + 1, self.compile_action(group_action))
+                                   for i, group_action in enumerate(callback_variables["args"])
+                                   if group_action is not None]
+
+        if "gt_kwargs" in callback_variables:
+            # using(...)
+            other_lexer_class = callback_variables.get("_other", this)
+            if callback_variables["kwargs"] and other_lexer_class is this:
+                raise ValueError("using(this, ...) with lexer options is not supported")
+            # None for this lexer, which is still being compiled
+            other_lexer = None if other_lexer_class is this else get_compiled_lexer(other_lexer_class, **self.options)
+            stack = tuple(callback_variables["gt_kwargs"].get("stack", ('root',)))
+            return USING_ACTION, (other_lexer, stack)
+
+        raise ValueError(f"Unsupported lexer action {action!r}")
+
+    @staticmethod
+    def compile_new_state(new_state):
+        """None or a tuple of states to push, "#pop" and "#push", like RegexLexer"""
+        if new_state is None or isinstance(new_state, tuple):
+            return new_state
+        if new_state == '#push':
+            return ('#push',)
+        if isinstance(new_state, int):
+            return ('#pop',) * -new_state
+        raise ValueError(f"Unsupported state transition {new_state!r}")
+
+    def preprocess(self, text):
+        """Same as Lexer.get_tokens"""
+        if text.startswith('\ufeff'):
+            text = text[len('\ufeff'):]
+        text = text.replace('\r\n', '\n')
+        text = text.replace('\r', '\n')
+        if self.lexer.stripall:
+            text = text.strip()
+        elif self.lexer.stripnl:
+            text = text.strip('\n')
+        if self.lexer.tabsize > 0:
+            text = text.expandtabs(self.lexer.tabsize)
+        if self.lexer.ensurenl and not text.endswith('\n'):
+            text += '\n'
+        return text
+
+    def get_tokens(self, text):
+        tokens = []
+        self.lex(self.preprocess(text), tokens)
+        return tokens
+
+    def get_tokens_and_checkpoints(self, text):
+        """(get_tokens(text), Checkpoints of the preprocessed text)"""
+        tokens, checkpoints = [], []
+        self.lex(self.preprocess(text), tokens, checkpoints=checkpoints)
+        return tokens, checkpoints
+
+    def relex(self, text, tokens, checkpoints, new_text):
+        """
+        get_tokens_and_checkpoints(new_text), given get_tokens_and_checkpoints(text), by lexing from the last
+        checkpoint before the changed part of the text, until the first checkpoint after it that is also
+        one of `checkpoints` (and far enough from the change for lookbehinds). From there, the tokens and
+        checkpoints are the ones of text.
+        """
+        text, new_text = self.preprocess(text), self.preprocess(new_text)
+        start, end, new_end = get_changed_range(text, new_text)
+        offset = len(new_text) - len(text)
+
+        def find_checkpoint(position):
+            """Index of the checkpoint of text at position, None if there is none"""
+            i = bisect_left(checkpoints, (position,))
+            return i if i < len(checkpoints) and checkpoints[i].Position == position else None
+
+        def is_resynchronized(checkpoint):
+            return checkpoint.Position >= new_end + self.lookbehind_width and \
+                find_checkpoint(checkpoint.Position - offset) is not None
+
+        # There's always one at the start
+        i = bisect_right(checkpoints, (start, len(tokens))) - 1
+        new_tokens, new_checkpoints = tokens[:checkpoints[i].TokenIndex], checkpoints[:i]
+        resynchronized = self.lex(new_text, new_tokens, pos=checkpoints[i].Position, checkpoints=new_checkpoints,
+                                  stop=is_resynchronized)
+
+        if resynchronized is not None:
+            i = find_checkpoint(resynchronized.Position - offset)
+            token_offset = resynchronized.TokenIndex - checkpoints[i].TokenIndex
+            new_tokens += tokens[checkpoints[i].TokenIndex:]
+            new_checkpoints += [Checkpoint(position + offset, token_index + token_offset)
+                                for position, token_index in checkpoints[i:]]
+        return new_tokens, new_checkpoints
+
+    def lex_using(self, using, text, tokens):
+        other_lexer, stack = using
+        (other_lexer or self).lex(text, tokens, stack)
+
+    def lex(self, text, tokens, stack=('root',), pos=0, checkpoints=None, stop=None):
+        """
+        Appends the (token_type, value) of `text` to `tokens`, like RegexLexer.get_tokens_unprocessed.
+        If checkpoints is a list, appends a Checkpoint for every line start in "root" that no earlier match
+        attempt examined (reached). Lexing from there gives the same tokens as lexing the whole text, and
+        they are the same for all texts with the same lines up to there. Lexing stops at the first of
+        them for which stop(checkpoint) is true, and returns it (None if it lexed all of `text`).
+        """
+
+        append = tokens.append
+        states = self.states
+        state_stack = list(stack)
+        state = states[state_stack[-1]]
+        by_character, by_character_at_line_start = state.by_character, state.by_character_at_line_start
+        text_length = len(text)
+        # States reached by zero-length matches at the current position
+        empty_match_states = set()
+        # Last position examined by a match attempt, and of the last checkpoint
+        reach = last_checkpoint_position = pos - 1
+
+        while True:
+            if pos < text_length:
+                character = text[pos]
+                if pos and text[pos - 1] != '\n':
+                    match, actions = by_character.get(character) or state.compile_for_character(character, False)
+                else:
+                    if (checkpoints is not None and reach < pos and pos > last_checkpoint_position
+                            and state_stack == ['root']):
+                        checkpoint = Checkpoint(pos, len(tokens))
+                        if stop is not None and stop(checkpoint):
+                            return checkpoint
+                        checkpoints.append(checkpoint)
+                        last_checkpoint_position = pos
+                    match, actions = by_character_at_line_start.get(character) or state.compile_for_character(character, True)
+            else:
+                match, actions = state.end_of_text
+
+            if match is None:
+                # Single rule, matching only this character
+                token, new_state = actions
+                m = None
+                if new_state is None and state.direct_run_match is not None:
+                    m = state.direct_run_match(text, pos)
+                if m is not None:
+                    end = m.end()
+                    if checkpoints is not None:
+                        # Stops at the next line, for its checkpoint. Runs don't examine characters for the
+                        # tokens before, so they don't reach beyond that.
+                        newline_pos = text.find('\n', pos, end - 1)
+                        if newline_pos != -1:
+                            end = newline_pos + 1
+                    tokens.extend(map(state.direct_tokens.__getitem__, text[pos:end]))
+                else:
+                    if token is not None:
+                        append(token)
+                    end = pos + 1
+
+            else:
+                m = match(text, pos)
+                if checkpoints is not None and actions[0] is not None:
+                    reach = max(reach, get_reach(actions[0], text, pos, m))
+                if m is None:
+                    if pos >= text_length:
+                        break
+
+                    empty_match_states.clear()
+                    if text[pos] == '\n':
+                        # At EOL, reset state to "root"
+                        state_stack = ['root']
+                        state = states['root']
+                        by_character, by_character_at_line_start = state.by_character, state.by_character_at_line_start
+                        append((UNMATCHED_NEWLINE_TOKEN, "NEWLINE") if UNMATCHED_NEWLINE_TOKEN is Text
+                               else (UNMATCHED_NEWLINE_TOKEN, '\n'))
+                    else:
+                        append((Error, text[pos]))
+                    pos += 1
+                    continue
+
+                group = m.lastindex
+                action_type, action, new_state = actions[group]
+
+                if action_type == TOKEN_ACTION:
+                    if action is not None:
+                        value = m.group()
+                        append((action, FORMATTING_TOKENS.get(value, value)) if action is Text else (action, value))
+
+                elif action_type == GROUPS_ACTION:
+                    for offset, (group_action_type, group_action) in action:
+                        value = m.group(group + offset)
+                        if group_action_type == TOKEN_ACTION:
+                            if value:
+                                append((group_action, FORMATTING_TOKENS.get(value, value))
+                                       if group_action is Text else (group_action, value))
+                        elif value is not None:
+                            self.lex_using(group_action, value, tokens)
+
+                else:
+                    self.lex_using(action, m.group(), tokens)
+
+                end = m.end()
+
+            if new_state is not None:
+                for new_state_name in new_state:
+                    if new_state_name == '#pop':
+                        if len(state_stack) > 1:
+                            state_stack.pop()
+                    elif new_state_name == '#push':
+                        state_stack.append(state_stack[-1])
+                    else:
+                        state_stack.append(new_state_name)
+                state = states[state_stack[-1]]
+                by_character, by_character_at_line_start = state.by_character, state.by_character_at_line_start
+
+            if end == pos:
+                # Back in the same state at the same position: RegexLexer loops forever here
+                # (e.g. camelcase lexer, text ending with "class\n")
+                empty_match_state = tuple(state_stack)
+                if empty_match_state in empty_match_states:
+                    raise RuntimeError(f"Lexer loops at position {pos} in state {state_stack[-1]}")
+                empty_match_states.add(empty_match_state)
+            elif empty_match_states:
+                empty_match_states.clear()
+            pos = end
+        return None
@@ -0,0 +1,113 @@
+import unittest
+import random
+import regex_lexer_tests
+from regex_lexer import CSharpAndCommentsLexer, LanguageLexer
+from regex_lexer_camelcase import CSharpAndCommentsCamelcaseLexer, LanguageCamelcaseLexer
+from pygments.token import Name
+from compiling_regex_lexers import get_compiled_lexer, get_lexer, is_supported_version, CompiledRegexLexer
+from generating_synthetic_inputs import load_csharp_corpus, fuzz_csharp_code, edit_csharp_code
+
+
+class MatchAttemptsExceeded(Exception):
+    pass
+
+
+def loops_in_pygments(lexer_class, code):
+    """
+    Whether the RegexLexer makes more match attempts on code than it could without looping: once per rule
+    of every state at every position
+    """
+    lexer = lexer_class()
+    max_match_attempts = sum(map(len, lexer._tokens.values())) * (len(code) + 1)
+    num_match_attempts = 0
+
+    def count_attempts(rexmatch):
+        def match(text, pos):
+            nonlocal num_match_attempts
+            num_match_attempts += 1
+            if num_match_attempts > max_match_attempts:
+                raise MatchAttemptsExceeded()
+            return rexmatch(text, pos)
+        return match
+
+    lexer._tokens = {state: [(count_attempts(rexmatch), action, new_state) for rexmatch, action, new_state in rules]
+                     for state, rules in lexer._tokens.items()}
+    try:
+        list(lexer.get_tokens(code))
+    except MatchAttemptsExceeded:
+        return True
+    return False
+
+
+class TestCompiledRegexLexers(regex_lexer_tests.TestRegexLexer):
+    """All test cases of regex_lexer_tests.py, with the compiled lexers"""
+
+    standard_lexer = get_compiled_lexer(CSharpAndCommentsLexer)
+    camelcase_lexer = get_compiled_lexer(CSharpAndCommentsCamelcaseLexer)
+
+    @unittest.skip("Downloads a file, lexer output is compared in test_same_tokens")
+    def test_count_newlines(self):
+        pass
+
+    def test_same_tokens(self):
+        corpus = load_csharp_corpus()
+        self.assertGreater(len(corpus), 0)
+        rand = random.Random(0)
+
+        codes = corpus + [fuzz_csharp_code(corpus, rand) for _ in range(300)] + ["x = new class", "namespace\n"]
+        for lexer_class in (CSharpAndCommentsLexer, LanguageLexer, CSharpAndCommentsCamelcaseLexer,
+                            LanguageCamelcaseLexer):
+            compiled_lexer = get_compiled_lexer(lexer_class)
+            for code in codes:
+                try:
+                    compiled_tokens = compiled_lexer.get_tokens(code)
+                except RuntimeError:
+                    # Only where Pygments loops forever
+                    self.assertTrue(loops_in_pygments(lexer_class, code), f"{lexer_class.__name__}: {code!r}")
+                    continue
+                self.assertEqual(compiled_tokens, list(lexer_class().get_tokens(code)), f"{lexer_class.__name__}: {code!r}")
+
+    def test_relex(self):
+        corpus = load_csharp_corpus()
+        rand = random.Random(0)
+
+        for lexer_class in (CSharpAndCommentsLexer, LanguageLexer, CSharpAndCommentsCamelcaseLexer,
+                            LanguageCamelcaseLexer):
+            compiled_lexer = get_compiled_lexer(lexer_class)
+            for i in range(200):
+                code = rand.choice(corpus) if i % 4 == 0 else fuzz_csharp_code(corpus, rand)
+                new_code = edit_csharp_code(code, rand)
+                tokens, checkpoints = compiled_lexer.get_tokens_and_checkpoints(code)
+                new_tokens_and_checkpoints = compiled_lexer.get_tokens_and_checkpoints(new_code)
+                self.assertEqual(tokens, compiled_lexer.get_tokens(code))
+                self.assertEqual(compiled_lexer.relex(code, tokens, checkpoints, new_code), new_tokens_and_checkpoints,
+                                 f"{lexer_class.__name__}: {code!r} -> {new_code!r}")
+
+        # Lines within comments & strings have none
+        tokens, checkpoints = self.standard_lexer.get_tokens_and_checkpoints("a;\n/*\nb\n*/\nc = @\"\n\";\nd\n")
+        self.assertEqual([position for position, _ in checkpoints], [0, 3, 11, 21])
+        self.assertEqual(tokens[checkpoints[-1].TokenIndex], (Name, "d"))
+
+    def test_endless_loop(self):
+        # RegexLexer never returns here
+        with self.assertRaises(RuntimeError):
+            self.camelcase_lexer.get_tokens("x = new class")
+        self.assertTrue(loops_in_pygments(CSharpAndCommentsCamelcaseLexer, "x = new class"))
+        self.assertFalse(loops_in_pygments(CSharpAndCommentsCamelcaseLexer, "x = new class Foo {}"))
+
+    def test_supported_versions(self):
+        # These tests pass on the supported versions, add the running ones only if they pass on them
+        self.assertTrue(is_supported_version(), "Python or Pygments version not in the supported ranges")
+        self.assertIsInstance(get_lexer(CSharpAndCommentsLexer), CompiledRegexLexer)
+        self.assertIsInstance(get_lexer(CSharpAndCommentsLexer, compiled=False), CSharpAndCommentsLexer)
+
+        self.assertTrue(is_supported_version((3, 7), (2, 9)))
+        self.assertTrue(is_supported_version((3, 13), (2, 19)))
+        self.assertFalse(is_supported_version((3, 6), (2, 9)))
+        self.assertFalse(is_supported_version((3, 14), (2, 9)))
+        self.assertFalse(is_supported_version((3, 7), (2, 8)))
+        self.assertFalse(is_supported_version((3, 7), (2, 20)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+This file lets the raw dataset be stored compressed. Diffs and analysis files are plain
+text and compress several-fold, so storing them as .diff.zst/.xml.zst (or .gz) reduces
+the I/O of every later stage, especially on network storage.
+
+Readers open raw dataset files with open_raw_dataset_file, which decompresses while
+streaming, so the XML and diff parsers consume the decompressed stream directly without
+temp files. Filenames keep their compression extension on disk; everything derived from
+a filename (catalog keys, datapoint IDs) uses the name without it.
+
+zstd needs the zstandard package, gzip only the standard library.
+
+Converting an existing raw dataset:
+
+    python compressing_raw_dataset.py
+
+"""
+
+import os
+import io
+import gzip
+import shutil
+
+
+COMPRESSION_EXTENSIONS = (".zst", ".gz")
+RAW_DATASET_EXTENSIONS = (".diff", ".xml")
+
+
+def get_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst raw dataset files requires the zstandard package")
+    return zstandard
+
+
+def get_compression_extension(filename):
+    """".zst", ".gz" or "" if the file is not compressed"""
+    for compression_extension in COMPRESSION_EXTENSIONS:
+        if filename.endswith(compression_extension):
+            return compression_extension
+    return ""
+
+
+def strip_compression_extension(filename):
+    """e.g. "x.diff.zst" -> "x.diff" """
+    compression_extension = get_compression_extension(filename)
+    return filename[:-len(compression_extension)] if compression_extension else filename
+
+
+def open_raw_dataset_file(filepath, mode='rb', encoding=None):
+    """
+    Opens a raw dataset file for streaming reads, decompressing it if it ends with a compression
+    extension. `mode` is 'rb' or 'r' (text, decoded with `encoding`).
+    """
+
+    if mode not in ('rb', 'r'):
+        raise ValueError(f"Unsupported mode: {mode}")
+
+    compression_extension = get_compression_extension(filepath)
+    if compression_extension == "":
+        return open(filepath, mode, encoding=encoding)
+
+    if compression_extension == ".gz":
+        f = gzip.open(filepath, 'rb')
+    else:
+        zstandard = get_zstandard()
+        f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb')))
+
+    if mode == 'r':
+        return io.TextIOWrapper(f, encoding=encoding)
+    return f
+
+
+def compress_file(filepath, compression_extension=".zst", level=None):
+    """Writes `filepath` + `compression_extension` and removes `filepath`. Returns the new path."""
+
+    compressed_filepath = f"{filepath}{compression_extension}"
+    tmp_filepath = f"{compressed_filepath}.{os.getpid()}.tmp"
+    with open(filepath, 'rb') as f:
+        if compression_extension == ".gz":
+            with gzip.open(tmp_filepath, 'wb', compresslevel=level or 6) as compressed_file:
+                shutil.copyfileobj(f, compressed_file, 2**20)
+        elif compression_extension == ".zst":
+            zstandard = get_zstandard()
+            with open(tmp_filepath, 'wb') as compressed_file:
+                zstandard.ZstdCompressor(level=level or 10).copy_stream(f, compressed_file)
+        else:
+            raise ValueError(f"Unknown compression extension: {compression_extension}")
+
+    # Readers always see either the complete original or the complete compressed file
+    os.replace(tmp_filepath, compressed_filepath)
+    os.remove(filepath)
+    return compressed_filepath
+
+
+def compress_raw_dataset_dir(raw_dataset_dir, compression_extension=".zst", level=None):
+    """Compresses all uncompressed diffs & analysis files. Returns (num files, bytes before, bytes after)."""
+
+    num_files = 0
+    num_bytes_before = 0
+    num_bytes_after = 0
+    for f in sorted(os.scandir(raw_dataset_dir), key=lambda f: f.name):
+        if not f.is_file() or not f.name.endswith(RAW_DATASET_EXTENSIONS):
+            continue
+
+        num_bytes_before += f.stat().st_size
+        compressed_filepath = compress_file(f.path, compression_extension, level)
+        num_bytes_after += os.stat(compressed_filepath).st_size
+        num_files += 1
+
+    return num_files, num_bytes_before, num_bytes_after
+
+
+if __name__ == "__main__":
+
+    raw_dataset_dirs = ["raw_dataset/diffs", "raw_dataset/analysis_files"]
+    compression_extension = ".zst"  # ".gz" without the zstandard package
+
+    for raw_dataset_dir in raw_dataset_dirs:
+        num_files, num_bytes_before, num_bytes_after = compress_raw_dataset_dir(raw_dataset_dir, compression_extension)
+        print(f"{raw_dataset_dir}: Compressed {num_files} files, "
+              f"{num_bytes_before / 2**20:.1f} MB -> {num_bytes_after / 2**20:.1f} MB")
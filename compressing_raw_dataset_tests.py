@@ -0,0 +1,63 @@
+import unittest
+import os
+import tempfile
+from compressing_raw_dataset import open_raw_dataset_file, compress_file, strip_compression_extension
+from cataloging_raw_dataset import scan_raw_dataset_dir
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DIFF_CONTENT = "diff --git a/ä.cs b/ä.cs\r\n--- a/ä.cs\n+++ b/ä.cs\n@@ -1 +1 @@\n-int a;\n+int b;\n" * 1000
+
+
+class TestCompressingRawDataset(unittest.TestCase):
+
+    def assert_round_trip(self, compression_extension):
+        with tempfile.TemporaryDirectory() as raw_dataset_dir:
+            filepath = f"{raw_dataset_dir}/acat__acat.sln__abc123__Nuget.1.0__SA1101.diff"
+            with open(filepath, 'w', encoding='utf-8', newline='') as f:
+                f.write(DIFF_CONTENT)
+            with open(filepath, 'r', encoding='utf-8') as f:
+                expected_lines = list(f)
+            with open(filepath, 'rb') as f:
+                expected_bytes = f.read()
+
+            compressed_filepath = compress_file(filepath, compression_extension)
+            self.assertEqual(os.listdir(raw_dataset_dir), [os.path.basename(compressed_filepath)])
+            self.assertLess(os.stat(compressed_filepath).st_size, len(expected_bytes))
+
+            with open_raw_dataset_file(compressed_filepath, 'r', encoding='utf-8') as f:
+                self.assertEqual(list(f), expected_lines)
+            with open_raw_dataset_file(compressed_filepath, 'rb') as f:
+                self.assertEqual(f.read(), expected_bytes)
+
+            self.assertEqual(strip_compression_extension(os.path.basename(compressed_filepath)),
+                             "acat__acat.sln__abc123__Nuget.1.0__SA1101.diff")
+            self.assertEqual(list(scan_raw_dataset_dir(raw_dataset_dir, ".diff", 5)), [(
+                os.path.basename(compressed_filepath), ["acat", "acat.sln", "abc123", "Nuget.1.0", "SA1101"],
+                os.stat(compressed_filepath).st_size)])
+
+    def test_gzip(self):
+        self.assert_round_trip(".gz")
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        self.assert_round_trip(".zst")
+
+    def test_scan_prefers_uncompressed(self):
+        with tempfile.TemporaryDirectory() as raw_dataset_dir:
+            filepath = f"{raw_dataset_dir}/acat__acat.sln__abc123__Nuget.1.0.xml"
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write("<Roslynator />")
+            with open(f"{filepath}.gz", 'wb') as f:
+                pass
+
+            self.assertEqual([filename for filename, _, _ in scan_raw_dataset_dir(raw_dataset_dir, ".xml", 4)],
+                             ["acat__acat.sln__abc123__Nuget.1.0.xml"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,6 +30,14 @@ Write-Output "Loaded ANALYZER_PACKAGE_DETAILS"
 
 [string[]]$RELEVANT_ANALYZER_PACKAGES = Get-Content -Path ./nuget_packages_relevant_sources.txt
 
+# Created by planning_solution_analysis.py: Only analyse solutions that cover all projects
+$SOLUTION_PLAN_PATH = "solution_analysis_plan.json"
+$SOLUTION_PLAN = $null
+if (Test-Path $SOLUTION_PLAN_PATH) {
+    $SOLUTION_PLAN = Get-Content -Raw -Path $SOLUTION_PLAN_PATH | ConvertFrom-Json
+    Write-Output "Loaded SOLUTION_PLAN"
+}
+
 $GH_REPOS = Import-Csv -Path "github_repos.csv"
 $GH_REPOS | ForEach-Object -ThrottleLimit 10 -Parallel {
 
@@ -52,6 +60,7 @@ $GH_REPOS | ForEach-Object -ThrottleLimit 10 -Parallel {
     . ./create_raw_dataset_functions.ps1
 
     $SOLUTION_FILES = GetAllRepoSolutions $REPO_PATH
+    $SOLUTION_FILES = @(GetPlannedSolutions $SOLUTION_FILES $REPO_NAME $REPO_PATH $Using:SOLUTION_PLAN)
 
     $NUMBER_SOLUTIONS = $SOLUTION_FILES.Count
     Write-Output "NUMBER_SOLUTIONS: $NUMBER_SOLUTIONS"
@@ -17,6 +17,30 @@ function GetAllRepoSolutions{
 }
 
 
+function GetPlannedSolutions{
+    param (
+        $SOLUTION_FILES,
+        $REPO_NAME,
+        $REPO_PATH,
+        $SOLUTION_PLAN
+    )
+    # Without a plan for the repo (see planning_solution_analysis.py), or planned without solutions,
+    # all solutions are analysed
+    if (($null -eq $SOLUTION_PLAN) -or ($null -eq $SOLUTION_PLAN.Repos.$REPO_NAME) -or
+            (@($SOLUTION_PLAN.Repos.$REPO_NAME.Solutions).Count -eq 0)) {
+        return $SOLUTION_FILES
+    }
+    $PLANNED_SOLUTIONS = $SOLUTION_PLAN.Repos.$REPO_NAME.Solutions
+    $FULL_REPO_PATH = (Resolve-Path $REPO_PATH).Path
+    $PLANNED_SOLUTION_FILES = $SOLUTION_FILES |
+        Where-Object {
+            $RELATIVE_PATH = [System.IO.Path]::GetRelativePath($FULL_REPO_PATH, $_.Filepath).Replace("\", "/")
+            $PLANNED_SOLUTIONS -contains $RELATIVE_PATH
+        }
+    return $PLANNED_SOLUTION_FILES
+}
+
+
 function ApplyRoslynatorAnalysis {
     param (
         $ANALYSIS_FILEPATH,
@@ -0,0 +1,46 @@
+"""
+This file stores which diagnostics of each analyzer package can be fixed, i.e. have both a
+DiagnosticAnalyzer and a CodeFixProvider (see das_cps_intersections in analyzing_analyzers.py).
+Diagnostics without a CodeFixProvider can never yield a diff, so the analysis scheduler skips
+packages without any fixable diagnostic, and the analysis file index skips the diagnostics
+that cannot be fixed.
+
+The lookup is a JSON file, {"<NuGet full name>": ["<DiagnosticID>", ...], ...}, with every
+analyzer package of the analysis, also the ones without fixable diagnostics. Packages that
+are not in the lookup are unknown, and are not filtered.
+
+"""
+
+import json
+import hashlib
+
+
+FIXABLE_DIAGNOSTICS_PATH = "fixable_diagnostics.json"
+
+
+def write_fixable_diagnostics(analyzer_packages, intersection, fixable_diagnostics_path=FIXABLE_DIAGNOSTICS_PATH):
+    """`intersection` is [(NuGet full name, DiagnosticID), ...]"""
+
+    fixable_diagnostics = {analyzer_package: [] for analyzer_package in analyzer_packages}
+    for analyzer_package, diagnostic_id in intersection:
+        fixable_diagnostics[analyzer_package].append(diagnostic_id)
+
+    # One package per line
+    with open(fixable_diagnostics_path, 'w', encoding='utf-8') as f:
+        f.write("{\n")
+        f.write(",\n".join([f"{json.dumps(analyzer_package)}: {json.dumps(sorted(set(diagnostic_ids)))}"
+                            for analyzer_package, diagnostic_ids in sorted(fixable_diagnostics.items())]))
+        f.write("\n}\n")
+
+
+def load_fixable_diagnostics(fixable_diagnostics_path=FIXABLE_DIAGNOSTICS_PATH):
+    """{NuGet full name: frozenset of fixable DiagnosticIDs}"""
+    with open(fixable_diagnostics_path, 'r', encoding='utf-8') as f:
+        return {analyzer_package: frozenset(diagnostic_ids) for analyzer_package, diagnostic_ids in json.load(f).items()}
+
+
+def hash_fixable_diagnostic_ids(fixable_diagnostic_ids):
+    """Identifies the filter of an index, None without filter"""
+    if fixable_diagnostic_ids is None:
+        return None
+    return hashlib.sha256("\n".join(sorted(fixable_diagnostic_ids)).encode('utf-8')).hexdigest()
@@ -7,6 +7,7 @@ import statistics
 from enum import Enum
 from pathlib import Path
 from collections import Counter
+from unified_data_model import UnifiedDatapoint
 
 random.seed(10)  # For reproducible shuffles
 
@@ -135,52 +136,57 @@ class Pipeline:
 
         return metadata
 
-    def flatten_input_datapoint(self, datapoint_dict):
+    @staticmethod
+    def load_tokenized_datapoint(tokenized_file):
+        with open(tokenized_file) as json_file:
+            return UnifiedDatapoint.from_json(json.load(json_file))
+
+    def flatten_input_datapoint(self, datapoint):
         input_list = []
 
-        for diag in datapoint_dict["DiagnosticOccurances"]:
+        for diag in datapoint.DiagnosticOccurances:
             input_list.append("LINE")
-            # input_list.extend([int(d) for d in diag["Line"]])
+            # input_list.extend([int(d) for d in diag.Line])
             # Offset is subtracted anyways
-            input_list.append(str(diag["Line"]))
+            input_list.append(str(diag.Line))
             input_list.append("MESSAGE")
-            input_list.extend(diag["TokenizedMessage"])
+            input_list.extend(diag.TokenizedMessage)
 
         input_list.append("FILE_CONTENT")
-        input_list.extend(datapoint_dict["TokenizedFileContext"])
+        input_list.extend(datapoint.TokenizedFileContext)
 
         return " ".join(input_list) + "\n"
 
-    def flatten_output_datapoint(self, datapoint_dict):
+    def flatten_output_datapoint(self, datapoint):
         output_list = []
 
-        action_type = datapoint_dict["ParsedDiff"]["ActionType"]
-        action = datapoint_dict["ParsedDiff"]["Action"]
+        action_type = datapoint.ParsedDiff.ActionType
+        action = datapoint.ParsedDiff.Action
 
         if action_type == "ADD":
 
             output_list.append("ADD")
             output_list.append("PREVIOUS_SOURCE_LOCATION")
-            output_list.append(str(action["PreviousSourceLocation"]))
+            output_list.append(str(action.PreviousSourceLocation))
             output_list.append("TARGET_LINES")
-            output_list.extend(action["TokenizedTargetLines"])
+            output_list.extend(action.TokenizedTargetLines)
 
         elif action_type == "REPLACE":
 
             output_list.append("REPLACE")
             output_list.append("SOURCE_LOCATION")
             output_list.extend([str(line_num)
-                                for line_num in action["SourceLocations"]])
+                                for line_num in action.SourceLocations])
             output_list.append("TARGET_LINES")
-            output_list.extend(action["TokenizedTargetLines"])
+            output_list.extend(action.TokenizedTargetLines)
 
         else:  # REMOVE
 
             output_list.append("REMOVE")
             output_list.append("SOURCE_LOCATION_START")
-            output_list.append(str(action["SourceLocationStart"]))
+            output_list.append(str(action.SourceLocationStart))
             output_list.append("SOURCE_LOCATION_END")
-            output_list.append(str(action["SourceLocationEnd"]))
+            output_list.append(str(action.SourceLocationEnd))
 
         return " ".join(output_list) + "\n"
 
@@ -296,11 +302,10 @@ class Pipeline:
 
             print("tokenized_file: ", tokenized_file.name)
 
-            with open(tokenized_file) as json_file:
-                tokenized_data_dict = json.load(json_file)
+            tokenized_data = self.load_tokenized_datapoint(tokenized_file)
 
-            src_string = self.flatten_input_datapoint(tokenized_data_dict)
-            target_string = self.flatten_output_datapoint(tokenized_data_dict)
+            src_string = self.flatten_input_datapoint(tokenized_data)
+            target_string = self.flatten_output_datapoint(tokenized_data)
 
             # TODO: Debug this for new dataset
             if src_string.count("\n") > 1 or target_string.count("\n") > 1:
@@ -357,9 +362,8 @@ class Pipeline:
         # Get and shuffle diagnostics
         diagnostics = []
         for tokenized_file in tokenized_files:
-            with open(tokenized_file) as json_file:
-                tokenized_data_dict = json.load(json_file)
-            diagnostics.append(tokenized_data_dict["DiagnosticID"])
+            tokenized_data = self.load_tokenized_datapoint(tokenized_file)
+            diagnostics.append(tokenized_data.DiagnosticID)
 
         diagnostics = list(set(diagnostics))
         diagnostics.sort()  # To have a reproducible shuffle
@@ -383,10 +387,9 @@ class Pipeline:
         file_to_dataset = {}
         for tokenized_file in tokenized_files:
 
-            with open(tokenized_file) as json_file:
-                tokenized_data_dict = json.load(json_file)
+            tokenized_data = self.load_tokenized_datapoint(tokenized_file)
 
-            diagnostic = tokenized_data_dict["DiagnosticID"]
+            diagnostic = tokenized_data.DiagnosticID
             if diagnostic in train_diagnostics:
                 file_to_dataset[tokenized_file.name] = Stage.train.value
             elif diagnostic in val_diagnostics:
@@ -464,15 +467,14 @@ class Pipeline:
 
         for tokenized_file in tokenized_files:
 
-            with open(tokenized_file) as json_file:
-                tokenized_data_dict = json.load(json_file)
+            tokenized_data = self.load_tokenized_datapoint(tokenized_file)
 
-            diagnostic_id = tokenized_data_dict["DiagnosticID"]
-            nuget_name = tokenized_data_dict["AnalyzerNuGet"]
-            repo = tokenized_data_dict["Repo"]
+            diagnostic_id = tokenized_data.DiagnosticID
+            nuget_name = tokenized_data.AnalyzerNuGet
+            repo = tokenized_data.Repo
 
-            src_string = self.flatten_input_datapoint(tokenized_data_dict)
-            target_string = self.flatten_output_datapoint(tokenized_data_dict)
+            src_string = self.flatten_input_datapoint(tokenized_data)
+            target_string = self.flatten_output_datapoint(tokenized_data)
 
             num_src_tokens = len(src_string.split())
             num_tgt_tokens = len(target_string.split())
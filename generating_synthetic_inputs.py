@@ -0,0 +1,101 @@
+"""
+This file generates the synthetic inputs of the benchmarks (benchmarking_pipeline.py) and
+the tests: diffs of randomly edited source files, and C# code for the lexers.
+
+"""
+
+import os
+import glob
+import random
+import difflib
+
+
+NO_NEWLINE_MARKER = "\\ No newline at end of file\n"
+# The submodules of the analysed repos, when checked out
+ANALYZED_REPOS_DIR = "submodule_repos_to_analyze"
+
+
+def git_diff_of_file(rel_path, lines, new_lines, num_context_lines):
+    """Unified diff with git headers & "No newline" markers"""
+
+    if not lines:
+        header = f"diff --git a/{rel_path} b/{rel_path}\nnew file mode 100644\nindex 0000000..1111111\n"
+        from_file = "/dev/null"
+    elif not new_lines:
+        header = f"diff --git a/{rel_path} b/{rel_path}\ndeleted file mode 100644\nindex 1111111..0000000\n"
+        from_file = f"a/{rel_path}"
+    else:
+        header = f"diff --git a/{rel_path} b/{rel_path}\nindex 1111111..2222222 100644\n"
+        from_file = f"a/{rel_path}"
+    to_file = "/dev/null" if not new_lines else f"b/{rel_path}"
+
+    diff_text = header
+    for diff_line in difflib.unified_diff(lines, new_lines, from_file, to_file, n=num_context_lines):
+        diff_text += diff_line if diff_line.endswith("\n") else diff_line + "\n" + NO_NEWLINE_MARKER
+    return diff_text
+
+
+def random_edit(rng, lines):
+    """Copy of the lines with random lines replaced, removed and added"""
+    new_lines = list(lines)
+    for line_num in sorted(rng.sample(range(len(lines) + 1), k=min(len(lines), rng.randint(1, 15))), reverse=True):
+        kind = rng.choice(["REPLACE", "REMOVE", "ADD"])
+        if kind == "REPLACE":
+            new_lines[line_num:line_num + rng.randint(1, 3)] = ["    // replaced\n"] * rng.randint(1, 3)
+        elif kind == "REMOVE":
+            del new_lines[line_num:line_num + rng.randint(1, 3)]
+        else:
+            new_lines[line_num:line_num] = ["    this.x = 0;\n"] * rng.randint(1, 3)
+    return new_lines
+
+
+# Inserted into the C# files, to reach the less common rules & states
+FUZZ_FRAGMENTS = ['"', '@"', '""', "'", "'x'", "'\\n'", "\\", "\\\n", "/*", "*/", "//", "\n", "\r\n", "\r", "\t", " ",
+                  "\ufeff", "class ", "struct X", "using ", "namespace A.B", "[Attr]", "#pragma warning disable 1",
+                  "#region", "extern alias x;", "global::", "int? a", "->*", ">>=", "...", "0x1Fl", "1.5e+3f", "é",
+                  "Ünïcödé", "$", "`", "@class", "void Foo(", "public static int Bar (", "'name'", "CamelCASEWord_x"]
+
+
+def load_csharp_corpus(corpus_dir=".", max_files=None, rng=None):
+    """
+    The C# files in corpus_dir (by default the C# projects of this repo) outside of the analysed
+    repos in it, a random sample of max_files of them if there are more
+    """
+    analyzed_repos_dir = os.path.join(corpus_dir, ANALYZED_REPOS_DIR, "")
+    filepaths = [filepath for filepath in sorted(glob.glob(os.path.join(corpus_dir, "**/*.cs"), recursive=True))
+                 if os.path.isfile(filepath) and not filepath.startswith(analyzed_repos_dir)]
+    if max_files is not None and len(filepaths) > max_files:
+        filepaths = sorted((rng or random).sample(filepaths, max_files))
+
+    corpus = []
+    for filepath in filepaths:
+        with open(filepath, 'r', encoding='utf-8-sig', errors='replace') as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def fuzz_csharp_code(corpus, rand):
+    """A random slice of a file, with random fragments inserted"""
+    code = rand.choice(corpus)
+    start = rand.randrange(len(code))
+    code = code[start:start + rand.randrange(1, 2000)]
+    for _ in range(rand.randrange(4)):
+        pos = rand.randrange(len(code) + 1)
+        code = code[:pos] + rand.choice(FUZZ_FRAGMENTS) + code[pos:]
+    return code
+
+
+def edit_csharp_code(code, rand):
+    """Random lines replaced, characters removed and fragments inserted"""
+    for _ in range(rand.randrange(1, 4)):
+        pos = rand.randrange(len(code) + 1)
+        edit_type = rand.randrange(3)
+        if edit_type == 0:
+            code = code[:pos] + rand.choice(FUZZ_FRAGMENTS) + code[pos:]
+        elif edit_type == 1:
+            code = code[:pos] + code[pos + rand.randrange(1, 30):]
+        else:
+            lines = code.split("\n")
+            lines[rand.randrange(len(lines))] = rand.choice(["", "int x = 1;", "// x", "/*", "*/", '"', '@"', "'"])
+            code = "\n".join(lines)
+    return code
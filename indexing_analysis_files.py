@@ -0,0 +1,284 @@
+"""
+This file indexes the diagnostics of a Roslynator analysis file, so that they can be
+looked up per (DiagnosticID, FilePath) instead of walking the whole XML tree again
+for every patched file. Compressed analysis files are decompressed while parsing.
+
+"""
+
+import xml.etree.ElementTree as ET
+import hashlib
+import os
+import pickle
+import struct
+from filtering_fixable_diagnostics import hash_fixable_diagnostic_ids
+from compressing_raw_dataset import open_raw_dataset_file
+
+
+# Path of the elements we are interested in, see sample_roslynator_analysis.xml
+PROJECT_PATH = ["Roslynator", "CodeAnalysis", "Projects", "Project"]
+DIAGNOSTIC_PATH = PROJECT_PATH + ["Diagnostics", "Diagnostic"]
+
+# Increase whenever the structure of the index changes, invalidates all cached indexes
+INDEX_SCHEMA_VERSION = 5
+# End of every cache file: magic & offset of the cache entry
+CACHE_TRAILER = struct.Struct("<4sQ")
+CACHE_MAGIC = b"RIDX"
+
+
+def get_analyzed_file_prefix(repo_name):
+    """Generated by Roslynator as 'Filepath'"""
+    return f"C:\\Users\\vlohse\Desktop\\neural-repair-static-analysis\\submodule_repos_to_analyze\\{repo_name}\\"
+
+
+def index_analysis_file(analysis_filepath, repo_name, fixable_diagnostic_ids=None):
+    """
+    Streams through a Roslynator analysis file exactly once and returns all diagnostics
+    keyed by (DiagnosticID, relative FilePath):
+
+    {
+        ("CA2211", "src/Applications/AppCommon/OldACATPreferences.cs"): {
+            "Severity": "Info",
+            "DiagnosticOccurances": [
+                {
+                    "Message": "Non-constant fields should not be visible",
+                    "Line": 75,
+                    "Character": 30
+                }
+            ]
+        }
+    }
+
+    Projects which have been analysed multiple times are only indexed once, and
+    occurances with the same (Message, Line, Character) are only indexed once per key.
+    The number of dropped duplicates is returned as well:
+
+    {
+        "CsprojDuplicates": 0,      # Diagnostics of a .csproj that was analysed again
+        "SharedFileDuplicates": 0   # Same occurance, file is referenced by multiple projects
+    }
+
+    With `fixable_diagnostic_ids` (see filtering_fixable_diagnostics.py), diagnostics without
+    a CodeFixProvider are skipped, since they never have a diff. They are not duplicates, their
+    number is returned separately: (diagnostic_index, duplicate_counts, num_unfixable_diagnostics)
+    """
+
+    analyzed_file_prefix = get_analyzed_file_prefix(repo_name)
+
+    diagnostic_index = {}
+    seen_occurances = {}
+    duplicate_counts = {
+        "CsprojDuplicates": 0,
+        "SharedFileDuplicates": 0
+    }
+    num_unfixable_diagnostics = 0
+    project_filepaths = set()
+    skip_project = False
+    element_path = []
+    with open_raw_dataset_file(analysis_filepath, 'rb') as analysis_file:
+        for event, element in ET.iterparse(analysis_file, events=("start", "end")):
+
+            if event == "start":
+                element_path.append(element.tag)
+
+                if element_path == PROJECT_PATH:
+                    # TODO: Check whether some analysis is based on target framework
+                    # Occasionally, Roslynator may perform the same analysis multiple times (due to multiple target frameworks in sln file, etc.)
+                    cs_proj_path = element.get('FilePath')
+                    skip_project = cs_proj_path in project_filepaths
+                    project_filepaths.add(cs_proj_path)
+                continue
+
+            if element_path == DIAGNOSTIC_PATH:
+                if fixable_diagnostic_ids is not None and element.get('Id') not in fixable_diagnostic_ids:
+                    num_unfixable_diagnostics += 1
+                elif skip_project:
+                    duplicate_counts["CsprojDuplicates"] += 1
+                elif not index_diagnostic(element, analyzed_file_prefix, diagnostic_index, seen_occurances):
+                    duplicate_counts["SharedFileDuplicates"] += 1
+                element.clear()
+            elif element_path == PROJECT_PATH:
+                element.clear()
+
+            element_path.pop()
+
+    return diagnostic_index, duplicate_counts, num_unfixable_diagnostics
+
+
+def index_diagnostic(xml_diagnostic, analyzed_file_prefix, diagnostic_index, seen_occurances):
+    """Returns False if the occurance was already indexed, True otherwise"""
+
+    if not hasattr(xml_diagnostic.find('FilePath'), 'text'):
+        # Happens rarely. Example:
+        # CA9998; FxCopAnalyzers package has been deprecated in favor of 'Microsoft.CodeAnalysis.NetAnalyzers'
+
+        # Cannot be sure that this diagnostic led to fix in our file
+        return True
+
+    analyzed_file_filepath = xml_diagnostic.find(
+        'FilePath').text[len(analyzed_file_prefix):].replace("\\", "/")
+
+    key = (xml_diagnostic.get('Id'), analyzed_file_filepath)
+    occurance = {
+        "Message": xml_diagnostic.find('Message').text,
+        "Line": int(xml_diagnostic.find('Location').get('Line')),
+        "Character": int(xml_diagnostic.find('Location').get('Character'))
+    }
+
+    # Even though already skipping .csproj duplicates, one file may be referenced
+    # in multiple different projects as well.
+    # Example: SA1642 for <Location Line="55" Character="16" /> in analysis file
+    # Druntime__Microsoft.Bcl.AsyncInterfaces.sln__e98d043d7d293c88a346b632d8fc12564a8ef0ce__Documentation.Analyser.1.1.1.xml
+    occurance_key = (occurance["Message"], occurance["Line"], occurance["Character"])
+    if key not in diagnostic_index:
+        diagnostic_index[key] = {
+            "Severity": xml_diagnostic.find('Severity').text,
+            "DiagnosticOccurances": []
+        }
+        seen_occurances[key] = set()
+    elif occurance_key in seen_occurances[key]:
+        return False
+
+    seen_occurances[key].add(occurance_key)
+    diagnostic_index[key]["DiagnosticOccurances"].append(occurance)
+    return True
+
+
+def hash_file_content(filepath, chunk_size=2**20):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_cache_filepath(analysis_filepath, repo_name, cache_dir):
+    cache_key = f"{repo_name}__{os.path.basename(analysis_filepath)}"
+    return f"{cache_dir}/{hashlib.sha256(cache_key.encode('utf-8')).hexdigest()}.pickle"
+
+
+def read_cache_file(cache_filepath):
+    """Returns the cache entry (without the index), None if there is no valid cache file"""
+    try:
+        with open(cache_filepath, 'rb') as f:
+            f.seek(-CACHE_TRAILER.size, os.SEEK_END)
+            magic, entry_offset = CACHE_TRAILER.unpack(f.read(CACHE_TRAILER.size))
+            if magic != CACHE_MAGIC:
+                return None
+            f.seek(entry_offset)
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def read_cached_index(cache_filepath, cache_entry, diagnostic_ids=None):
+    """Unpickles the index of all DiagnosticIDs, or only of `diagnostic_ids`"""
+    diagnostic_index = {}
+    with open(cache_filepath, 'rb') as f:
+        for diagnostic_id, offset in cache_entry["IndexOffsets"].items():
+            if diagnostic_ids is None or diagnostic_id in diagnostic_ids:
+                f.seek(offset)
+                diagnostic_index.update(pickle.load(f))
+    return diagnostic_index
+
+
+def write_cache_file(cache_filepath, cache_entry, diagnostic_index):
+    """
+    The index is pickled per DiagnosticID, so that single DiagnosticIDs can be loaded
+    without unpickling the index of the whole analysis file:
+
+        [index of 1st DiagnosticID][index of 2nd DiagnosticID]...[cache entry][trailer]
+
+    The cache entry holds the offset of each DiagnosticID in "IndexOffsets".
+    """
+
+    diagnostic_index_by_id = {}
+    for key, indexed_diagnostics in diagnostic_index.items():
+        if key[0] not in diagnostic_index_by_id:
+            diagnostic_index_by_id[key[0]] = {}
+        diagnostic_index_by_id[key[0]][key] = indexed_diagnostics
+
+    # Writing to a temporary file first, so that concurrent readers never see half a pickle
+    tmp_filepath = f"{cache_filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, 'wb') as f:
+        index_offsets = {}
+        for diagnostic_id, index in diagnostic_index_by_id.items():
+            index_offsets[diagnostic_id] = f.tell()
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        entry_offset = f.tell()
+        pickle.dump(dict(cache_entry, IndexOffsets=index_offsets), f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.write(CACHE_TRAILER.pack(CACHE_MAGIC, entry_offset))
+    os.replace(tmp_filepath, cache_filepath)
+
+
+def load_or_index_analysis_file(analysis_filepath, repo_name, cache_dir, diagnostic_ids=None,
+                                fixable_diagnostic_ids=None):
+    """
+    Same as index_analysis_file, but the index (and its counts) is cached on disk. A cached index is
+    valid if it was created with the same INDEX_SCHEMA_VERSION and `fixable_diagnostic_ids`, and the
+    analysis file still has the same size & mtime. If only the mtime changed (e.g. after copying
+    the raw dataset), the content hash decides whether the index has to be rebuilt.
+
+    With `diagnostic_ids`, only the index of these DiagnosticIDs is returned. If the index
+    is cached already, only their part of the cache is loaded.
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_filepath = get_cache_filepath(analysis_filepath, repo_name, cache_dir)
+    stat = os.stat(analysis_filepath)
+
+    fixable_diagnostics_hash = hash_fixable_diagnostic_ids(fixable_diagnostic_ids)
+    cache_entry = read_cache_file(cache_filepath)
+    if (cache_entry is not None and cache_entry["SchemaVersion"] == INDEX_SCHEMA_VERSION
+            and cache_entry["FixableDiagnosticsHash"] == fixable_diagnostics_hash):
+
+        if cache_entry["Size"] == stat.st_size and cache_entry["MtimeNs"] == stat.st_mtime_ns:
+            return (read_cached_index(cache_filepath, cache_entry, diagnostic_ids), cache_entry["DuplicateCounts"],
+                    cache_entry["NumUnfixableDiagnostics"])
+
+        content_hash = hash_file_content(analysis_filepath)
+        if cache_entry["Size"] == stat.st_size and cache_entry["Sha256"] == content_hash:
+            diagnostic_index = read_cached_index(cache_filepath, cache_entry)
+            cache_entry["MtimeNs"] = stat.st_mtime_ns
+            write_cache_file(cache_filepath, cache_entry, diagnostic_index)
+            return (filter_diagnostic_index(diagnostic_index, diagnostic_ids), cache_entry["DuplicateCounts"],
+                    cache_entry["NumUnfixableDiagnostics"])
+    else:
+        content_hash = hash_file_content(analysis_filepath)
+
+    diagnostic_index, duplicate_counts, num_unfixable_diagnostics = index_analysis_file(
+        analysis_filepath, repo_name, fixable_diagnostic_ids)
+    write_cache_file(cache_filepath, {
+        "SchemaVersion": INDEX_SCHEMA_VERSION,
+        "FixableDiagnosticsHash": fixable_diagnostics_hash,
+        "Size": stat.st_size,
+        "MtimeNs": stat.st_mtime_ns,
+        "Sha256": content_hash,
+        "DuplicateCounts": duplicate_counts,
+        "NumUnfixableDiagnostics": num_unfixable_diagnostics
+    }, diagnostic_index)
+    return filter_diagnostic_index(diagnostic_index, diagnostic_ids), duplicate_counts, num_unfixable_diagnostics
+
+
+def filter_diagnostic_index(diagnostic_index, diagnostic_ids):
+    if diagnostic_ids is None:
+        return diagnostic_index
+    return {key: indexed_diagnostics for key, indexed_diagnostics in diagnostic_index.items()
+            if key[0] in diagnostic_ids}
+
+
+def clear_index_cache(cache_dir):
+    if not os.path.isdir(cache_dir):
+        return
+    for f in os.scandir(cache_dir):
+        if f.is_file() and (f.name.endswith(".pickle") or f.name.endswith(".tmp")):
+            os.remove(f.path)
+
+
+if __name__ == "__main__":
+
+    diagnostic_index, duplicate_counts, _ = index_analysis_file("sample_roslynator_analysis.xml", "acat")
+    num_occurances = sum([len(indexed_diagnostics["DiagnosticOccurances"])
+                          for indexed_diagnostics in diagnostic_index.values()])
+    print(f"Indexed {len(diagnostic_index)} (DiagnosticID, FilePath) pairs with {num_occurances} occurances")
+    print(f"Skipped duplicates: {duplicate_counts}")
@@ -0,0 +1,203 @@
+import unittest
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from indexing_analysis_files import (index_analysis_file, load_or_index_analysis_file, filter_diagnostic_index,
+                                     get_cache_filepath, read_cache_file, write_cache_file, clear_index_cache,
+                                     get_analyzed_file_prefix)
+
+
+def walk_analysis_file(analysis_filepath, repo_name, diagnostic_id, path):
+    """
+    (Severity, DiagnosticOccurances) of the diagnostic in the file at path, as found by walking the whole
+    tree for every patched file before the analysis files were indexed. Severity is None if there are none.
+    """
+
+    analyzed_file_prefix = get_analyzed_file_prefix(repo_name)
+    severity = None
+    project_filepaths = []
+    unique_diagnostic_occurances = []
+    for xml_project in ET.parse(analysis_filepath).getroot().find('CodeAnalysis').find('Projects'):
+        cs_proj_path = xml_project.get('FilePath')
+        if cs_proj_path in project_filepaths:
+            continue
+        project_filepaths.append(cs_proj_path)
+
+        for xml_diagnostic in xml_project.find('Diagnostics'):
+            if not hasattr(xml_diagnostic.find('FilePath'), 'text'):
+                continue
+            analyzed_file_filepath = xml_diagnostic.find('FilePath').text[len(analyzed_file_prefix):].replace("\\", "/")
+            if xml_diagnostic.get('Id') != diagnostic_id or analyzed_file_filepath != path:
+                continue
+
+            if severity is None:
+                severity = xml_diagnostic.find('Severity').text
+            new_occurance_dict = {
+                "Message": xml_diagnostic.find('Message').text,
+                "Line": int(xml_diagnostic.find('Location').get('Line')),
+                "Character": int(xml_diagnostic.find('Location').get('Character'))
+            }
+            if new_occurance_dict not in unique_diagnostic_occurances:
+                unique_diagnostic_occurances.append(new_occurance_dict)
+    return severity, unique_diagnostic_occurances
+
+
+def write_analysis_file(analysis_filepath, repo_name, projects):
+    """projects: [(.csproj path, [(DiagnosticID, path or None, Message, Line, Character), ...]), ...]"""
+
+    with open(analysis_filepath, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<Roslynator><CodeAnalysis><Projects>\n')
+        for cs_proj_path, diagnostics in projects:
+            f.write(f'<Project Name="P" FilePath="{cs_proj_path}"><Diagnostics>\n')
+            for diagnostic_id, path, message, line, character in diagnostics:
+                f.write(f'<Diagnostic Id="{diagnostic_id}"><Severity>Warning</Severity><Message>{message}</Message>')
+                if path is not None:
+                    f.write(f'<FilePath>{get_analyzed_file_prefix(repo_name)}{path.replace("/", chr(92))}</FilePath>')
+                f.write(f'<Location Line="{line}" Character="{character}" /></Diagnostic>\n')
+            f.write('</Diagnostics></Project>\n')
+        f.write('</Projects></CodeAnalysis></Roslynator>\n')
+
+
+# Two projects analysed twice, sharing src/Shared.cs, and a diagnostic without a file
+DUPLICATED_PROJECTS = [
+    ("A.csproj", [("SA1101", "src/A.cs", "m", 1, 1), ("SA1101", "src/A.cs", "m", 2, 1),
+                  ("SA1101", "src/A.cs", "m", 2, 1), ("SA1101", "src/Shared.cs", "m", 3, 5),
+                  ("CA9998", None, "deprecated", 1, 1)]),
+    ("B.csproj", [("SA1101", "src/Shared.cs", "m", 3, 5), ("SA1101", "src/Shared.cs", "other", 3, 5),
+                  ("CA1822", "src/B.cs", "m", 4, 2)]),
+    ("A.csproj", [("SA1101", "src/A.cs", "m", 1, 1), ("SA1101", "src/A.cs", "m", 9, 9)]),
+    ("B.csproj", [("CA1822", "src/B.cs", "m", 4, 2)]),
+]
+
+
+class TestIndexingAnalysisFiles(unittest.TestCase):
+
+    def assert_same_as_tree_walk(self, analysis_filepath, repo_name, other_keys=()):
+        diagnostic_index, _, _ = index_analysis_file(analysis_filepath, repo_name)
+        self.assertGreater(len(diagnostic_index), 0)
+        for key in list(diagnostic_index) + list(other_keys):
+            indexed_diagnostics = diagnostic_index.get(key)
+            self.assertEqual(walk_analysis_file(analysis_filepath, repo_name, *key),
+                             (None, []) if indexed_diagnostics is None else
+                             (indexed_diagnostics["Severity"], indexed_diagnostics["DiagnosticOccurances"]), key)
+
+    def test_same_as_tree_walk(self):
+        self.assert_same_as_tree_walk("sample_roslynator_analysis.xml", "acat", [("CA1822", "src/Missing.cs")])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_analysis_file(f"{tmp_dir}/analysis.xml", "demo", DUPLICATED_PROJECTS)
+            self.assert_same_as_tree_walk(f"{tmp_dir}/analysis.xml", "demo",
+                                          [("SA1101", "src/B.cs"), ("CA9998", "")])
+
+    def test_duplicate_counts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_analysis_file(f"{tmp_dir}/analysis.xml", "demo", DUPLICATED_PROJECTS)
+            diagnostic_index, duplicate_counts, num_unfixable_diagnostics = index_analysis_file(
+                f"{tmp_dir}/analysis.xml", "demo")
+            self.assertEqual(duplicate_counts, {"CsprojDuplicates": 3, "SharedFileDuplicates": 2})
+            self.assertEqual(num_unfixable_diagnostics, 0)
+            self.assertEqual([(occurance["Message"], occurance["Line"]) for occurance in
+                              diagnostic_index[("SA1101", "src/Shared.cs")]["DiagnosticOccurances"]],
+                             [("m", 3), ("other", 3)])
+            self.assertEqual(len(diagnostic_index[("SA1101", "src/A.cs")]["DiagnosticOccurances"]), 2)
+
+            # Unfixable diagnostics are counted as such, not as duplicates, also in projects analysed again
+            _, duplicate_counts, num_unfixable_diagnostics = index_analysis_file(
+                f"{tmp_dir}/analysis.xml", "demo", frozenset(["SA1101"]))
+            self.assertEqual(duplicate_counts, {"CsprojDuplicates": 2, "SharedFileDuplicates": 2})
+            self.assertEqual(num_unfixable_diagnostics, 3)
+
+    def test_cached_index(self):
+        diagnostic_index, duplicate_counts, num_unfixable_diagnostics = index_analysis_file(
+            "sample_roslynator_analysis.xml", "acat")
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Indexed, then loaded from the cache, completely or per DiagnosticID
+            for _ in range(2):
+                self.assertEqual(load_or_index_analysis_file("sample_roslynator_analysis.xml", "acat", cache_dir),
+                                 (diagnostic_index, duplicate_counts, num_unfixable_diagnostics))
+            self.assertEqual(load_or_index_analysis_file(
+                "sample_roslynator_analysis.xml", "acat", cache_dir, diagnostic_ids={"CA1822", "CA2211"}),
+                (filter_diagnostic_index(diagnostic_index, {"CA1822", "CA2211"}), duplicate_counts,
+                 num_unfixable_diagnostics))
+            self.assertEqual(load_or_index_analysis_file(
+                "sample_roslynator_analysis.xml", "acat", cache_dir, diagnostic_ids=set()),
+                ({}, duplicate_counts, num_unfixable_diagnostics))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_cache_file(self):
+        diagnostic_index, duplicate_counts, num_unfixable_diagnostics = index_analysis_file(
+            "sample_roslynator_analysis.xml", "acat")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            analysis_filepath = f"{tmp_dir}/analysis.xml"
+            shutil.copyfile("sample_roslynator_analysis.xml", analysis_filepath)
+            cache_dir = f"{tmp_dir}/cache"
+            cache_filepath = get_cache_filepath(analysis_filepath, "acat", cache_dir)
+            load_or_index_analysis_file(analysis_filepath, "acat", cache_dir)
+            cache_entry = read_cache_file(cache_filepath)
+            self.assertEqual(set(cache_entry["IndexOffsets"]), set([key[0] for key in diagnostic_index]))
+
+            # Only the mtime changed, e.g. copied: the cache is used and gets the new mtime
+            stat = os.stat(analysis_filepath)
+            os.utime(analysis_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertEqual(load_or_index_analysis_file(analysis_filepath, "acat", cache_dir, diagnostic_ids={"CA1822"}),
+                             (filter_diagnostic_index(diagnostic_index, {"CA1822"}), duplicate_counts,
+                              num_unfixable_diagnostics))
+            self.assertEqual(read_cache_file(cache_filepath)["MtimeNs"], stat.st_mtime_ns + 10**9)
+
+            # Truncated cache files (e.g. of a killed worker) have no valid trailer, and are indexed again
+            with open(cache_filepath, 'r+b') as f:
+                f.truncate(os.path.getsize(cache_filepath) - 1)
+            self.assertIsNone(read_cache_file(cache_filepath))
+            self.assertEqual(load_or_index_analysis_file(analysis_filepath, "acat", cache_dir),
+                             (diagnostic_index, duplicate_counts, num_unfixable_diagnostics))
+            self.assertIsNotNone(read_cache_file(cache_filepath))
+
+    def test_invalidated_index(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            analysis_filepath = f"{tmp_dir}/analysis.xml"
+            cache_dir = f"{tmp_dir}/cache"
+            cache_filepath = get_cache_filepath(analysis_filepath, "demo", cache_dir)
+            write_analysis_file(analysis_filepath, "demo", DUPLICATED_PROJECTS)
+            load_or_index_analysis_file(analysis_filepath, "demo", cache_dir)
+
+            # Rewritten with the same size, but another content & mtime
+            write_analysis_file(analysis_filepath, "demo", [
+                (cs_proj_path, [(diagnostic_id, path and path.replace("A.cs", "C.cs"), message, line, character)
+                                for diagnostic_id, path, message, line, character in diagnostics])
+                for cs_proj_path, diagnostics in DUPLICATED_PROJECTS])
+            self.assertEqual(os.path.getsize(analysis_filepath), read_cache_file(cache_filepath)["Size"])
+            stat = os.stat(analysis_filepath)
+            os.utime(analysis_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertEqual(load_or_index_analysis_file(analysis_filepath, "demo", cache_dir),
+                             index_analysis_file(analysis_filepath, "demo"))
+
+            # Cached with another INDEX_SCHEMA_VERSION
+            cache_entry = read_cache_file(cache_filepath)
+            write_cache_file(cache_filepath, dict(cache_entry, SchemaVersion=cache_entry["SchemaVersion"] - 1), {})
+            self.assertEqual(load_or_index_analysis_file(analysis_filepath, "demo", cache_dir),
+                             index_analysis_file(analysis_filepath, "demo"))
+            self.assertEqual(read_cache_file(cache_filepath)["SchemaVersion"], cache_entry["SchemaVersion"])
+
+            clear_index_cache(cache_dir)
+            self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_fixable_diagnostic_ids(self):
+        diagnostic_index, _, _ = index_analysis_file("sample_roslynator_analysis.xml", "acat")
+        num_unfixable = sum([len(indexed_diagnostics["DiagnosticOccurances"])
+                             for key, indexed_diagnostics in diagnostic_index.items() if key[0] != "CA1822"])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # The cached index of another filter is not used
+            load_or_index_analysis_file("sample_roslynator_analysis.xml", "acat", cache_dir)
+            fixable_index, _, num_unfixable_diagnostics = load_or_index_analysis_file(
+                "sample_roslynator_analysis.xml", "acat", cache_dir, fixable_diagnostic_ids=frozenset(["CA1822"]))
+
+        self.assertEqual(fixable_index, filter_diagnostic_index(diagnostic_index, {"CA1822"}))
+        # Skipped before the duplicate checks, so duplicates of unfixable diagnostics are counted as unfixable
+        self.assertGreaterEqual(num_unfixable_diagnostics, num_unfixable)
+
+
+if __name__ == '__main__':
+    unittest.main()
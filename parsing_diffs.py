@@ -1,6 +1,10 @@
 import urllib.request
 from unidiff import PatchSet, PatchedFile
 import json
+import re
+from collections import namedtuple
+import numpy as np
+from compressing_raw_dataset import open_raw_dataset_file
 
 
 def parse_hunk(hunk):
@@ -83,6 +87,428 @@ def parse_hunk(hunk):
     return all_replaced_lines, all_added_lines, all_removed_lines
 
 
+# Streaming parser
+# ----------------
+# Reads a .diff file line by line and returns the REPLACE/ADD/REMOVE batches of each
+# patched file in the same shape as parse_hunk, without building a unidiff PatchSet.
+# Follows the parsing rules of unidiff for the git diffs of the raw dataset.
+
+RE_DIFF_GIT_HEADER = re.compile(r'^diff --git (?P<source>"?a/[^\t\n]+"?) (?P<target>"?b/[^\t\n]+"?)')
+RE_DIFF_GIT_HEADER_NO_PREFIX = re.compile(r'^diff --git (?P<source>[^\t\n]+) (?P<target>[^\t\n]+)')
+RE_DIFF_GIT_NEW_FILE = re.compile(r'^new file mode \d+$')
+RE_DIFF_GIT_DELETED_FILE = re.compile(r'^deleted file mode \d+$')
+RE_SOURCE_FILENAME = re.compile(r'^--- (?P<filename>"?[^\t\n]*"?)')
+RE_TARGET_FILENAME = re.compile(r'^\+\+\+ (?P<filename>"?[^\t\n]*"?)')
+RE_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))?\ @@[ ]?(.*)")
+RE_PATCH_FILE_PREFIX = re.compile(r'^[abciow12]/')
+DEV_NULL = '/dev/null'
+
+ParsedPatchedFile = namedtuple("ParsedPatchedFile", [
+    "path", "is_added_file", "is_removed_file", "all_replaced_lines", "all_added_lines", "all_removed_lines"])
+
+
+class DiffParseError(Exception):
+    pass
+
+
+def parse_hunk_lines(hunk_lines, source_start):
+    """
+    Same as parse_hunk, but for (line_type, value, source_line_no) tuples. Line types are
+    ' ' (context), '+', '-' and '\\' (no newline marker).
+    """
+
+    all_replaced_lines = []
+    all_added_lines = []
+    all_removed_lines = []
+
+    replaced_line_pair = {
+        "SourceLocations": [],
+        "TargetLines": []
+    }
+    added_line_set = {
+        "PreviousSourceLocation": None,
+        "TargetStartLocation": None,
+        "TargetLines": []
+    }
+
+    # Previous line of the hunk, including "\\ No newline at end of file" markers, which
+    # have no source line number
+    is_first_line = True
+    prev_source_line_no = None
+    for line_type, value, source_line_no, target_line_no in hunk_lines:
+        if line_type == ' ':
+            if added_line_set["TargetStartLocation"]:
+                all_added_lines.append(added_line_set)
+                added_line_set = {
+                    "PreviousSourceLocation": None,
+                    "TargetStartLocation": None,
+                    "TargetLines": []
+                }
+            elif replaced_line_pair["SourceLocations"] != []:
+
+                # Looked liked replacing, but just ended up deleting:
+                if replaced_line_pair["TargetLines"] == []:
+                    all_removed_lines.append({
+                        "SourceLocationStart": replaced_line_pair["SourceLocations"][0],
+                        "SourceLocationEnd": replaced_line_pair["SourceLocations"][-1],
+                    })
+                else:
+                    all_replaced_lines.append(replaced_line_pair)
+
+                replaced_line_pair = {
+                    "SourceLocations": [],
+                    "TargetLines": []
+                }
+
+        elif line_type == '+':
+            # Nothing deleted previously:
+            if replaced_line_pair["SourceLocations"] == []:
+
+                # Nothing added previously:
+                if not added_line_set["TargetStartLocation"]:
+                    added_line_set["PreviousSourceLocation"] = source_start if is_first_line else prev_source_line_no
+                    added_line_set["TargetStartLocation"] = target_line_no
+                added_line_set["TargetLines"].append(value)
+
+            # Add is related to previous deletion:
+            else:
+                replaced_line_pair["TargetLines"].append(value)
+
+        elif line_type == '-':
+            replaced_line_pair["SourceLocations"].append(source_line_no)
+
+        is_first_line = False
+        prev_source_line_no = source_line_no
+
+    if replaced_line_pair["SourceLocations"] != []:
+        # Deleted lines without adding
+        if replaced_line_pair["TargetLines"] == []:
+            all_removed_lines.append({
+                "SourceLocationStart": replaced_line_pair["SourceLocations"][0],
+                "SourceLocationEnd": replaced_line_pair["SourceLocations"][-1],
+            })
+        else:
+            all_replaced_lines.append(replaced_line_pair)
+    elif added_line_set["TargetStartLocation"]:
+        all_added_lines.append(added_line_set)
+
+    return all_replaced_lines, all_added_lines, all_removed_lines
+
+
+def iter_hunk_lines(diff_lines, source_start, source_length, target_start, target_length):
+    """Reads the lines of one hunk from `diff_lines` and yields (line_type, value, source_line_no, target_line_no)"""
+
+    source_line_no = source_start
+    target_line_no = target_start
+    expected_source_end = source_start + source_length
+    expected_target_end = target_start + target_length
+
+    for line in diff_lines:
+        line_type = line[:1]
+        if line_type in ('\r', '\n'):
+            # Empty line, treated like context
+            line_type = ' '
+            value = line
+        elif line_type in (' ', '+', '-', '\\'):
+            value = line[1:]
+        else:
+            raise DiffParseError(f"Hunk diff line expected: {line}")
+
+        if line_type == '+':
+            yield line_type, value, None, target_line_no
+            target_line_no += 1
+        elif line_type == '-':
+            yield line_type, value, source_line_no, None
+            source_line_no += 1
+        elif line_type == ' ':
+            yield line_type, value, source_line_no, target_line_no
+            target_line_no += 1
+            source_line_no += 1
+        else:
+            yield line_type, value, None, None
+
+        if source_line_no > expected_source_end or target_line_no > expected_target_end:
+            raise DiffParseError("Hunk is longer than expected")
+
+        if source_line_no == expected_source_end and target_line_no == expected_target_end:
+            return
+
+    raise DiffParseError("Hunk is shorter than expected")
+
+
+class StreamedPatchedFile:
+
+    def __init__(self, source_file, target_file):
+        self.source_file = source_file
+        self.target_file = target_file
+        self.hunk_headers = []
+        self.all_replaced_lines = []
+        self.all_added_lines = []
+        self.all_removed_lines = []
+
+    def to_parsed_patched_file(self):
+        """Same path, is_added_file & is_removed_file as unidiff's PatchedFile"""
+
+        is_rename = (self.source_file != DEV_NULL and self.target_file != DEV_NULL and
+                     self.source_file[2:] != self.target_file[2:])
+        filepath = self.source_file
+        if filepath in (None, DEV_NULL) or (is_rename and self.target_file not in (None, DEV_NULL)):
+            filepath = self.target_file
+
+        quoted = filepath.startswith('"') and filepath.endswith('"')
+        if quoted:
+            filepath = filepath[1:-1]
+        if RE_PATCH_FILE_PREFIX.match(filepath):
+            filepath = filepath[2:]
+        if quoted:
+            filepath = f'"{filepath}"'
+
+        is_single_hunk = len(self.hunk_headers) == 1
+        is_added_file = self.source_file == DEV_NULL or (
+            is_single_hunk and self.hunk_headers[0][0] == 0 and self.hunk_headers[0][1] == 0)
+        is_removed_file = self.target_file == DEV_NULL or (
+            is_single_hunk and self.hunk_headers[0][2] == 0 and self.hunk_headers[0][3] == 0)
+
+        return ParsedPatchedFile(filepath, is_added_file, is_removed_file,
+                                 self.all_replaced_lines, self.all_added_lines, self.all_removed_lines)
+
+
+def iter_parsed_patched_files(diff_filepath):
+    """
+    Yields one ParsedPatchedFile per patched file of the diff, in the order of PatchSet.
+    Only the batches of the current file are kept in memory, so diffs of any size
+    can be parsed. Compressed diffs are decompressed while reading.
+
+    The batches of all hunks of a file are concatenated, like:
+
+        for hunk in patched_file:
+            replaced_lines, added_lines, removed_lines = parse_hunk(hunk)
+    """
+
+    with open_raw_dataset_file(diff_filepath, 'r', encoding='utf-8') as diff_lines:
+
+        current_file = None
+        # True while inside the extended header of a "diff --git" block
+        in_git_header = False
+        source_file = None
+
+        for line in diff_lines:
+
+            is_diff_git_header = RE_DIFF_GIT_HEADER.match(line) or RE_DIFF_GIT_HEADER_NO_PREFIX.match(line)
+            if is_diff_git_header:
+                if current_file is not None:
+                    yield current_file.to_parsed_patched_file()
+                current_file = StreamedPatchedFile(
+                    is_diff_git_header.group('source'), is_diff_git_header.group('target'))
+                in_git_header = True
+                continue
+
+            if RE_DIFF_GIT_NEW_FILE.match(line):
+                if current_file is None or not in_git_header:
+                    raise DiffParseError(f"Unexpected new file found: {line}")
+                current_file.source_file = DEV_NULL
+                continue
+
+            if RE_DIFF_GIT_DELETED_FILE.match(line):
+                if current_file is None or not in_git_header:
+                    raise DiffParseError(f"Unexpected deleted file found: {line}")
+                current_file.target_file = DEV_NULL
+                continue
+
+            is_source_filename = RE_SOURCE_FILENAME.match(line)
+            if is_source_filename:
+                source_file = is_source_filename.group('filename')
+                # A "---" line starts a new file, unless it is part of the "diff --git" header
+                if current_file is not None and not in_git_header:
+                    yield current_file.to_parsed_patched_file()
+                    current_file = None
+                continue
+
+            is_target_filename = RE_TARGET_FILENAME.match(line)
+            if is_target_filename:
+                target_file = is_target_filename.group('filename')
+                if current_file is not None and current_file.target_file != target_file:
+                    raise DiffParseError(f"Target without source: {line}")
+                if current_file is None:
+                    if source_file is None:
+                        raise DiffParseError(f"Target without source: {line}")
+                    current_file = StreamedPatchedFile(source_file, target_file)
+                    in_git_header = False
+                    source_file = None
+                continue
+
+            is_hunk_header = RE_HUNK_HEADER.match(line)
+            if is_hunk_header:
+                in_git_header = False
+                if current_file is None:
+                    raise DiffParseError(f"Unexpected hunk found: {line}")
+
+                source_start, source_length, target_start, target_length, _ = is_hunk_header.groups()
+                hunk_header = (int(source_start), 1 if source_length is None else int(source_length),
+                               int(target_start), 1 if target_length is None else int(target_length))
+                current_file.hunk_headers.append(hunk_header)
+
+                replaced_lines, added_lines, removed_lines = parse_hunk_lines(
+                    iter_hunk_lines(diff_lines, *hunk_header), hunk_header[0])
+                current_file.all_replaced_lines += replaced_lines
+                current_file.all_added_lines += added_lines
+                current_file.all_removed_lines += removed_lines
+                continue
+
+            if line.startswith("\\ No newline at end of file"):
+                # Marker after a complete hunk, does not change any batch
+                if current_file is None:
+                    raise DiffParseError(f"Unexpected marker: {line}")
+                continue
+
+            if line == '\n' and current_file is not None and current_file.hunk_headers:
+                # Hunks may be followed by empty lines
+                continue
+
+            # Any other line is extended patch info (index, mode, similarity, binary, ...)
+            if not in_git_header:
+                if current_file is not None:
+                    yield current_file.to_parsed_patched_file()
+                current_file = None
+                in_git_header = True
+
+        if current_file is not None:
+            yield current_file.to_parsed_patched_file()
+
+
+# Columnar diff actions
+# ---------------------
+# All batches of one patched file as NumPy arrays, one entry per action, so that
+# consumers can match and measure them with vectorized operations instead of
+# looping over the batch dicts.
+
+ACTION_REPLACE = 0
+ACTION_ADD = 1
+ACTION_REMOVE = 2
+ACTION_KIND_NAMES = ("REPLACE", "ADD", "REMOVE")
+# Line number of absent fields, e.g. the source lines of ADD actions
+NO_LINE = -1
+
+
+class DiffActionArrays:
+    """
+    Actions are ordered like the batches: all REPLACE, then all ADD, then all REMOVE.
+
+        kinds                      ACTION_REPLACE, ACTION_ADD or ACTION_REMOVE
+        batch_nums                 Index in all_replaced_lines/all_added_lines/all_removed_lines
+        source_starts/source_ends  First & last deleted source line of REPLACE and REMOVE
+        previous_source_lines      PreviousSourceLocation of ADD (NO_LINE if it is None)
+        target_starts              TargetStartLocation of ADD
+        target_line_nums           Target lines of action i are target_line_nums[i]:target_line_nums[i + 1]
+        target_line_offsets        Target line j is target_buffer[target_line_offsets[j]:target_line_offsets[j + 1]]
+    """
+
+    def __init__(self, kinds, batch_nums, source_starts, source_ends, previous_source_lines, target_starts,
+                 target_line_nums, target_line_offsets, target_buffer):
+        self.kinds = kinds
+        self.batch_nums = batch_nums
+        self.source_starts = source_starts
+        self.source_ends = source_ends
+        self.previous_source_lines = previous_source_lines
+        self.target_starts = target_starts
+        self.target_line_nums = target_line_nums
+        self.target_line_offsets = target_line_offsets
+        self.target_buffer = target_buffer
+
+    @classmethod
+    def from_batches(cls, all_replaced_lines, all_added_lines, all_removed_lines):
+        kinds = []
+        batch_nums = []
+        source_starts = []
+        source_ends = []
+        previous_source_lines = []
+        target_starts = []
+        target_line_nums = [0]
+        target_lines = []
+
+        for batch_num, replaced_line_pair in enumerate(all_replaced_lines):
+            kinds.append(ACTION_REPLACE)
+            batch_nums.append(batch_num)
+            # The deleted lines of a batch are always consecutive
+            source_starts.append(replaced_line_pair["SourceLocations"][0])
+            source_ends.append(replaced_line_pair["SourceLocations"][-1])
+            previous_source_lines.append(NO_LINE)
+            target_starts.append(NO_LINE)
+            target_lines += replaced_line_pair["TargetLines"]
+            target_line_nums.append(len(target_lines))
+
+        for batch_num, added_line_set in enumerate(all_added_lines):
+            kinds.append(ACTION_ADD)
+            batch_nums.append(batch_num)
+            source_starts.append(NO_LINE)
+            source_ends.append(NO_LINE)
+            previous_source_line = added_line_set["PreviousSourceLocation"]
+            previous_source_lines.append(NO_LINE if previous_source_line is None else previous_source_line)
+            target_starts.append(added_line_set["TargetStartLocation"])
+            target_lines += added_line_set["TargetLines"]
+            target_line_nums.append(len(target_lines))
+
+        for batch_num, removed_line_set in enumerate(all_removed_lines):
+            kinds.append(ACTION_REMOVE)
+            batch_nums.append(batch_num)
+            source_starts.append(removed_line_set["SourceLocationStart"])
+            source_ends.append(removed_line_set["SourceLocationEnd"])
+            previous_source_lines.append(NO_LINE)
+            target_starts.append(NO_LINE)
+            target_line_nums.append(len(target_lines))
+
+        target_line_offsets = np.zeros(len(target_lines) + 1, dtype=np.int64)
+        target_line_offsets[1:] = np.cumsum([len(target_line) for target_line in target_lines], dtype=np.int64)
+
+        return cls(np.array(kinds, dtype=np.int8),
+                   np.array(batch_nums, dtype=np.int64),
+                   np.array(source_starts, dtype=np.int64),
+                   np.array(source_ends, dtype=np.int64),
+                   np.array(previous_source_lines, dtype=np.int64),
+                   np.array(target_starts, dtype=np.int64),
+                   np.array(target_line_nums, dtype=np.int64),
+                   target_line_offsets,
+                   "".join(target_lines))
+
+    @classmethod
+    def from_parsed_patched_file(cls, patched_file):
+        return cls.from_batches(patched_file.all_replaced_lines, patched_file.all_added_lines,
+                                patched_file.all_removed_lines)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def get_target_lines(self, action_num):
+        first_line = self.target_line_nums[action_num]
+        last_line = self.target_line_nums[action_num + 1]
+        offsets = self.target_line_offsets[first_line:last_line + 1].tolist()
+        return [self.target_buffer[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def get_action(self, action_num):
+        """Returns (diff key, batch dict) of one action, e.g. ("REPLACE-2", {"SourceLocations": ...})"""
+
+        kind = int(self.kinds[action_num])
+        diff_key = f"{ACTION_KIND_NAMES[kind]}-{self.batch_nums[action_num]}"
+        if kind == ACTION_REPLACE:
+            return diff_key, {
+                "SourceLocations": list(range(int(self.source_starts[action_num]),
+                                              int(self.source_ends[action_num]) + 1)),
+                "TargetLines": self.get_target_lines(action_num)
+            }
+        elif kind == ACTION_ADD:
+            previous_source_line = int(self.previous_source_lines[action_num])
+            return diff_key, {
+                "PreviousSourceLocation": None if previous_source_line == NO_LINE else previous_source_line,
+                "TargetStartLocation": int(self.target_starts[action_num]),
+                "TargetLines": self.get_target_lines(action_num)
+            }
+        else:
+            return diff_key, {
+                "SourceLocationStart": int(self.source_starts[action_num]),
+                "SourceLocationEnd": int(self.source_ends[action_num]),
+            }
+
+
 def run_through_patches(patches):
     # Each file has one patch
     for patch in patches:
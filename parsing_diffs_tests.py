@@ -0,0 +1,108 @@
+import unittest
+import os
+import glob
+import random
+import tempfile
+from unidiff import PatchSet
+from parsing_diffs import parse_hunk, iter_parsed_patched_files, DiffActionArrays
+from generating_synthetic_inputs import NO_NEWLINE_MARKER, git_diff_of_file, random_edit
+
+
+def parse_with_unidiff(diff_filepath):
+    parsed_patched_files = []
+    for patched_file in PatchSet.from_filename(diff_filepath):
+        all_replaced_lines = []
+        all_added_lines = []
+        all_removed_lines = []
+        for hunk in patched_file:
+            replaced_lines, added_lines, removed_lines = parse_hunk(hunk)
+            all_replaced_lines += replaced_lines
+            all_added_lines += added_lines
+            all_removed_lines += removed_lines
+        parsed_patched_files.append((patched_file.path, patched_file.is_added_file, patched_file.is_removed_file,
+                                     all_replaced_lines, all_added_lines, all_removed_lines))
+    return parsed_patched_files
+
+
+class TestStreamingDiffParser(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assert_same_as_unidiff(self, diff_filepath):
+        self.assertEqual([tuple(parsed_patched_file) for parsed_patched_file in iter_parsed_patched_files(diff_filepath)],
+                         parse_with_unidiff(diff_filepath))
+
+    def write_diff(self, diff_text):
+        diff_filepath = os.path.join(self.tmp_dir.name, "test.diff")
+        with open(diff_filepath, 'w', encoding='utf-8') as f:
+            f.write(diff_text)
+        return diff_filepath
+
+    def test_generated_diffs(self):
+        rng = random.Random(0)
+        source_filepaths = sorted(glob.glob("SourceCodeTokenizer/*.cs") + glob.glob("AssemblyAnalysis/*/*.cs"))
+        self.assertNotEqual(source_filepaths, [])
+
+        for _ in range(30):
+            diff_text = ""
+            for source_filepath in rng.sample(source_filepaths, k=min(len(source_filepaths), 4)):
+                with open(source_filepath, encoding='utf-8-sig') as f:
+                    lines = f.read().replace("\r\n", "\n").splitlines(keepends=True)
+                if rng.random() < 0.3 and lines:
+                    # No newline at end of file
+                    lines[-1] = lines[-1].rstrip("\n")
+
+                action = rng.random()
+                if action < 0.1:
+                    lines, new_lines = [], lines
+                elif action < 0.2:
+                    new_lines = []
+                else:
+                    new_lines = random_edit(rng, lines)
+                diff_text += git_diff_of_file(source_filepath, lines, new_lines, rng.choice([0, 1, 3]))
+
+            if rng.random() < 0.3:
+                # Empty context lines
+                diff_text = diff_text.replace("\n \n", "\n\n")
+            self.assert_same_as_unidiff(self.write_diff(diff_text))
+
+    def test_no_newline_marker_inside_hunk(self):
+        # The marker is the previous line of the ADD batch, so it has no PreviousSourceLocation
+        diff_text = ("--- a/A.cs\n+++ b/A.cs\n@@ -1,2 +1,3 @@\n"
+                     " int i;\n int j;\n" + NO_NEWLINE_MARKER + "+int k;\n")
+        self.assert_same_as_unidiff(self.write_diff(diff_text))
+        self.assertIsNone(next(iter_parsed_patched_files(
+            self.write_diff(diff_text))).all_added_lines[0]["PreviousSourceLocation"])
+
+    def test_diff_action_arrays(self):
+        diff_text = ""
+        rng = random.Random(1)
+        with open("parsing_diffs.py", encoding='utf-8') as f:
+            lines = f.read().splitlines(keepends=True)
+        for num in range(10):
+            diff_text += git_diff_of_file(f"src/{num}/File.cs", lines, random_edit(rng, lines), 1)
+        diff_text += ("--- a/A.cs\n+++ b/A.cs\n@@ -1,2 +1,3 @@\n"
+                      " int i;\n int j;\n" + NO_NEWLINE_MARKER + "+int ä;\n")
+
+        for patched_file in iter_parsed_patched_files(self.write_diff(diff_text)):
+            diff_actions = DiffActionArrays.from_parsed_patched_file(patched_file)
+            batches = ([(f"REPLACE-{num}", batch) for num, batch in enumerate(patched_file.all_replaced_lines)] +
+                       [(f"ADD-{num}", batch) for num, batch in enumerate(patched_file.all_added_lines)] +
+                       [(f"REMOVE-{num}", batch) for num, batch in enumerate(patched_file.all_removed_lines)])
+            self.assertEqual([diff_actions.get_action(action_num) for action_num in range(len(diff_actions))],
+                             batches)
+
+    def test_raw_dataset_diffs(self):
+        diff_filepaths = sorted(glob.glob("raw_dataset/diffs/*.diff"))
+        if not diff_filepaths:
+            self.skipTest("No raw dataset")
+        for diff_filepath in diff_filepaths:
+            self.assert_same_as_unidiff(diff_filepath)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""
+This file plans which solutions of each repo are analysed by create_raw_dataset.ps1.
+Solutions overlap heavily (e.g. a repo-wide solution and one solution per component),
+so analysing every solution analyses the same .csproj many times, for every analyzer
+package. Each .sln is parsed for its .csproj projects, and a small set of solutions that
+covers every project is chosen with a greedy set cover: repeatedly take the solution
+that adds the most projects not covered yet.
+
+The plan is written as JSON, which create_raw_dataset.ps1 uses instead of all solutions:
+
+    {
+        "PlanVersion": 1,
+        "Repos": {
+            "<RepoName>": {
+                "Solutions": ["<.sln path relative to the repo>", ...],
+                "NumSolutions": ..., "NumProjects": ...
+            },
+            ...
+        }
+    }
+
+Repos missing from the plan, or planned without solutions, are analysed with all their solutions.
+
+"""
+
+import os
+import re
+import csv
+import json
+from collections import namedtuple
+
+
+PLAN_VERSION = 1
+
+# Project("{FAE04EC0-301F-11D3-BF4B-00C04F79EFBC}") = "Name", "src\Name\Name.csproj", "{GUID}"
+RE_SOLUTION_PROJECT = re.compile(r'^Project\("\{[^}]*\}"\)\s*=\s*"[^"]*"\s*,\s*"([^"]*)"', re.MULTILINE)
+
+# Projects are paths relative to the repo, with "/" and lowercased, since Windows paths
+# are case-insensitive
+SolutionEntry = namedtuple("SolutionEntry", ["SolutionPath", "Projects"])
+
+SolutionCoverPlan = namedtuple("SolutionCoverPlan", [
+    "Repo", "Solutions", "SelectedSolutions", "NumProjects", "SolutionsWithoutProjects"])
+
+
+def normalize_project_path(solution_path, project_path):
+    """Project paths in a .sln are relative to the .sln"""
+    solution_dir = os.path.dirname(solution_path)
+    path = os.path.normpath(os.path.join(solution_dir, project_path.replace("\\", "/")))
+    return path.replace("\\", "/").lower()
+
+
+def parse_solution_file(repo_dir, solution_path):
+    """Returns the SolutionEntry of the .sln at `solution_path` (relative to `repo_dir`)"""
+
+    with open(f"{repo_dir}/{solution_path}", 'r', encoding='utf-8-sig', errors='replace') as f:
+        content = f.read()
+
+    # Solution folders are "projects" as well, their path is just their name
+    projects = frozenset([normalize_project_path(solution_path, project_path)
+                          for project_path in RE_SOLUTION_PROJECT.findall(content)
+                          if project_path.lower().endswith(".csproj")])
+    return SolutionEntry(solution_path, projects)
+
+
+def find_solution_files(repo_dir):
+    """Relative paths of all .sln files in the repo, as GetAllRepoSolutions in create_raw_dataset_functions.ps1"""
+    solution_paths = []
+    for dirpath, dirnames, filenames in os.walk(repo_dir):
+        dirnames[:] = [dirname for dirname in dirnames if dirname != ".git"]
+        for filename in filenames:
+            if filename.lower().endswith(".sln"):
+                solution_paths.append(os.path.relpath(os.path.join(dirpath, filename), repo_dir).replace("\\", "/"))
+    return sorted(solution_paths)
+
+
+def plan_solution_cover(repo, solutions):
+    """
+    Greedy set cover of the projects of `solutions` (SolutionEntry). Ties are broken by
+    the smaller solution, since it analyses fewer projects twice, then by path. If no .csproj
+    was found in any solution (e.g. only other project types), there is nothing to cover and
+    all solutions are selected, as without a plan.
+    """
+
+    uncovered_projects = set().union(*[solution.Projects for solution in solutions])
+    num_projects = len(uncovered_projects)
+    candidates = [solution for solution in solutions if solution.Projects]
+
+    selected_solutions = []
+    while uncovered_projects:
+        best_solution = min(candidates, key=lambda solution: (
+            -len(solution.Projects & uncovered_projects), len(solution.Projects), solution.SolutionPath))
+        selected_solutions.append(best_solution.SolutionPath)
+        uncovered_projects -= best_solution.Projects
+        candidates.remove(best_solution)
+    if num_projects == 0:
+        selected_solutions = [solution.SolutionPath for solution in solutions]
+
+    return SolutionCoverPlan(
+        repo, [solution.SolutionPath for solution in solutions], selected_solutions, num_projects,
+        [solution.SolutionPath for solution in solutions if not solution.Projects])
+
+
+def plan_repo(repo, repo_dir):
+    solutions = [parse_solution_file(repo_dir, solution_path) for solution_path in find_solution_files(repo_dir)]
+    return plan_solution_cover(repo, solutions)
+
+
+def plan_to_json(plans):
+    return {
+        "PlanVersion": PLAN_VERSION,
+        "Repos": {plan.Repo: {
+            "Solutions": plan.SelectedSolutions,
+            "NumSolutions": len(plan.Solutions),
+            "NumProjects": plan.NumProjects
+        } for plan in plans}
+    }
+
+
+def write_plan(plans, plan_path):
+    tmp_plan_path = f"{plan_path}.{os.getpid()}.tmp"
+    with open(tmp_plan_path, 'w', encoding='utf-8') as f:
+        json.dump(plan_to_json(plans), f, indent=2)
+    os.replace(tmp_plan_path, plan_path)
+
+
+def print_report(plans, num_analyzer_packages):
+    """Every solution is analysed (and restored) once per analyzer package"""
+
+    for plan in plans:
+        print(f"{plan.Repo}: {len(plan.Solutions)} solutions -> {len(plan.SelectedSolutions)} "
+              f"covering {plan.NumProjects} projects")
+        # Unless there are only such solutions, which are all selected then
+        skipped_solutions = [solution_path for solution_path in plan.SolutionsWithoutProjects
+                             if solution_path not in plan.SelectedSolutions]
+        if skipped_solutions:
+            print(f"    Solutions without .csproj, skipped: {skipped_solutions}")
+
+    num_solutions = sum([len(plan.Solutions) for plan in plans])
+    num_selected_solutions = sum([len(plan.SelectedSolutions) for plan in plans])
+    print("########")
+    print(f"Num repos: {len(plans)}")
+    print(f"Num solutions: {num_solutions}")
+    print(f"Num solutions to analyse: {num_selected_solutions}")
+    print(f"Num analyzer packages: {num_analyzer_packages}")
+    print(f"Projected analysis runs: {num_selected_solutions * num_analyzer_packages} "
+          f"instead of {num_solutions * num_analyzer_packages}")
+    print(f"Projected analysis runs saved: {(num_solutions - num_selected_solutions) * num_analyzer_packages} "
+          f"({100 * (num_solutions - num_selected_solutions) / max(num_solutions, 1):.1f}%)")
+
+
+if __name__ == "__main__":
+
+    repos_csv = "github_repos.csv"
+    repositories_dir = "submodule_repos_to_analyze"
+    analyzer_packages_path = "nuget_packages_relevant_sources.txt"
+    plan_path = "solution_analysis_plan.json"
+
+    with open(repos_csv, newline='') as f:
+        repos = [row["RepoName"] for row in csv.DictReader(f)]
+    with open(analyzer_packages_path, 'r', encoding='utf-8') as f:
+        num_analyzer_packages = len([line for line in f if line.strip()])
+
+    plans = []
+    for repo in repos:
+        repo_dir = f"{repositories_dir}/{repo}"
+        if not os.path.isdir(repo_dir):
+            print(f"Repo not cloned, not planned: {repo}")
+            continue
+        plans.append(plan_repo(repo, repo_dir))
+
+    print_report(plans, num_analyzer_packages)
+    write_plan(plans, plan_path)
+    print(f"Plan: {plan_path}")
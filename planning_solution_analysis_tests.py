@@ -0,0 +1,92 @@
+import unittest
+import io
+import contextlib
+import os
+import json
+import tempfile
+from planning_solution_analysis import (SolutionEntry, parse_solution_file, find_solution_files, plan_solution_cover,
+                                        plan_repo, write_plan, print_report)
+
+
+def write_solution_file(repo_dir, solution_path, project_paths):
+    lines = ["\ufeff", "Microsoft Visual Studio Solution File, Format Version 12.00",
+             'Project("{2150E333-8FDC-42A3-9474-1A3956D46DE8}") = "src", "src", "{11111111-0000-0000-0000-000000000000}"',
+             "EndProject"]
+    for project_path in project_paths:
+        name = os.path.splitext(os.path.basename(project_path.replace("\\", "/")))[0]
+        lines += [f'Project("{{FAE04EC0-301F-11D3-BF4B-00C04F79EFBC}}") = "{name}", "{project_path}", '
+                  '"{22222222-0000-0000-0000-000000000000}"', "EndProject"]
+    lines += ["Global", "EndGlobal"]
+
+    os.makedirs(os.path.dirname(f"{repo_dir}/{solution_path}"), exist_ok=True)
+    with open(f"{repo_dir}/{solution_path}", 'w', encoding='utf-8') as f:
+        f.write("\r\n".join(lines))
+
+
+class TestPlanningSolutionAnalysis(unittest.TestCase):
+
+    def test_parse_solution_file(self):
+        with tempfile.TemporaryDirectory() as repo_dir:
+            write_solution_file(repo_dir, "src/Tools/Tools.sln",
+                                ["Cli\\Cli.csproj", "..\\Core\\Core.csproj", "Docs\\Docs.shproj"])
+            self.assertEqual(parse_solution_file(repo_dir, "src/Tools/Tools.sln"), SolutionEntry(
+                "src/Tools/Tools.sln", frozenset(["src/tools/cli/cli.csproj", "src/core/core.csproj"])))
+
+    def test_plan_solution_cover(self):
+        solutions = [
+            SolutionEntry("All.sln", frozenset(["a", "b", "c", "d"])),
+            SolutionEntry("A.sln", frozenset(["a"])),
+            SolutionEntry("B.sln", frozenset(["b", "e"])),
+            SolutionEntry("CD.sln", frozenset(["c", "d"])),
+            SolutionEntry("Empty.sln", frozenset())
+        ]
+        plan = plan_solution_cover("repo", solutions)
+        self.assertEqual(plan.SelectedSolutions, ["All.sln", "B.sln"])
+        self.assertEqual(plan.NumProjects, 5)
+        self.assertEqual(plan.SolutionsWithoutProjects, ["Empty.sln"])
+
+        # Ties are broken by the smaller solution
+        plan = plan_solution_cover("repo", [SolutionEntry("Big.sln", frozenset(["a", "b", "c"])),
+                                            SolutionEntry("Small.sln", frozenset(["a", "b"])),
+                                            SolutionEntry("C.sln", frozenset(["c"]))])
+        self.assertEqual(plan.SelectedSolutions, ["Big.sln"])
+
+        self.assertEqual(plan_solution_cover("repo", []).SelectedSolutions, [])
+
+        # Without any .csproj, all solutions are analysed, as without a plan
+        plan = plan_solution_cover("repo", [SolutionEntry("Fs.sln", frozenset()), SolutionEntry("Vb.sln", frozenset())])
+        self.assertEqual(plan.SelectedSolutions, ["Fs.sln", "Vb.sln"])
+        self.assertEqual(plan.NumProjects, 0)
+
+    def test_plan_repo(self):
+        with tempfile.TemporaryDirectory() as repo_dir:
+            write_solution_file(repo_dir, "Repo.sln", ["src\\Core\\Core.csproj", "src\\Cli\\Cli.csproj"])
+            write_solution_file(repo_dir, "src/Core/Core.sln", ["Core.csproj"])
+            write_solution_file(repo_dir, "tests/Tests.sln", ["..\\src\\Core\\Core.csproj", "Tests\\Tests.csproj"])
+            self.assertEqual(find_solution_files(repo_dir), ["Repo.sln", "src/Core/Core.sln", "tests/Tests.sln"])
+
+            plan = plan_repo("repo", repo_dir)
+            self.assertEqual(plan.SelectedSolutions, ["Repo.sln", "tests/Tests.sln"])
+
+            write_plan([plan], f"{repo_dir}/plan.json")
+            with open(f"{repo_dir}/plan.json", encoding='utf-8') as f:
+                self.assertEqual(json.load(f)["Repos"]["repo"], {
+                    "Solutions": ["Repo.sln", "tests/Tests.sln"], "NumSolutions": 3, "NumProjects": 3})
+
+
+    def test_print_report(self):
+        plans = [plan_solution_cover("repo", [SolutionEntry("All.sln", frozenset(["a.csproj"])),
+                                              SolutionEntry("Docs.sln", frozenset())]),
+                 plan_solution_cover("fsharp", [SolutionEntry("Fs.sln", frozenset())])]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            print_report(plans, 2)
+
+        # Only the solutions that are left out, not all solutions of repos without any .csproj
+        self.assertEqual([line for line in output.getvalue().splitlines() if "skipped" in line],
+                         ["    Solutions without .csproj, skipped: ['Docs.sln']"])
+        self.assertIn("Projected analysis runs: 4 instead of 6", output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+"""
+This file instruments unifying_raw_dataset.py, to find out where long unification runs
+spend their time. The phases (indexing analysis files, parsing diffs, reading sources,
+matching, writing datapoints, ...) are timed with monotonic timers and counted, and the
+time of every diff and analysis file is recorded. Optionally, every diff file is profiled
+with cProfile (one .prof file per diff) or tracemalloc (peak of traced memory).
+
+Each worker fills its own UnificationProfile per analysis group, which is merged into the
+profile of the run. At the end, the run writes a JSON report and prints the slowest files.
+
+The RSS of the workers is sampled while unifying (RssMonitor), so that the peak RSS of each
+diff file is reported as well. RSS is read from /proc on Linux and with GetProcessMemoryInfo
+on Windows (the working set), elsewhere it is unknown.
+
+Stage seconds are summed over all workers, so they can exceed the elapsed seconds of the run.
+
+"""
+
+import os
+import json
+import time
+import ctypes
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+
+PROFILE_MODES = (None, "cprofile", "tracemalloc")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class UnificationProfile:
+
+    def __init__(self):
+        # {stage: [seconds, count]}
+        self.stages = {}
+        self.counters = {}
+        self.diff_files = []
+        self.analysis_files = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+
+    def add_stage_time(self, name, seconds, count=1):
+        if name not in self.stages:
+            self.stages[name] = [0.0, 0]
+        self.stages[name][0] += seconds
+        self.stages[name][1] += count
+
+    def time_iterator(self, name, iterable):
+        """Yields the items of `iterable`, timing how long each item takes to produce"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_stage_time(name, time.perf_counter() - start, 0)
+                return
+            self.add_stage_time(name, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, num=1):
+        self.counters[name] = self.counters.get(name, 0) + num
+
+    def add_diff_file(self, diff_entry, seconds, **details):
+        self.diff_files.append(dict(Filename=diff_entry.Filename, Repo=diff_entry.Repo,
+                                    AnalyzerNuGet=diff_entry.AnalyzerNuGet, DiagnosticID=diff_entry.DiagnosticID,
+                                    Seconds=seconds, **details))
+
+    def add_analysis_file(self, analysis_entry, seconds, **details):
+        self.analysis_files.append(dict(Filename=analysis_entry.Filename, Repo=analysis_entry.Repo,
+                                        AnalyzerNuGet=analysis_entry.AnalyzerNuGet, Seconds=seconds, **details))
+
+    def merge(self, other):
+        for name, (seconds, count) in other.stages.items():
+            self.add_stage_time(name, seconds, count)
+        for name, num in other.counters.items():
+            self.count(name, num)
+        self.diff_files += other.diff_files
+        self.analysis_files += other.analysis_files
+
+    def to_json(self, elapsed_seconds, num_workers, top_n):
+        return {
+            "ElapsedSeconds": elapsed_seconds,
+            "NumWorkers": num_workers,
+            "Stages": {name: {"Seconds": seconds, "Count": count}
+                       for name, (seconds, count) in sorted(self.stages.items(), key=lambda item: -item[1][0])},
+            "Counters": self.counters,
+            "SlowestDiffFiles": get_slowest(self.diff_files, top_n),
+            "SlowestAnalysisFiles": get_slowest(self.analysis_files, top_n),
+            "DiffFiles": self.diff_files,
+            "AnalysisFiles": self.analysis_files
+        }
+
+    def write_report(self, report_path, elapsed_seconds, num_workers, top_n=20):
+        tmp_report_path = f"{report_path}.{os.getpid()}.tmp"
+        with open(tmp_report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(elapsed_seconds, num_workers, top_n), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_report_path, report_path)
+
+    def print_summary(self, top_n=10):
+        print("Stage seconds (summed over workers):")
+        for name, (seconds, count) in sorted(self.stages.items(), key=lambda item: -item[1][0]):
+            print(f"    {name:<28} {seconds:>10.2f}s {count:>10}x")
+
+        print(f"Slowest {top_n} diff files:")
+        for diff_file in get_slowest(self.diff_files, top_n):
+            print(f"    {diff_file['Seconds']:>8.2f}s  {diff_file['Repo']:<30} {diff_file['AnalyzerNuGet']:<40} "
+                  f"{diff_file['DiagnosticID']:<10} {diff_file['Filename']}")
+
+        print(f"Slowest {top_n} analysis files:")
+        for analysis_file in get_slowest(self.analysis_files, top_n):
+            print(f"    {analysis_file['Seconds']:>8.2f}s  {analysis_file['Repo']:<30} "
+                  f"{analysis_file['AnalyzerNuGet']:<40} {analysis_file['Filename']}")
+
+        diff_files_with_rss = [diff_file for diff_file in self.diff_files if diff_file.get("PeakRssBytes")]
+        if diff_files_with_rss:
+            print(f"Largest peak RSS, {top_n} diff files:")
+            for diff_file in sorted(diff_files_with_rss, key=lambda file: -file["PeakRssBytes"])[:top_n]:
+                print(f"    {diff_file['PeakRssBytes'] / 2**20:>8.0f}MB {diff_file['Repo']:<30} "
+                      f"{diff_file['AnalyzerNuGet']:<40} {diff_file['DiagnosticID']:<10} {diff_file['Filename']}")
+
+
+def get_slowest(files, top_n):
+    return sorted(files, key=lambda file: -file["Seconds"])[:top_n]
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+    """PROCESS_MEMORY_COUNTERS of GetProcessMemoryInfo"""
+    _fields_ = [("cb", ctypes.c_uint32), ("PageFaultCount", ctypes.c_uint32)] + [
+        (name, ctypes.c_size_t) for name in (
+            "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+            "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+
+def get_windows_rss_bytes():
+    """Working set of this process, None if unknown"""
+    try:
+        kernel32 = ctypes.WinDLL("kernel32")
+        kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+        kernel32.K32GetProcessMemoryInfo.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(ProcessMemoryCounters), ctypes.c_uint32]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters.WorkingSetSize
+    except (OSError, AttributeError):
+        return None
+
+
+def get_rss_bytes():
+    """Current resident set size of this process, None if unknown"""
+    if os.name == "nt":
+        return get_windows_rss_bytes()
+    try:
+        with open("/proc/self/statm", 'rb') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssMonitor:
+    """Samples the RSS of the process, e.g. after every patched file, and keeps its peak"""
+
+    def __init__(self, max_rss_bytes=None):
+        self.max_rss_bytes = max_rss_bytes
+        self.peak_rss_bytes = None
+        self.sample()
+
+    def sample(self):
+        rss_bytes = get_rss_bytes()
+        if rss_bytes is not None and (self.peak_rss_bytes is None or rss_bytes > self.peak_rss_bytes):
+            self.peak_rss_bytes = rss_bytes
+        return rss_bytes
+
+    def is_above_ceiling(self):
+        """Samples the RSS, False if there is no ceiling or the RSS is unknown"""
+        rss_bytes = self.sample()
+        return self.max_rss_bytes is not None and rss_bytes is not None and rss_bytes > self.max_rss_bytes
+
+
+@contextmanager
+def profiling(profile_mode, profile_path):
+    """
+    Profiles the block with cProfile (stats are dumped to `profile_path`) or tracemalloc.
+    Yields a dict, which afterwards holds the details to add to the report.
+    """
+
+    details = {}
+    if profile_mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield details
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            details["ProfilePath"] = profile_path
+    elif profile_mode == "tracemalloc":
+        tracemalloc.start()
+        try:
+            yield details
+        finally:
+            details["PeakTracedBytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    else:
+        yield details
@@ -0,0 +1,64 @@
+import unittest
+import json
+import tempfile
+from collections import namedtuple
+from profiling_unification import UnificationProfile, RssMonitor, profiling, get_rss_bytes
+
+
+DiffEntry = namedtuple("DiffEntry", ["Filename", "Repo", "AnalyzerNuGet", "DiagnosticID"])
+
+
+class TestUnificationProfile(unittest.TestCase):
+
+    def test_stages_and_merge(self):
+        profile = UnificationProfile()
+        with profile.stage("parse_diff"):
+            pass
+        self.assertEqual(list(profile.time_iterator("parse_diff", [1, 2, 3])), [1, 2, 3])
+        profile.count("Datapoints", 2)
+        profile.add_diff_file(DiffEntry("slow.diff", "acat", "Nuget.1.0", "SA1101"), 2.0, NumDatapoints=2)
+
+        worker_profile = UnificationProfile()
+        worker_profile.add_stage_time("parse_diff", 1.0)
+        worker_profile.count("Datapoints")
+        worker_profile.add_diff_file(DiffEntry("fast.diff", "acat", "Nuget.1.0", "SA1101"), 1.0, NumDatapoints=1)
+        profile.merge(worker_profile)
+
+        self.assertEqual(profile.stages["parse_diff"][1], 5)
+        self.assertGreaterEqual(profile.stages["parse_diff"][0], 1.0)
+        self.assertEqual(profile.counters, {"Datapoints": 3})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile.write_report(f"{tmp_dir}/report.json", 3.0, 2, top_n=1)
+            with open(f"{tmp_dir}/report.json", encoding='utf-8') as f:
+                report = json.load(f)
+        self.assertEqual([diff_file["Filename"] for diff_file in report["SlowestDiffFiles"]], ["slow.diff"])
+        self.assertEqual(len(report["DiffFiles"]), 2)
+
+    def test_profiling(self):
+        with profiling("tracemalloc", None) as details:
+            data = [0] * 100000
+        self.assertGreater(details["PeakTracedBytes"], 100000)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with profiling("cprofile", f"{tmp_dir}/diff.prof") as details:
+                sorted(data)
+            self.assertEqual(details, {"ProfilePath": f"{tmp_dir}/diff.prof"})
+
+        with profiling(None, None) as details:
+            pass
+        self.assertEqual(details, {})
+
+    @unittest.skipIf(get_rss_bytes() is None, "RSS is only known on Linux")
+    def test_rss_monitor(self):
+        rss_monitor = RssMonitor()
+        self.assertGreater(rss_monitor.peak_rss_bytes, 0)
+        self.assertFalse(rss_monitor.is_above_ceiling())
+
+        rss_monitor = RssMonitor(max_rss_bytes=1)
+        self.assertTrue(rss_monitor.is_above_ceiling())
+        self.assertGreaterEqual(rss_monitor.peak_rss_bytes, rss_monitor.sample())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+"""
+This file serves the source files of the analyzed repositories (submodule_repos_to_analyze)
+to the unification and tokenization. Every file is memory-mapped once and indexed by line,
+so that line counts, line slices and the full text do not require reading it again.
+
+On Windows, a mapped file can be neither deleted nor replaced, e.g. by a checkout of the
+repository, so the files are read into memory there instead of keeping up to
+`max_open_files` of them mapped.
+
+Lines are split like open() in text mode does (universal newlines: '\r\n', '\r' and '\n'
+are all returned as '\n'). Files are decoded as UTF-8, or else with the locale's encoding
+like open() does by default (e.g. cp1252 on Windows); files that neither can decode raise
+UnicodeDecodeError.
+
+Instead of the checked out working tree, files can also be read at the commit recorded in
+the dataset, straight from the git object database (see GitSourceFileCache).
+
+"""
+
+import codecs
+import locale
+import mmap
+import os
+import re
+import subprocess
+from collections import OrderedDict
+
+
+NEWLINE_REGEX = re.compile(rb"\r\n|\r|\n")
+
+
+class SourceFile:
+
+    def __init__(self, filepath, content=None):
+        """Maps the file at `filepath`, unless its `content` is already given as bytes"""
+        self.filepath = filepath
+
+        if content is not None:
+            self.content = content
+        else:
+            with open(filepath, 'rb') as f:
+                # Empty files cannot be mapped
+                if os.name == "nt" or not os.fstat(f.fileno()).st_size:
+                    self.content = f.read()
+                else:
+                    self.content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            # Only validating here, the decoded content is not kept
+            str(self.content[:], 'utf-8')
+        except UnicodeDecodeError:
+            locale_encoding = locale.getpreferredencoding(False)
+            try:
+                if codecs.lookup(locale_encoding).name == "utf-8":
+                    raise
+                # Kept as UTF-8 instead, which is rare enough to not need mapping
+                text = str(self.content[:], locale_encoding)
+            finally:
+                self.close()
+            self.content = text.encode('utf-8')
+
+        # Offsets of the first byte of each line. UTF-8 continuation bytes can never be
+        # '\r' or '\n', so the bytes can be split directly.
+        self.line_offsets = [0] + [match.end()
+                                   for match in NEWLINE_REGEX.finditer(self.content)]
+        if self.line_offsets[-1] == len(self.content):
+            # File is empty or ends with a newline
+            del self.line_offsets[-1]
+
+    @property
+    def num_lines(self):
+        """Same as len(list(f))"""
+        return len(self.line_offsets)
+
+    def lines(self, start, stop):
+        """Same as list(f)[start:stop], i.e. 0-indexed and stop is not included"""
+        start, stop, _ = slice(start, stop).indices(self.num_lines)
+        if start >= stop:
+            return []
+
+        end_offset = self.line_offsets[stop] if stop < self.num_lines else len(self.content)
+        lines = decode_source(self.content[self.line_offsets[start]:end_offset]).split("\n")
+
+        # The last element is either empty (line ended with a newline) or the last line of the file
+        if lines[-1] == "":
+            del lines[-1]
+            return [line + "\n" for line in lines]
+        return [line + "\n" for line in lines[:-1]] + [lines[-1]]
+
+    def text(self):
+        """Same as f.read()"""
+        return decode_source(self.content[:])
+
+    def close(self):
+        if isinstance(self.content, mmap.mmap):
+            self.content.close()
+
+
+def decode_source(content):
+    return str(content, 'utf-8').replace("\r\n", "\n").replace("\r", "\n")
+
+
+class SourceFileCache:
+    """Keeps the `max_open_files` most recently used source files mapped"""
+
+    def __init__(self, max_open_files=64):
+        self.max_open_files = max_open_files
+        self.source_files = OrderedDict()
+
+    def get(self, filepath):
+        if filepath in self.source_files:
+            self.source_files.move_to_end(filepath)
+            return self.source_files[filepath]
+
+        source_file = self.load_source_file(filepath)
+        self.source_files[filepath] = source_file
+        if len(self.source_files) > self.max_open_files:
+            _, evicted_source_file = self.source_files.popitem(last=False)
+            evicted_source_file.close()
+        return source_file
+
+    def load_source_file(self, filepath):
+        return SourceFile(filepath)
+
+    def clear(self):
+        for source_file in self.source_files.values():
+            source_file.close()
+        self.source_files.clear()
+
+
+class GitBlobReader:
+    """
+    One long-lived `git cat-file --batch` process per repository, which returns the
+    content of a file at a given commit without checking it out.
+    """
+
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.process = subprocess.Popen(["git", "-C", repo_dir, "cat-file", "--batch"],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, commit, path):
+        """Raises KeyError if `path` does not exist at `commit`"""
+
+        self.process.stdin.write(f"{commit}:{path}\n".encode('utf-8'))
+        self.process.stdin.flush()
+
+        # "<sha> blob <size>", or "<object> missing" where the object name can contain spaces
+        header = self.process.stdout.readline().decode('utf-8').split()
+        if header[-1] in ("missing", "ambiguous") or len(header) != 3:
+            raise KeyError(f"Not in git repository {self.repo_dir}: {commit}:{path}")
+
+        content = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1)  # Trailing newline
+        if header[1] != "blob":
+            raise KeyError(f"Not a file in git repository {self.repo_dir}: {commit}:{path}")
+        return content
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+class GitSourceFileCache(SourceFileCache):
+    """
+    Keeps the `max_open_files` most recently used blobs in memory. Keys are
+    (repo_dir, commit, path) instead of filepaths.
+    """
+
+    def __init__(self, max_open_files=64):
+        super().__init__(max_open_files)
+        self.blob_readers = {}
+
+    def load_source_file(self, key):
+        repo_dir, commit, path = key
+        if repo_dir not in self.blob_readers:
+            self.blob_readers[repo_dir] = GitBlobReader(repo_dir)
+        content = self.blob_readers[repo_dir].read(commit, path)
+        return SourceFile(f"{repo_dir}/{path}@{commit}", content)
+
+    def clear(self):
+        super().clear()
+        for blob_reader in self.blob_readers.values():
+            blob_reader.close()
+        self.blob_readers.clear()
+
+
+# Shared by all stages of the pipeline within one process
+source_file_cache = SourceFileCache()
+git_source_file_cache = GitSourceFileCache()
+
+
+def get_source_file(repo_dir, commit, path, at_commit):
+    """
+    Returns the SourceFile of `path` either at `commit` (from the git object database)
+    or as currently checked out in `repo_dir`.
+    """
+    if at_commit:
+        return git_source_file_cache.get((repo_dir, commit, path))
+    return source_file_cache.get(f"{repo_dir}/{path}")
@@ -0,0 +1,133 @@
+import unittest
+import os
+import tempfile
+import subprocess
+from unittest import mock
+from reading_source_files import SourceFile, SourceFileCache, GitBlobReader, GitSourceFileCache
+
+
+class TestSourceFile(unittest.TestCase):
+
+    contents = [
+        b"",
+        b"\n",
+        b"int i;",
+        b"int i;\nint j;\n",
+        b"int i;\r\nint j;\r\n\r\nint k;",
+        b"int i;\rint j;\n\r\nint k;\r",
+        "// äöü\nstring s = \"€\";\n".encode('utf-8'),
+        b"\xef\xbb\xbfusing System;\n"
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, content):
+        filepath = os.path.join(self.tmp_dir.name, name)
+        with open(filepath, 'wb') as f:
+            f.write(content)
+        return filepath
+
+    def test_same_as_open(self):
+        for num, content in enumerate(self.contents):
+            filepath = self.write_file(f"{num}.cs", content)
+            with open(filepath, encoding='utf-8') as f:
+                file_list = list(f)
+            with open(filepath, encoding='utf-8') as f:
+                file_text = f.read()
+
+            source_file = SourceFile(filepath)
+            self.assertEqual(source_file.num_lines, len(file_list))
+            self.assertEqual(source_file.text(), file_text)
+            for start in range(-2, len(file_list) + 2):
+                for stop in range(-2, len(file_list) + 2):
+                    self.assertEqual(source_file.lines(start, stop), file_list[start:stop])
+            source_file.close()
+
+    def test_invalid_utf8(self):
+        filepath = self.write_file("invalid.cs", b"int \xff;\n")
+        with mock.patch("locale.getpreferredencoding", return_value="UTF-8"):
+            with self.assertRaises(UnicodeDecodeError):
+                SourceFile(filepath)
+
+    def test_locale_encoding(self):
+        # Like open() without encoding on Windows
+        filepath = self.write_file("cp1252.cs", "// caf\u00e9\r\nstring s = \"\u20ac\";\r\n".encode('cp1252'))
+        with mock.patch("locale.getpreferredencoding", return_value="cp1252"):
+            source_file = SourceFile(filepath)
+        self.assertEqual(source_file.num_lines, 2)
+        self.assertEqual(source_file.lines(1, 2), ["string s = \"\u20ac\";\n"])
+        self.assertEqual(source_file.text(), "// caf\u00e9\nstring s = \"\u20ac\";\n")
+
+    def test_not_mapped_on_windows(self):
+        filepath = self.write_file("0.cs", b"int i;\n")
+        with mock.patch("os.name", "nt"):
+            source_file = SourceFile(filepath)
+        self.assertIsInstance(source_file.content, bytes)
+        os.remove(filepath)
+        self.assertEqual(source_file.text(), "int i;\n")
+
+    def test_lru_eviction(self):
+        cache = SourceFileCache(max_open_files=2)
+        filepaths = [self.write_file(f"{num}.cs", b"int i;\n") for num in range(3)]
+
+        first_source_file = cache.get(filepaths[0])
+        self.assertIs(cache.get(filepaths[0]), first_source_file)
+        cache.get(filepaths[1])
+        cache.get(filepaths[2])
+        self.assertEqual(list(cache.source_files), filepaths[1:])
+        cache.clear()
+
+
+class TestGitSourceFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo_dir = self.tmp_dir.name
+        self.git("init", "-q")
+        self.commits = []
+        for content in (b"int i;\n", b"int i;\r\nint j;\r\n"):
+            os.makedirs(f"{self.repo_dir}/src dir", exist_ok=True)
+            with open(f"{self.repo_dir}/src dir/Program.cs", 'wb') as f:
+                f.write(content)
+            self.git("add", "-A")
+            self.git("-c", "user.name=test", "-c", "user.email=test@test", "commit", "-q", "-m", "commit")
+            self.commits.append(self.git("rev-parse", "HEAD").strip())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def git(self, *args):
+        return subprocess.run(["git", "-C", self.repo_dir] + list(args),
+                              check=True, stdout=subprocess.PIPE).stdout.decode('utf-8')
+
+    def test_read_blobs(self):
+        blob_reader = GitBlobReader(self.repo_dir)
+        self.assertEqual(blob_reader.read(self.commits[0], "src dir/Program.cs"), b"int i;\n")
+        self.assertEqual(blob_reader.read(self.commits[1], "src dir/Program.cs"), b"int i;\r\nint j;\r\n")
+        with self.assertRaises(KeyError):
+            blob_reader.read(self.commits[0], "Missing.cs")
+        with self.assertRaises(KeyError):
+            blob_reader.read(self.commits[0], "src dir/Missing.cs")
+        with self.assertRaises(KeyError):
+            blob_reader.read(self.commits[0], "src dir/Missing 1 2.cs")
+        with self.assertRaises(KeyError):
+            blob_reader.read(self.commits[0], "src dir")
+        # Still in sync after errors
+        self.assertEqual(blob_reader.read(self.commits[0], "src dir/Program.cs"), b"int i;\n")
+        blob_reader.close()
+
+    def test_source_file_at_commit(self):
+        cache = GitSourceFileCache(max_open_files=1)
+        self.assertEqual(cache.get((self.repo_dir, self.commits[0], "src dir/Program.cs")).num_lines, 1)
+        self.assertEqual(cache.get((self.repo_dir, self.commits[1], "src dir/Program.cs")).lines(0, 2),
+                         ["int i;\n", "int j;\n"])
+        self.assertEqual(len(cache.source_files), 1)
+        cache.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -229,18 +229,47 @@ class CSharpAndCommentsLexer(UnprocessedTokensMixin, CSharpLexer):
     @staticmethod
     def index_identifier_token(token_type, value, index_dict):
 
-        all_name_types = [Name] + [getattr(Name, attribute) for attribute in dir(
-            Name) if not attribute.startswith("_") and not attribute.islower()]
-        if token_type not in all_name_types:
+        if token_type not in NAME_TOKEN_TYPES:
             return token_type, value
 
         if value in index_dict:
             return token_type, index_dict[value]
 
-        new_index_name = f"VAR-{len(index_dict.keys())}"
+        new_index_name = f"VAR-{len(index_dict)}"
         index_dict[value] = new_index_name
         return token_type, new_index_name
 
+    @staticmethod
+    def index_identifier_tokens(tokens, index_dict):
+        """
+        Same as index_identifier_token for a whole list of (token_type, value), in one call.
+        `index_dict` is shared, e.g. by the file context, target lines and diagnostic messages
+        of a datapoint.
+        """
+
+        indexed_tokens = []
+        for token_type, value in tokens:
+            if token_type in NAME_TOKEN_TYPES:
+                index_name = index_dict.get(value)
+                if index_name is None:
+                    index_name = f"VAR-{len(index_dict)}"
+                    index_dict[value] = index_name
+                value = index_name
+            indexed_tokens.append((token_type, value))
+        return indexed_tokens
+
+
+def get_token_subtypes(token_type):
+    """`token_type` and all its subtypes, i.e. all token types for which `token in token_type` is True"""
+    token_types = {token_type}
+    for subtype in token_type.subtypes:
+        token_types |= get_token_subtypes(subtype)
+    return token_types
+
+
+# Computed once, after the lexers above created all the token types they emit
+NAME_TOKEN_TYPES = frozenset(get_token_subtypes(Name))
+
 
 def run_only_language_lexer(original_file_string):
     textlex = LanguageLexer()
@@ -1,7 +1,8 @@
 import unittest
 import requests
 import json
-from regex_lexer import CSharpAndCommentsLexer
+from pygments.token import Name
+from regex_lexer import CSharpAndCommentsLexer, NAME_TOKEN_TYPES
 from regex_lexer_camelcase import CSharpAndCommentsCamelcaseLexer
 from tokenizing_unified_dataset import Pipeline
 
@@ -235,6 +236,21 @@ RedirectFailed = 302,"""
                            "VAR-1", "WHITESPACE", "=", "WHITESPACE", "3", "0", "2", ",", "NEWLINE"]
         self.run_single_test(self.CODE_ENUMS, true_token_list, index_vars=True)
 
+    def test_index_identifier_tokens(self):
+        self.assertTrue(all(token_type in Name for token_type in NAME_TOKEN_TYPES))
+        self.assertTrue({Name, Name.Function, Name.Attribute, Name.Class, Name.Namespace} <= NAME_TOKEN_TYPES)
+
+        # One table across several token lists, as for the context, target lines and messages of a datapoint
+        code_tokens = list(self.standard_lexer.get_tokens(self.CODE_ENUMS))
+        comment_tokens = list(self.standard_lexer.get_tokens(self.CODE_MULTILINE_BLOCK_COMMENT))
+        index_dict, batch_index_dict = {}, {}
+        for tokens in (code_tokens, comment_tokens):
+            self.assertEqual(CSharpAndCommentsLexer.index_identifier_tokens(tokens, batch_index_dict),
+                             [CSharpAndCommentsLexer.index_identifier_token(token_type, value, index_dict)
+                              for token_type, value in tokens])
+        self.assertEqual(batch_index_dict, index_dict)
+        self.assertEqual(len(index_dict), 4)
+
     CODE_PRAGMA = """#pragma warning disable 436 // SuppressUnmanagedCodeSecurityAttribute defined in source and mscorlib"""
 
     def test_pragma(self):
@@ -0,0 +1,336 @@
+"""
+This file runs the Roslynator analysis of the raw dataset from Python, instead of the
+nested loops of create_raw_dataset.ps1. One job per (repo, solution, analyzer package)
+is run on a bounded pool of workers, with a timeout and retries per job. The duration,
+output size and status of every job are recorded in a SQLite results database
+(raw_dataset/analysis_runs.sqlite), and completed jobs are skipped by the next run.
+
+The command of a job is a template, formatted with the fields of AnalysisJob (and
+OutputPath, the temporary file the analysis is written to), so that any executable
+can stand in for Roslynator, e.g. a stub analyzer in tests on Linux.
+
+Analysis files and empty markers are written to the same places as by create_raw_dataset.ps1,
+i.e. the fixes (RunAndSaveFix) can still be created from them. Fixes modify the working
+tree of the repo, so they are not run by this scheduler.
+
+"""
+
+import os
+import csv
+import json
+import time
+import sqlite3
+import threading
+import subprocess
+from itertools import zip_longest
+from multiprocessing.pool import ThreadPool
+from collections import namedtuple
+from compressing_raw_dataset import COMPRESSION_EXTENSIONS
+from planning_solution_analysis import find_solution_files
+from filtering_fixable_diagnostics import FIXABLE_DIAGNOSTICS_PATH, load_fixable_diagnostics
+
+
+# Increase whenever the tables change, forces the results to be recreated
+RESULTS_SCHEMA_VERSION = 1
+
+ROSLYNATOR_ANALYZE_COMMAND = [
+    "C:\\Users\\vlohse\\.nuget\\packages\\roslynator.commandline\\0.1.1\\tools\\net48\\Roslynator.exe", "analyze",
+    "--msbuild-path", "C:\\Program Files (x86)\\Microsoft Visual Studio\\2019\\Community\\MSBuild\\Current\\Bin",
+    "{SolutionFilepath}",
+    "--output", "{OutputPath}",
+    # Mostly compiler diagnostics (CSxxxx)
+    "--report-not-configurable",
+    # Only use our own analyzer assemblies
+    "--ignore-analyzer-references",
+    "--analyzer-assemblies", "{NuGetPath}",
+    "-v", "quiet"]
+MSBUILD_RESTORE_COMMAND = [
+    "C:\\Program Files (x86)\\Microsoft Visual Studio\\2019\\Community\\MSBuild\\Current\\Bin\\MSBuild.exe",
+    "{SolutionFilepath}", "/t:Restore"]
+
+# JobID is the OUTPUT_FILENAME of create_raw_dataset.ps1
+AnalysisJob = namedtuple("AnalysisJob", [
+    "JobID", "Repo", "SolutionFilepath", "Commit", "AnalyzerNuGet", "NuGetPath",
+    "AnalysisFilepath", "AnalysisFilepathEmpty"])
+
+# Status: "analysed", "empty" (no analysis file), "failed" or "timeout"
+JobResult = namedtuple("JobResult", [
+    "JobID", "Repo", "SolutionFilepath", "AnalyzerNuGet", "Status", "Attempts", "Seconds",
+    "OutputBytes", "ReturnCode", "Error"])
+
+COMPLETED_STATUSES = ("analysed", "empty")
+
+
+def get_repo_commit(repo_dir):
+    return subprocess.run(["git", "-C", repo_dir, "log", "-n", "1", "--pretty=format:%H"],
+                          stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').strip()
+
+
+def build_job_matrix(repos, repositories_dir, analyzer_packages, analysis_dir, analysis_empty_dir,
+                     solution_plan=None, fixable_diagnostics=None):
+    """
+    One AnalysisJob per (repo, solution, analyzer package). `analyzer_packages` is
+    [(NuGet full name, NuGet path), ...]. With `solution_plan` (see planning_solution_analysis.py),
+    only the planned solutions of the repos in the plan are analysed. With `fixable_diagnostics`
+    (see filtering_fixable_diagnostics.py), packages without any fixable diagnostic are skipped.
+    """
+
+    if fixable_diagnostics is not None:
+        unfixable_packages = [nuget_full_name for nuget_full_name, _ in analyzer_packages
+                              if nuget_full_name in fixable_diagnostics and not fixable_diagnostics[nuget_full_name]]
+        print(f"Num analyzer packages without CodeFixProvider, skipped: {len(unfixable_packages)}")
+        analyzer_packages = [(nuget_full_name, nuget_path) for nuget_full_name, nuget_path in analyzer_packages
+                             if nuget_full_name not in unfixable_packages]
+
+    jobs = []
+    job_ids = set()
+    for repo in repos:
+        repo_dir = f"{repositories_dir}/{repo}"
+        if not os.path.isdir(repo_dir):
+            print(f"Repo not cloned, skipping it: {repo}")
+            continue
+        commit = get_repo_commit(repo_dir)
+
+        solution_paths = find_solution_files(repo_dir)
+        # Repos planned without solutions are analysed with all of them, as by create_raw_dataset.ps1
+        if solution_plan is not None and solution_plan["Repos"].get(repo, {}).get("Solutions"):
+            planned_solutions = set([solution_path.lower() for solution_path in solution_plan["Repos"][repo]["Solutions"]])
+            solution_paths = [solution_path for solution_path in solution_paths
+                              if solution_path.lower() in planned_solutions]
+
+        for solution_path in solution_paths:
+            for nuget_full_name, nuget_path in analyzer_packages:
+                job_id = f"{repo}__{os.path.basename(solution_path)}__{commit}__{nuget_full_name}"
+                if job_id in job_ids:
+                    # Same output filename, as in create_raw_dataset.ps1
+                    print(f"Solution filename analysed already, skipping it: {repo_dir}/{solution_path}")
+                    continue
+                job_ids.add(job_id)
+                jobs.append(AnalysisJob(
+                    job_id, repo, f"{repo_dir}/{solution_path}", commit, nuget_full_name, nuget_path,
+                    f"{analysis_dir}/{job_id}.xml", f"{analysis_empty_dir}/{job_id}.xml"))
+
+    return jobs
+
+
+class CommandRunner:
+    """
+    Runs one job with the command template `command`; every argument is formatted with the
+    fields of the job and OutputPath. The command must write its output to OutputPath,
+    which is renamed to the analysis file if the command succeeds.
+    """
+
+    def __init__(self, command, timeout_seconds=None, max_attempts=1, retry_delay_seconds=0):
+        self.command = command
+        self.timeout_seconds = timeout_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+
+    def run_once(self, job, output_path):
+        """Returns (status, return code, error). Without `output_path`, the status of a successful command is "analysed"."""
+
+        arguments = [argument.format(OutputPath=output_path, **job._asdict()) for argument in self.command]
+        try:
+            completed_process = subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                               timeout=self.timeout_seconds)
+        except subprocess.TimeoutExpired:
+            return "timeout", None, f"Timed out after {self.timeout_seconds}s"
+        except OSError as e:
+            return "failed", None, str(e)
+
+        if completed_process.returncode != 0:
+            error = completed_process.stderr or completed_process.stdout
+            return "failed", completed_process.returncode, error.decode('utf-8', 'replace')[-2000:]
+        if output_path is not None and not os.path.isfile(output_path):
+            return "empty", completed_process.returncode, None
+        return "analysed", completed_process.returncode, None
+
+    def run(self, job):
+        """Runs the job until it completes or `max_attempts` are used up, returns its JobResult"""
+
+        start_time = time.monotonic()
+        output_path = f"{job.AnalysisFilepath}.{os.getpid()}.tmp"
+        for attempt in range(1, self.max_attempts + 1):
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+            status, return_code, error = self.run_once(job, output_path)
+            if status in COMPLETED_STATUSES:
+                break
+            print(f"Job {status} (attempt {attempt}/{self.max_attempts}): {job.JobID}; Error: {error}")
+            if attempt < self.max_attempts:
+                time.sleep(self.retry_delay_seconds)
+
+        output_bytes = 0
+        if status == "analysed":
+            output_bytes = os.stat(output_path).st_size
+            os.replace(output_path, job.AnalysisFilepath)
+        elif status == "empty":
+            # As Out-File in create_raw_dataset.ps1
+            with open(job.AnalysisFilepathEmpty, 'w'):
+                pass
+        elif os.path.isfile(output_path):
+            os.remove(output_path)
+
+        return JobResult(job.JobID, job.Repo, job.SolutionFilepath, job.AnalyzerNuGet, status, attempt,
+                         time.monotonic() - start_time, output_bytes, return_code, error)
+
+
+class AnalysisRunResults:
+
+    def __init__(self, results_path):
+        self.connection = sqlite3.connect(results_path)
+
+        schema_version = None
+        try:
+            schema_version = self.connection.execute(
+                "SELECT Value FROM metadata WHERE Key = 'SchemaVersion'").fetchone()
+        except sqlite3.DatabaseError:
+            pass
+        if schema_version is None or int(schema_version[0]) != RESULTS_SCHEMA_VERSION:
+            self.create_tables()
+
+    def create_tables(self):
+        with self.connection:
+            for table in ("metadata", "job_results"):
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.execute("CREATE TABLE metadata (Key TEXT PRIMARY KEY, Value TEXT)")
+            self.connection.execute(
+                "CREATE TABLE job_results (JobID TEXT PRIMARY KEY, Repo TEXT, SolutionFilepath TEXT, "
+                "AnalyzerNuGet TEXT, Status TEXT, Attempts INTEGER, Seconds REAL, OutputBytes INTEGER, "
+                "ReturnCode INTEGER, Error TEXT)")
+            self.connection.execute("INSERT INTO metadata VALUES (?, ?)",
+                                    ("SchemaVersion", str(RESULTS_SCHEMA_VERSION)))
+
+    def get_completed_job_ids(self):
+        return set([row[0] for row in self.connection.execute(
+            f"SELECT JobID FROM job_results WHERE Status IN ({', '.join(['?'] * len(COMPLETED_STATUSES))})",
+            COMPLETED_STATUSES)])
+
+    def get_results(self):
+        return [JobResult(*row) for row in self.connection.execute("SELECT * FROM job_results ORDER BY JobID")]
+
+    def add_result(self, job_result):
+        """Committed right away, so that an interrupted run keeps its completed jobs"""
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO job_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    job_result)
+
+    def close(self):
+        self.connection.close()
+
+
+def is_job_completed(job, completed_job_ids):
+    """Also jobs completed by create_raw_dataset.ps1, i.e. without a result, and compressed analysis files"""
+    return (job.JobID in completed_job_ids or os.path.isfile(job.AnalysisFilepathEmpty)
+            or any([os.path.isfile(f"{job.AnalysisFilepath}{compression_extension}")
+                    for compression_extension in ("",) + COMPRESSION_EXTENSIONS]))
+
+
+def interleave_by_repo(jobs):
+    """Jobs of different repos take turns, e.g. [a1, a2, b1] -> [a1, b1, a2]"""
+    jobs_by_repo = {}
+    for job in jobs:
+        jobs_by_repo.setdefault(job.Repo, []).append(job)
+    return [job for jobs_in_turn in zip_longest(*jobs_by_repo.values()) for job in jobs_in_turn if job is not None]
+
+
+def run_jobs(jobs, runner, results, num_workers, prepare_runner=None):
+    """
+    Runs all jobs that are not completed yet. With `prepare_runner` (e.g. MSBuild restore),
+    every solution is prepared once before its first job. Like create_raw_dataset.ps1, repos run
+    in parallel but the jobs (and preparations) of one repo never run at the same time, since the
+    solutions of a repo share projects and build into the same obj/ directories.
+    Returns the JobResults of this run.
+    """
+
+    completed_job_ids = results.get_completed_job_ids()
+    jobs_to_do = [job for job in jobs if not is_job_completed(job, completed_job_ids)]
+    print(f"Num jobs: {len(jobs)}")
+    print(f"Num jobs completed already: {len(jobs) - len(jobs_to_do)}")
+    print(f"Num jobs to run: {len(jobs_to_do)}")
+
+    repo_locks = {job.Repo: threading.Lock() for job in jobs_to_do}
+    prepared_solutions = set()
+
+    def run_job(job):
+        with repo_locks[job.Repo]:
+            if prepare_runner is not None and job.SolutionFilepath not in prepared_solutions:
+                prepared_solutions.add(job.SolutionFilepath)
+                status, _, error = prepare_runner.run_once(job, None)
+                if status not in COMPLETED_STATUSES:
+                    print(f"Preparing solution {status}: {job.SolutionFilepath}; Error: {error}")
+            return runner.run(job)
+
+    pool = ThreadPool(num_workers)
+    try:
+        job_results = []
+        # Unordered, so that one slow repo does not hold back the results of the others, and
+        # interleaved, so that the workers don't all wait for the lock of the same repo
+        for job_result in pool.imap_unordered(run_job, interleave_by_repo(jobs_to_do)):
+            results.add_result(job_result)
+            job_results.append(job_result)
+            print(f"{job_result.Status}: {job_result.JobID} ({job_result.Seconds:.1f}s, "
+                  f"{job_result.OutputBytes / 2**20:.2f} MB)")
+    finally:
+        pool.close()
+        pool.join()
+
+    return job_results
+
+
+def print_summary(job_results, top_n=10):
+    num_jobs_by_status = {}
+    for job_result in job_results:
+        num_jobs_by_status[job_result.Status] = num_jobs_by_status.get(job_result.Status, 0) + 1
+
+    print("########")
+    print(f"Num jobs run: {len(job_results)}")
+    for status, num_jobs in sorted(num_jobs_by_status.items()):
+        print(f"    {status}: {num_jobs}")
+    print(f"Job seconds (summed over workers): {sum([job_result.Seconds for job_result in job_results]):.1f}")
+    print(f"MB of analysis files: {sum([job_result.OutputBytes for job_result in job_results]) / 2**20:.2f}")
+    print(f"Slowest {top_n} jobs:")
+    for job_result in sorted(job_results, key=lambda job_result: -job_result.Seconds)[:top_n]:
+        print(f"    {job_result.Seconds:>8.1f}s  {job_result.Status:<8} {job_result.JobID}")
+
+
+if __name__ == "__main__":
+
+    repos_csv = "github_repos.csv"
+    repositories_dir = "submodule_repos_to_analyze"
+    analyzer_packages_dir = "nuget_analyzer_packages"
+    relevant_analyzer_packages_path = "nuget_packages_relevant_sources.txt"
+    solution_plan_path = "solution_analysis_plan.json"
+    analysis_dir = "raw_dataset/analysis_files"
+    analysis_empty_dir = "raw_dataset/analysis_files_empty"
+    results_path = "raw_dataset/analysis_runs.sqlite"
+
+    num_workers = 4
+    timeout_seconds = 4 * 60 * 60
+    max_attempts = 2
+
+    os.makedirs(analysis_dir, exist_ok=True)
+    os.makedirs(analysis_empty_dir, exist_ok=True)
+
+    with open(repos_csv, newline='') as f:
+        repos = [row["RepoName"] for row in csv.DictReader(f)]
+    with open(relevant_analyzer_packages_path, 'r', encoding='utf-8') as f:
+        relevant_analyzer_packages = set([line.strip() for line in f if line.strip()])
+    analyzer_packages = sorted([(f.name, os.path.abspath(f.path)) for f in os.scandir(analyzer_packages_dir)
+                                if f.name in relevant_analyzer_packages])
+    solution_plan = None
+    if os.path.isfile(solution_plan_path):
+        with open(solution_plan_path, 'r', encoding='utf-8') as f:
+            solution_plan = json.load(f)
+    fixable_diagnostics = None
+    if os.path.isfile(FIXABLE_DIAGNOSTICS_PATH):
+        fixable_diagnostics = load_fixable_diagnostics(FIXABLE_DIAGNOSTICS_PATH)
+
+    jobs = build_job_matrix(repos, repositories_dir, analyzer_packages, analysis_dir, analysis_empty_dir,
+                            solution_plan, fixable_diagnostics)
+    results = AnalysisRunResults(results_path)
+    job_results = run_jobs(
+        jobs, CommandRunner(ROSLYNATOR_ANALYZE_COMMAND, timeout_seconds, max_attempts, retry_delay_seconds=60),
+        results, num_workers, prepare_runner=CommandRunner(MSBUILD_RESTORE_COMMAND, timeout_seconds))
+    results.close()
+    print_summary(job_results)
@@ -0,0 +1,146 @@
+import unittest
+import os
+import sys
+import subprocess
+import tempfile
+from planning_solution_analysis_tests import write_solution_file
+from compressing_raw_dataset import compress_file
+from scheduling_analysis_runs import build_job_matrix, CommandRunner, AnalysisRunResults, run_jobs
+
+
+# Stands in for Roslynator: analyze <solution> --output <path> --analyzer-assemblies <nuget path>,
+# and for MSBuild: restore <solution>
+STUB_ANALYZER = """
+import sys, os, time
+
+
+def run_exclusively(solution_filepath, seconds):
+    # Fails if another job or restore works on the same repo at the same time
+    repo_dir = os.path.dirname(os.path.abspath(solution_filepath))
+    while not os.path.isdir(os.path.join(repo_dir, ".git")):
+        repo_dir = os.path.dirname(repo_dir)
+    running_path = os.path.join(repo_dir, ".running")
+    try:
+        os.close(os.open(running_path, os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        sys.exit("Repo analysed concurrently")
+    time.sleep(seconds)
+    os.remove(running_path)
+
+
+if sys.argv[1] == "restore":
+    run_exclusively(sys.argv[2], 0.2)
+    sys.exit(0)
+
+solution_filepath, output_path, nuget_path = sys.argv[2], sys.argv[4], sys.argv[6]
+nuget = os.path.basename(nuget_path)
+if nuget.startswith("Empty"):
+    sys.exit(0)
+if nuget.startswith("Slow"):
+    time.sleep(10)
+if nuget.startswith("Flaky"):
+    attempts_path = f"{nuget_path}.attempts"
+    if not os.path.isfile(attempts_path):
+        open(attempts_path, 'w').close()
+        sys.exit("Flaky failure")
+if nuget.startswith("Broken"):
+    sys.exit("Broken analyzer")
+run_exclusively(solution_filepath, 0.5)
+with open(output_path, 'w') as f:
+    f.write(f"<Roslynator><!-- {os.path.basename(solution_filepath)} {nuget} --></Roslynator>")
+"""
+
+
+def init_repo(repo_dir, solution_paths):
+    for solution_path in solution_paths:
+        write_solution_file(repo_dir, solution_path, [f"{os.path.splitext(os.path.basename(solution_path))[0]}.csproj"])
+    subprocess.run(["git", "init", "-q", repo_dir], check=True)
+    subprocess.run(["git", "-C", repo_dir, "-c", "user.name=test", "-c", "user.email=test@test",
+                    "commit", "-q", "--allow-empty", "-m", "Initial"], check=True)
+
+
+class TestSchedulingAnalysisRuns(unittest.TestCase):
+
+    def test_run_jobs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            init_repo(f"{tmp_dir}/repos/acat", ["Acat.sln", "tests/Tests.sln"])
+
+            stub_path = f"{tmp_dir}/stub_analyzer.py"
+            with open(stub_path, 'w') as f:
+                f.write(STUB_ANALYZER)
+            analyzer_packages = [(nuget, f"{tmp_dir}/{nuget}") for nuget in
+                                 ("Analyzers.1.0", "Empty.1.0", "Flaky.1.0", "Slow.1.0", "Broken.1.0")]
+            os.makedirs(f"{tmp_dir}/analysis")
+            os.makedirs(f"{tmp_dir}/analysis_empty")
+
+            solution_plan = {"Repos": {"acat": {"Solutions": ["Acat.sln"]}}}
+            jobs = build_job_matrix(["acat", "not_cloned"], f"{tmp_dir}/repos", analyzer_packages,
+                                    f"{tmp_dir}/analysis", f"{tmp_dir}/analysis_empty", solution_plan)
+            self.assertEqual(len(jobs), 5)
+            self.assertTrue(jobs[0].JobID.startswith("acat__Acat.sln__"))
+            self.assertTrue(jobs[0].JobID.endswith("__Analyzers.1.0"))
+
+            runner = CommandRunner([sys.executable, stub_path, "analyze", "{SolutionFilepath}", "--output", "{OutputPath}",
+                                    "--analyzer-assemblies", "{NuGetPath}"], timeout_seconds=2, max_attempts=2)
+            results = AnalysisRunResults(f"{tmp_dir}/analysis_runs.sqlite")
+            job_results = run_jobs(jobs, runner, results, num_workers=3,
+                                   prepare_runner=CommandRunner([sys.executable, "-c", "pass"]))
+
+            statuses = {job_result.AnalyzerNuGet: (job_result.Status, job_result.Attempts) for job_result in job_results}
+            self.assertEqual(statuses, {"Analyzers.1.0": ("analysed", 1), "Empty.1.0": ("empty", 1),
+                                        "Flaky.1.0": ("analysed", 2), "Slow.1.0": ("timeout", 2),
+                                        "Broken.1.0": ("failed", 2)})
+            self.assertEqual(sorted(os.listdir(f"{tmp_dir}/analysis")),
+                             sorted([f"{job.JobID}.xml" for job in jobs if job.AnalyzerNuGet in ("Analyzers.1.0", "Flaky.1.0")]))
+            self.assertEqual(os.listdir(f"{tmp_dir}/analysis_empty"), [f"{jobs[1].JobID}.xml"])
+            analysed_result = [job_result for job_result in job_results if job_result.AnalyzerNuGet == "Analyzers.1.0"][0]
+            self.assertEqual(analysed_result.OutputBytes, os.stat(jobs[0].AnalysisFilepath).st_size)
+            self.assertEqual(len(results.get_results()), 5)
+
+            # Packages without fixable diagnostics are not analysed, unknown packages are
+            fixable_diagnostics = {"Analyzers.1.0": frozenset(["SA1101"]), "Empty.1.0": frozenset()}
+            self.assertEqual(len(build_job_matrix(["acat"], f"{tmp_dir}/repos", analyzer_packages, f"{tmp_dir}/analysis",
+                                                  f"{tmp_dir}/analysis_empty", solution_plan, fixable_diagnostics)), 4)
+
+            # Repos planned without solutions are analysed with all of them
+            self.assertEqual(len(build_job_matrix(["acat"], f"{tmp_dir}/repos", analyzer_packages, f"{tmp_dir}/analysis",
+                                                  f"{tmp_dir}/analysis_empty", {"Repos": {"acat": {"Solutions": []}}})),
+                             10)
+
+            # Only the jobs that did not complete run again
+            job_results = run_jobs(jobs, CommandRunner(runner.command, timeout_seconds=2), results, num_workers=3)
+            self.assertEqual(sorted([job_result.AnalyzerNuGet for job_result in job_results]), ["Broken.1.0", "Slow.1.0"])
+            results.close()
+
+            # Compressed analysis files are completed too, also without a result
+            compress_file(jobs[0].AnalysisFilepath, ".gz")
+            results = AnalysisRunResults(f"{tmp_dir}/analysis_runs_of_ps1.sqlite")
+            self.assertEqual(run_jobs(jobs[:3], runner, results, num_workers=3), [])
+            results.close()
+
+    def test_one_job_per_repo_at_a_time(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Solutions of a repo share projects, so neither their jobs nor their restores overlap
+            init_repo(f"{tmp_dir}/repos/acat", ["Acat.sln", "tests/Tests.sln", "src/Core.sln"])
+            init_repo(f"{tmp_dir}/repos/bcat", ["Bcat.sln", "tests/Tests.sln"])
+            stub_path = f"{tmp_dir}/stub_analyzer.py"
+            with open(stub_path, 'w') as f:
+                f.write(STUB_ANALYZER)
+            os.makedirs(f"{tmp_dir}/analysis")
+            os.makedirs(f"{tmp_dir}/analysis_empty")
+            jobs = build_job_matrix(["acat", "bcat"], f"{tmp_dir}/repos", [("Analyzers.1.0", f"{tmp_dir}/Analyzers.1.0")],
+                                    f"{tmp_dir}/analysis", f"{tmp_dir}/analysis_empty")
+            self.assertEqual(len(jobs), 5)
+
+            runner = CommandRunner([sys.executable, stub_path, "analyze", "{SolutionFilepath}", "--output", "{OutputPath}",
+                                    "--analyzer-assemblies", "{NuGetPath}"], timeout_seconds=10)
+            results = AnalysisRunResults(f"{tmp_dir}/analysis_runs.sqlite")
+            job_results = run_jobs(jobs, runner, results, num_workers=4, prepare_runner=CommandRunner(
+                [sys.executable, stub_path, "restore", "{SolutionFilepath}"]))
+            results.close()
+            self.assertEqual([(job_result.Status, job_result.Error) for job_result in job_results],
+                             [("analysed", None)] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
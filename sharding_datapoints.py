@@ -0,0 +1,173 @@
+"""
+This file stores datapoints as compact JSON lines in size-bounded shards, instead of
+one pretty-printed JSON file per datapoint:
+
+    unified_dataset/
+        shard-00000.jsonl   One datapoint per line
+        shard-00000.index   "<datapoint id>\t<byte offset>\t<byte length>" per datapoint
+        shard-00001.jsonl
+        ...
+
+The datapoint ID is the filename the datapoint has in the per-file layout, without
+".json" (e.g. "43932894-3").
+
+"""
+
+import os
+import json
+
+
+SHARD_PREFIX = "shard-"
+SHARD_EXTENSION = ".jsonl"
+INDEX_EXTENSION = ".index"
+DEFAULT_MAX_SHARD_SIZE = 64 * 2**20
+
+
+def get_shard_paths(dataset_dir):
+    """Sorted paths of all shards in `dataset_dir`, without extension"""
+    return sorted([f.path[:-len(SHARD_EXTENSION)] for f in os.scandir(dataset_dir)
+                   if f.is_file() and f.name.startswith(SHARD_PREFIX) and f.name.endswith(SHARD_EXTENSION)])
+
+
+def is_sharded_dataset(dataset_dir):
+    return len(get_shard_paths(dataset_dir)) != 0
+
+
+def read_shard_index(shard_path):
+    """Returns [(datapoint_id, offset, length), ...] of one shard"""
+    shard_index = []
+    with open(f"{shard_path}{INDEX_EXTENSION}", 'r', encoding='utf-8') as f:
+        for line in f:
+            datapoint_id, offset, length = line.rstrip("\n").split("\t")
+            shard_index.append((datapoint_id, int(offset), int(length)))
+    return shard_index
+
+
+def remove_datapoints(dataset_dir, datapoint_ids):
+    """
+    Rewrites the shards that contain any of `datapoint_ids` without them, and deletes
+    shards that end up empty. Returns the number of removed datapoints.
+    """
+
+    datapoint_ids = set(datapoint_ids)
+    num_removed = 0
+    for shard_path in get_shard_paths(dataset_dir):
+        shard_index = read_shard_index(shard_path)
+        kept_index = [entry for entry in shard_index if entry[0] not in datapoint_ids]
+        if len(kept_index) == len(shard_index):
+            continue
+        num_removed += len(shard_index) - len(kept_index)
+
+        if not kept_index:
+            os.remove(f"{shard_path}{SHARD_EXTENSION}")
+            os.remove(f"{shard_path}{INDEX_EXTENSION}")
+            continue
+
+        # Not starting with SHARD_PREFIX, so that leftovers are never read as shards
+        tmp_shard_path = f"{dataset_dir}/tmp-{os.getpid()}-{os.path.basename(shard_path)}"
+        with open(f"{shard_path}{SHARD_EXTENSION}", 'rb') as f, \
+                open(f"{tmp_shard_path}{SHARD_EXTENSION}", 'wb') as shard_file, \
+                open(f"{tmp_shard_path}{INDEX_EXTENSION}", 'w', encoding='utf-8') as index_file:
+            shard_size = 0
+            for datapoint_id, offset, length in kept_index:
+                f.seek(offset)
+                shard_file.write(f.read(length))
+                index_file.write(f"{datapoint_id}\t{shard_size}\t{length}\n")
+                shard_size += length
+
+        os.replace(f"{tmp_shard_path}{SHARD_EXTENSION}", f"{shard_path}{SHARD_EXTENSION}")
+        os.replace(f"{tmp_shard_path}{INDEX_EXTENSION}", f"{shard_path}{INDEX_EXTENSION}")
+
+    return num_removed
+
+
+class ShardedDatapointWriter:
+    """
+    Appends datapoints to the last shard until it would exceed `max_shard_size` bytes.
+    The writer never modifies existing shards; a new writer always starts a new shard.
+    """
+
+    def __init__(self, dataset_dir, max_shard_size=DEFAULT_MAX_SHARD_SIZE):
+        self.dataset_dir = dataset_dir
+        self.max_shard_size = max_shard_size
+
+        shard_paths = get_shard_paths(dataset_dir)
+        self.next_shard_num = int(os.path.basename(shard_paths[-1])[len(SHARD_PREFIX):]) + 1 if shard_paths else 0
+        self.shard_file = None
+        self.index_file = None
+        self.shard_size = 0
+
+    def open_next_shard(self):
+        self.close()
+        shard_path = f"{self.dataset_dir}/{SHARD_PREFIX}{self.next_shard_num:05}"
+        self.shard_file = open(f"{shard_path}{SHARD_EXTENSION}", 'wb')
+        self.index_file = open(f"{shard_path}{INDEX_EXTENSION}", 'w', encoding='utf-8')
+        self.shard_size = 0
+        self.next_shard_num += 1
+
+    def write(self, datapoint_id, datapoint):
+        line = (json.dumps(datapoint, ensure_ascii=False) + "\n").encode('utf-8')
+
+        if self.shard_file is None or (self.shard_size != 0 and self.shard_size + len(line) > self.max_shard_size):
+            self.open_next_shard()
+
+        self.shard_file.write(line)
+        self.index_file.write(f"{datapoint_id}\t{self.shard_size}\t{len(line)}\n")
+        self.shard_size += len(line)
+
+    def flush(self):
+        """Everything written so far is in the shard files, e.g. before recording it in a manifest"""
+        if self.shard_file is not None:
+            # Shard first, so that the index never points beyond the shard
+            self.shard_file.flush()
+            self.index_file.flush()
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.index_file.close()
+            self.shard_file = None
+            self.index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ShardedDatapointReader:
+
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        self.shard_paths = get_shard_paths(dataset_dir)
+        self.datapoint_locations = None
+
+    def get_datapoint_ids(self):
+        return [datapoint_id for shard_path in self.shard_paths
+                for datapoint_id, _, _ in read_shard_index(shard_path)]
+
+    def iter_datapoint_strings(self):
+        """Streams (datapoint_id, JSON string) through all shards in order"""
+        for shard_path in self.shard_paths:
+            shard_index = read_shard_index(shard_path)
+            with open(f"{shard_path}{SHARD_EXTENSION}", 'rb') as f:
+                for datapoint_id, _, length in shard_index:
+                    yield datapoint_id, f.read(length).decode('utf-8')
+
+    def iter_datapoints(self):
+        for datapoint_id, datapoint_string in self.iter_datapoint_strings():
+            yield datapoint_id, json.loads(datapoint_string)
+
+    def get_datapoint(self, datapoint_id):
+        """Random access by datapoint ID, using the shard indexes"""
+        if self.datapoint_locations is None:
+            self.datapoint_locations = {}
+            for shard_path in self.shard_paths:
+                for shard_datapoint_id, offset, length in read_shard_index(shard_path):
+                    self.datapoint_locations[shard_datapoint_id] = (shard_path, offset, length)
+
+        shard_path, offset, length = self.datapoint_locations[datapoint_id]
+        with open(f"{shard_path}{SHARD_EXTENSION}", 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length).decode('utf-8'))
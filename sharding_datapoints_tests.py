@@ -0,0 +1,49 @@
+import unittest
+import tempfile
+from sharding_datapoints import ShardedDatapointWriter, ShardedDatapointReader, get_shard_paths, remove_datapoints
+
+
+class TestShardedDatapoints(unittest.TestCase):
+
+    def test_write_and_read(self):
+        datapoints = [(f"{num}-0", {"Repo": "acat", "FileContext": ["int ä;\n"] * num}) for num in range(50)]
+
+        with tempfile.TemporaryDirectory() as dataset_dir:
+            with ShardedDatapointWriter(dataset_dir, max_shard_size=500) as writer:
+                for datapoint_id, datapoint in datapoints[:30]:
+                    writer.write(datapoint_id, datapoint)
+            # A second writer appends new shards
+            with ShardedDatapointWriter(dataset_dir, max_shard_size=500) as writer:
+                for datapoint_id, datapoint in datapoints[30:]:
+                    writer.write(datapoint_id, datapoint)
+
+            self.assertGreater(len(get_shard_paths(dataset_dir)), 2)
+
+            reader = ShardedDatapointReader(dataset_dir)
+            self.assertEqual(list(reader.iter_datapoints()), datapoints)
+            self.assertEqual(reader.get_datapoint_ids(), [datapoint_id for datapoint_id, _ in datapoints])
+            self.assertEqual(reader.get_datapoint("42-0"), datapoints[42][1])
+
+    def test_remove_datapoints(self):
+        datapoints = [(f"{num}-0", {"Repo": "acat", "FileContext": ["int ä;\n"] * num}) for num in range(20)]
+
+        with tempfile.TemporaryDirectory() as dataset_dir:
+            with ShardedDatapointWriter(dataset_dir, max_shard_size=300) as writer:
+                for datapoint_id, datapoint in datapoints:
+                    writer.write(datapoint_id, datapoint)
+            num_shards = len(get_shard_paths(dataset_dir))
+
+            # 19-0 is the only datapoint of the last shard, which is removed entirely
+            removed_ids = ["0-0", "1-0", "7-0", "19-0", "unknown"]
+            self.assertEqual(remove_datapoints(dataset_dir, removed_ids), 4)
+            self.assertEqual(len(get_shard_paths(dataset_dir)), num_shards - 1)
+
+            reader = ShardedDatapointReader(dataset_dir)
+            self.assertEqual(list(reader.iter_datapoints()),
+                             [(datapoint_id, datapoint) for datapoint_id, datapoint in datapoints
+                              if datapoint_id not in removed_ids])
+            self.assertEqual(reader.get_datapoint("8-0"), datapoints[8][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,36 @@
 import os
 import json
+from bisect import bisect_right
 from multiprocessing import Pool
 from itertools import product
 from regex_lexer import CSharpAndCommentsLexer, LanguageLexer
 from regex_lexer_camelcase import CSharpAndCommentsCamelcaseLexer, LanguageCamelcaseLexer
+from compiling_regex_lexers import get_lexer, CompiledRegexLexer
+from caching_lexed_tokens import get_token_cache, lex_text, LexedText
+from windowing_source_files import lex_window
 from enum import Enum
 from pathlib import Path
+from reading_source_files import get_source_file
+from unified_data_model import UnifiedDatapoint
+from sharding_datapoints import is_sharded_dataset, ShardedDatapointReader
+
+
+# Read source files at the datapoint's "Commit" instead of the checked out working tree
+read_sources_at_commit = False
+
+# Lex with the compiled versions of the lexers (same tokens, faster), and relex the diffed files from the
+# original file's checkpoints, see compiling_regex_lexers.py. With False, or on Python/Pygments versions the
+# lexers aren't compiled on, the Pygments lexers lex every diffed file whole.
+use_compiled_lexers = True
+
+# Lex only the lines a datapoint needs, with the compiled lexers (same tokens), see windowing_source_files.py.
+# The token cache is not used for them.
+use_windowed_lexing = False
+
+# Lexed tokens are cached here and reused by later runs (None to always lex), see caching_lexed_tokens.py
+token_cache_path = "tokenized_datasets/token_cache.sqlite"
+# Least recently used tokens are evicted above this size
+token_cache_max_bytes = 4 * 2**30
 
 
 class TokenizationType(Enum):
@@ -24,33 +49,30 @@ class Pipeline:
         self.output_dir = output_dir
 
         if self.tokenization_type == TokenizationType.camelcase:
-            self.the_lexer = CSharpAndCommentsCamelcaseLexer()
-            self.diag_message_lexer = LanguageCamelcaseLexer()
+            lexer_class, diag_message_lexer_class = CSharpAndCommentsCamelcaseLexer, LanguageCamelcaseLexer
         else:
-            self.the_lexer = CSharpAndCommentsLexer()
-            self.diag_message_lexer = LanguageLexer()
+            lexer_class, diag_message_lexer_class = CSharpAndCommentsLexer, LanguageLexer
 
-    def remove_redundant_fields(self, data_dict):
+        self.lexer_class = lexer_class
+        # Pygments lexers where the lexers can't be compiled
+        self.the_lexer = get_lexer(lexer_class, use_compiled_lexers)
+        self.diag_message_lexer = get_lexer(diag_message_lexer_class, use_compiled_lexers)
 
-        # for diagOccurance in data_dict["DiagnosticOccurances"]:
-        #     diagOccurance.pop("Message", None)
+        self.window_lexer = None
+        if use_windowed_lexing and isinstance(get_lexer(lexer_class), CompiledRegexLexer):
+            self.window_lexer = get_lexer(lexer_class)
 
-        # if data_dict["ParsedDiff"]["ActionType"] != "REMOVE":
-        #     data_dict["ParsedDiff"]["Action"].pop("TargetLines", None)
+        self.token_cache = None
+        if token_cache_path is not None:
+            self.token_cache = get_token_cache(token_cache_path, token_cache_max_bytes)
 
-        #     if data_dict["ParsedDiff"]["ActionType"] != "ADD":
-        #         data_dict["ParsedDiff"]["Action"].pop("TargetStartLocation", None)
+    def remove_redundant_fields(self, unified_data):
+        """Fields set to None are left out of the tokenized datapoint (see UnifiedDatapoint.OPTIONAL_FIELDS)"""
 
-        data_dict.pop("RepoURL", None)
-        data_dict.pop("SolutionFile", None)
-        data_dict.pop("FilePath", None)
-        data_dict.pop("Commit", None)
-        # data_dict.pop("Repo", None)
-        # data_dict.pop("AnalyzerNuGet", None)
-        # data_dict.pop("FileContextStart", None)
-        # data_dict.pop("RequiredLinesStart", None)
-        # data_dict.pop("RequiredLinesEnd", None)
-        # data_dict.pop("FileContext", None)
+        unified_data.RepoURL = None
+        unified_data.SolutionFile = None
+        unified_data.FilePath = None
+        unified_data.Commit = None
 
         return
 
@@ -66,26 +88,43 @@ class Pipeline:
 
         return orig_file_line_tokens
 
-    def get_required_tokens(self, all_tokens, start_line, end_line):
+    def lex(self, lexer, lexer_class, text, previous=None):
+        """LexedText of the text, from the token cache if possible. See lex_text for previous."""
 
-        line_tokens = Pipeline.split_tokens_by_line(all_tokens)
-        required_line_tokens = line_tokens[start_line:end_line + 1]
+        if self.token_cache is not None:
+            return self.token_cache.lex(lexer, lexer_class, text, previous)
+        return lex_text(lexer, text, previous)
+
+    @staticmethod
+    def remove_last_token(lexed_text):
+        """Because lexer always adds NEWLINE at very end"""
+
+        tokens, line_offsets, _ = lexed_text
+        if tokens[-1][1] == "NEWLINE":
+            # Its line is gone as well
+            line_offsets = line_offsets[:-1]
+        # Checkpoints are only needed to relex the text
+        return LexedText(tokens[:-1], line_offsets, None)
+
+    @staticmethod
+    def get_line_token_range(all_tokens, line_offsets, start_line, end_line):
+        """Token indices of the lines Pipeline.split_tokens_by_line(all_tokens)[start_line:end_line + 1]"""
 
-        # Flatten tokens again:
-        required_tokens = []
-        for line_tokens in required_line_tokens:
-            for token in line_tokens:
-                required_tokens.append(token)
+        lines = range(len(line_offsets))[start_line:end_line + 1]
+        if not lines:
+            return 0, 0
+        end_token_idx = line_offsets[lines.stop] if lines.stop < len(line_offsets) else len(all_tokens)
+        return line_offsets[lines.start], end_token_idx
 
-        return required_tokens
+    def get_required_tokens(self, all_tokens, line_offsets, start_line, end_line):
 
-    def count_tokens_in_lines(self, all_tokens, start_line, num_lines):
-        line_tokens = Pipeline.split_tokens_by_line(
-            all_tokens)[start_line:start_line+num_lines]
-        num_tokens = 0
-        for line in line_tokens:
-            num_tokens += len(line)
-        return num_tokens
+        start_token_idx, end_token_idx = Pipeline.get_line_token_range(all_tokens, line_offsets, start_line, end_line)
+        return all_tokens[start_token_idx:end_token_idx]
+
+    def count_tokens_in_lines(self, all_tokens, line_offsets, start_line, num_lines):
+        start_token_idx, end_token_idx = Pipeline.get_line_token_range(
+            all_tokens, line_offsets, start_line, start_line + num_lines - 1)
+        return end_token_idx - start_token_idx
 
     def add_context_to_tokens(self, all_tokens, core_token_list, core_idx_start, num_total_tokens):
 
@@ -112,37 +151,30 @@ class Pipeline:
 
         return context_token_list, core_idx_start
 
-    def get_line_number_by_token_idx(self, all_tokens, token_idx):
-        line_number = 0
-        for idx, token in enumerate(all_tokens):
-            if idx == token_idx:
-                # token is still part of old line
-                break
-            if token[1] == "NEWLINE":
-                line_number += 1
-
-        return line_number
+    def get_line_number_by_token_idx(self, line_offsets, token_idx):
+        # Number of NEWLINE tokens before the token
+        return bisect_right(line_offsets, token_idx) - 1
 
-    def apply_diff_to_file(self, unified_data_dict, orig_file):
+    def apply_diff_to_file(self, unified_data, orig_file):
 
         diffed_file_list = orig_file.split("\n")
-        diff_action_type = unified_data_dict["ParsedDiff"]["ActionType"]
-        diff_action = unified_data_dict["ParsedDiff"]["Action"]
+        diff_action_type = unified_data.ParsedDiff.ActionType
+        diff_action = unified_data.ParsedDiff.Action
 
         if diff_action_type == "ADD":
 
             target_lines = [line.rstrip('\n')
-                            for line in diff_action["TargetLines"]]
+                            for line in diff_action.TargetLines]
 
             # Diff starts at line 1
-            prev_idx = diff_action["PreviousSourceLocation"] - 1
+            prev_idx = diff_action.PreviousSourceLocation - 1
             diffed_file_list[prev_idx + 1:prev_idx +
                              1] = target_lines
 
         elif diff_action_type == "REMOVE":
 
-            start_idx = diff_action["SourceLocationStart"] - 1
-            end_idx = diff_action["SourceLocationEnd"] - 1
+            start_idx = diff_action.SourceLocationStart - 1
+            end_idx = diff_action.SourceLocationEnd - 1
             idx_to_del = list(range(start_idx, end_idx + 1))
             diffed_file_list = [i for j, i in enumerate(
                 diffed_file_list) if j not in idx_to_del]
@@ -151,37 +183,37 @@ class Pipeline:
 
             # Remove
             # Diff starts at line 1
-            idx_to_del = [i-1 for i in diff_action["SourceLocations"]]
+            idx_to_del = [i-1 for i in diff_action.SourceLocations]
             diffed_file_list = [i for j, i in enumerate(
                 diffed_file_list) if j not in idx_to_del]
 
             # Add
             first_idx = idx_to_del[0]
             target_lines = [line.rstrip('\n')
-                            for line in diff_action["TargetLines"]]
+                            for line in diff_action.TargetLines]
             diffed_file_list[first_idx:first_idx] = target_lines
 
         return "\n".join(diffed_file_list)
 
-    def get_required_target_indices(self, unified_data_dict):
+    def get_required_target_indices(self, unified_data):
 
         target_start_idx = -1
         target_end_idx = -1
-        diff_action_type = unified_data_dict["ParsedDiff"]["ActionType"]
-        diff_action = unified_data_dict["ParsedDiff"]["Action"]
+        diff_action_type = unified_data.ParsedDiff.ActionType
+        diff_action = unified_data.ParsedDiff.Action
         if diff_action_type == "ADD":
 
             # Diff line start at 1; target starts 1 after PreviousSourceLocation
-            target_start_idx = diff_action["PreviousSourceLocation"] - 1 + 1
+            target_start_idx = diff_action.PreviousSourceLocation - 1 + 1
             target_end_idx = target_start_idx + \
-                len(diff_action["TargetLines"]) - 1
+                len(diff_action.TargetLines) - 1
 
         elif diff_action_type == "REPLACE":
 
             # Diff line start at 1;
-            target_start_idx = diff_action["SourceLocations"][0] - 1
+            target_start_idx = diff_action.SourceLocations[0] - 1
             target_end_idx = target_start_idx + \
-                len(diff_action["TargetLines"]) - 1
+                len(diff_action.TargetLines) - 1
 
         else:  # "REMOVE"
             # No target information
@@ -189,41 +221,60 @@ class Pipeline:
 
         return target_start_idx, target_end_idx
 
-    def subtract_line_offset(self, unified_data_dict, line_offset):
+    def subtract_line_offset(self, unified_data, line_offset):
 
-        for diag_occurance in unified_data_dict["DiagnosticOccurances"]:
-            diag_occurance["Line"] -= line_offset
+        for diag_occurance in unified_data.DiagnosticOccurances:
+            diag_occurance.Line -= line_offset
 
-        diff_action_type = unified_data_dict["ParsedDiff"]["ActionType"]
-        diff_action = unified_data_dict["ParsedDiff"]["Action"]
+        diff_action_type = unified_data.ParsedDiff.ActionType
+        diff_action = unified_data.ParsedDiff.Action
 
         if diff_action_type == "ADD":
-            diff_action["PreviousSourceLocation"] -= line_offset
+            diff_action.PreviousSourceLocation -= line_offset
         elif diff_action_type == "REPLACE":
-            diff_action["SourceLocations"] = [
-                loc - line_offset for loc in diff_action["SourceLocations"]]
+            diff_action.SourceLocations = [
+                loc - line_offset for loc in diff_action.SourceLocations]
         else:  # "REMOVE"
-            diff_action["SourceLocationStart"] -= line_offset
-            diff_action["SourceLocationEnd"] -= line_offset
+            diff_action.SourceLocationStart -= line_offset
+            diff_action.SourceLocationEnd -= line_offset
 
     def run_single_datapoint(self, unified_file_path):
 
         unified_file_basename = os.path.basename(os.path.normpath(unified_file_path))
+        with open(unified_file_path, 'r') as file:
+            self.run_single_datapoint_string(unified_file_basename, file.read())
+
+    def run_single_datapoint_string(self, unified_file_basename, unified_data_string):
+        """`unified_file_basename` is also the name of the tokenized file"""
+
         print(f"File to tokenize: {unified_file_basename}")
 
-        with open(unified_file_path, 'r') as file:
-            orig_file_string = file.read()
-            if not orig_file_string.isascii():
-                print("File is not ASCII!")
-                return
-            unified_data_dict = json.loads(orig_file_string)
-
-        path_to_file = f"""./submodule_repos_to_analyze/{unified_data_dict["Repo"]}/{unified_data_dict["FilePath"]}"""
-        with open(path_to_file, 'r') as file:
-            orig_file_string = file.read()  # Adds newline at very end
+        if not unified_data_string.isascii():
+            print("File is not ASCII!")
+            return
+        unified_data = UnifiedDatapoint.from_json(json.loads(unified_data_string))
+
+        repo_dir = f"""./submodule_repos_to_analyze/{unified_data.Repo}"""
+        orig_file_string = get_source_file(repo_dir, unified_data.Commit, unified_data.FilePath,
+                                           read_sources_at_commit).text()  # Adds newline at very end
         num_lines = orig_file_string.count('\n')
-        orig_file_tokens = [
-            result for result in self.the_lexer.get_tokens(orig_file_string)]
+
+        # Diff indices start at 1
+        start_required_idx = unified_data.RequiredLinesStart - 1
+        end_required_idx = unified_data.RequiredLinesEnd - 1
+
+        # Either all tokens, or the ones from line orig_first_line on
+        orig_window = None
+        if self.window_lexer is not None:
+            orig_window = lex_window(self.window_lexer, orig_file_string, start_required_idx, end_required_idx,
+                                     self.num_file_context_tokens)
+        if orig_window is not None:
+            orig_file_lexed = None
+            orig_file_tokens, orig_line_offsets, orig_first_line = orig_window
+        else:
+            orig_file_lexed = self.lex(self.the_lexer, self.lexer_class, orig_file_string)
+            orig_file_tokens = orig_file_lexed.Tokens
+            orig_first_line = 0
 
         if any(["\n" in token[1] for token in orig_file_tokens]):
             print(
@@ -231,23 +282,19 @@ class Pipeline:
             exit(0)
             # return
 
-        # Because lexer always adds NEWLINE at very end
-        del orig_file_tokens[-1]
+        if orig_file_lexed is not None:
+            orig_file_tokens, orig_line_offsets, _ = Pipeline.remove_last_token(orig_file_lexed)
 
         # Sanity check
         # line_tokens = Pipeline.split_tokens_by_line(orig_file_tokens)
         # assert num_lines == len(
         #     line_tokens), f"""num_lines not equal to len(line_tokens); num_lines: {num_lines}; len(
-        #     line_tokens): {len(line_tokens)}; file: {unified_data_dict["FileURL"]}"""
+        #     line_tokens): {len(line_tokens)}; file: {unified_data.FileURL}"""
 
         ### Get required original tokens ###
 
-        # Diff indices start at 1
-        start_required_idx = unified_data_dict["RequiredLinesStart"] - 1
-        end_required_idx = unified_data_dict["RequiredLinesEnd"] - 1
-
         orig_required_tokens = self.get_required_tokens(
-            orig_file_tokens, start_required_idx, end_required_idx)
+            orig_file_tokens, orig_line_offsets, start_required_idx - orig_first_line, end_required_idx - orig_first_line)
 
         if len(orig_required_tokens) > self.num_file_context_tokens:
             print("Too many required tokens: ", len(orig_required_tokens))
@@ -256,7 +303,7 @@ class Pipeline:
         ### Add context to original tokens ###
 
         start_required_token_idx = self.count_tokens_in_lines(
-            orig_file_tokens, 0, start_required_idx)
+            orig_file_tokens, orig_line_offsets, 0, start_required_idx - orig_first_line)
 
         orig_padded_tokens, start_padded_token_idx = self.add_context_to_tokens(
             orig_file_tokens, orig_required_tokens, start_required_token_idx, self.num_file_context_tokens)
@@ -269,30 +316,37 @@ class Pipeline:
         # Optionally zero-index identifiers
         var_index_dict = {}
         if self.tokenization_type == TokenizationType.zero_index_vars:
-            index_func = CSharpAndCommentsLexer.index_identifier_token
-            orig_padded_tokens = [index_func(
-                token[0], token[1], var_index_dict) for token in orig_padded_tokens]
+            orig_padded_tokens = CSharpAndCommentsLexer.index_identifier_tokens(
+                orig_padded_tokens, var_index_dict)
 
-        unified_data_dict["TokenizedFileContext"] = [token[1]
-                                                     for token in orig_padded_tokens]
+        unified_data.TokenizedFileContext = [token[1]
+                                             for token in orig_padded_tokens]
 
         ### Apply diff to original file and tokenize all ###
 
-        if unified_data_dict["ParsedDiff"]["ActionType"] != "REMOVE":
+        if unified_data.ParsedDiff.ActionType != "REMOVE":
 
             diffed_file_str = self.apply_diff_to_file(
-                unified_data_dict, orig_file_string)
+                unified_data, orig_file_string)
 
-            diffed_file_tokens = [
-                result for result in self.the_lexer.get_tokens(diffed_file_str)]
+            start_target_idx, end_target_idx = self.get_required_target_indices(
+                unified_data)
 
-            # Because lexer always adds NEWLINE at very end
-            del diffed_file_tokens[-1]
+            diffed_window = None
+            if self.window_lexer is not None:
+                diffed_window = lex_window(self.window_lexer, diffed_file_str, start_target_idx, end_target_idx, 0)
+            if diffed_window is not None:
+                diffed_file_tokens, diffed_line_offsets, diffed_first_line = diffed_window
+            else:
+                # Relexed from the original file's tokens, where the diff applies
+                previous = None if orig_file_lexed is None else (orig_file_string, orig_file_lexed)
+                diffed_file_tokens, diffed_line_offsets, _ = Pipeline.remove_last_token(
+                    self.lex(self.the_lexer, self.lexer_class, diffed_file_str, previous))
+                diffed_first_line = 0
 
-            start_target_idx, end_target_idx = self.get_required_target_indices(
-                unified_data_dict)
-            diffed_required_tokens = self.get_required_tokens(
-                diffed_file_tokens, start_target_idx, end_target_idx)
+            diffed_required_tokens = self.get_required_tokens(diffed_file_tokens, diffed_line_offsets,
+                                                              start_target_idx - diffed_first_line,
+                                                              end_target_idx - diffed_first_line)
 
             if any(["\n" in token[1] for token in diffed_required_tokens]):
                 print(
@@ -302,45 +356,42 @@ class Pipeline:
 
             # Optionally zero-index identifiers
             if self.tokenization_type == TokenizationType.zero_index_vars:
-                index_func = CSharpAndCommentsLexer.index_identifier_token
-                diffed_required_tokens = [index_func(
-                    token[0], token[1], var_index_dict) for token in diffed_required_tokens]
+                diffed_required_tokens = CSharpAndCommentsLexer.index_identifier_tokens(
+                    diffed_required_tokens, var_index_dict)
 
-            unified_data_dict["ParsedDiff"]["Action"]["TokenizedTargetLines"] = [
+            unified_data.ParsedDiff.Action.TokenizedTargetLines = [
                 token[1] for token in diffed_required_tokens]
 
         ### Tokenize diagnostic message ###
 
-        for diag in unified_data_dict["DiagnosticOccurances"]:
+        for diag in unified_data.DiagnosticOccurances:
             message_lower = [word.lower() if not word.startswith(
-                "'") else word for word in diag["Message"].split(" ")]
-            diag_message_tokens = [
-                result for result in self.diag_message_lexer.get_tokens(' '.join(message_lower))]
-
-            # Because lexer always adds NEWLINE at very end
-            del diag_message_tokens[-1]
+                "'") else word for word in diag.Message.split(" ")]
+            # Not cached: messages are short, looking them up would take longer than lexing them,
+            # and their entries would evict the source files from the token cache
+            diag_message_tokens, _, _ = Pipeline.remove_last_token(
+                lex_text(self.diag_message_lexer, ' '.join(message_lower)))
 
             # Optionally zero-index identifiers
             if self.tokenization_type == TokenizationType.zero_index_vars:
-                index_func = CSharpAndCommentsLexer.index_identifier_token
-                diag_message_tokens = [index_func(
-                    token[0], token[1], var_index_dict) for token in diag_message_tokens]
+                diag_message_tokens = CSharpAndCommentsLexer.index_identifier_tokens(
+                    diag_message_tokens, var_index_dict)
 
-            diag["TokenizedMessage"] = [
+            diag.TokenizedMessage = [
                 result[1] for result in diag_message_tokens]
 
         ### Subtract line number of file context (offset) from diff src code locations ###
         start_padded_line_number = self.get_line_number_by_token_idx(
-            orig_file_tokens, start_padded_token_idx)
+            orig_line_offsets, start_padded_token_idx) + orig_first_line
         start_padded_line_number += 1  # In diffs, start counting at line 1
-        self.subtract_line_offset(unified_data_dict, start_padded_line_number)
-        unified_data_dict["TokenizedFileContextStart"] = start_padded_line_number
+        self.subtract_line_offset(unified_data, start_padded_line_number)
+        unified_data.TokenizedFileContextStart = start_padded_line_number
 
-        self.remove_redundant_fields(unified_data_dict)
+        self.remove_redundant_fields(unified_data)
 
         new_filepath = f"{self.output_dir}/{unified_file_basename}"
         with open(new_filepath, 'w', encoding='utf-8') as f:
-            json.dump(unified_data_dict, f, ensure_ascii=False, indent=2)
+            json.dump(unified_data.to_json(), f, ensure_ascii=False, indent=2)
 
     @staticmethod
     def start_and_run(unified_file_path, input_dir, output_dir, num_file_context_tokens, tokenization_type):
@@ -348,6 +399,13 @@ class Pipeline:
         pipeline = Pipeline(input_dir, output_dir, num_file_context_tokens, tokenization_type)
         pipeline.run_single_datapoint(unified_file_path)
 
+    @staticmethod
+    def start_and_run_sharded(args):
+        datapoint_id, unified_data_string, input_dir, output_dir, num_file_context_tokens, tokenization_type = args
+
+        pipeline = Pipeline(input_dir, output_dir, num_file_context_tokens, tokenization_type)
+        pipeline.run_single_datapoint_string(f"{datapoint_id}.json", unified_data_string)
+
 
 def main(input_dir, num_file_context_tokens, tokenization_type):
 
@@ -355,10 +413,25 @@ def main(input_dir, num_file_context_tokens, tokenization_type):
     output_dir = f"tokenized_datasets/{num_file_context_tokens}_tokens__{tokenization_type.value}__{dataset_version}"
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
+    already_tokenized_files = set([f.name for f in os.scandir(
+        output_dir) if f.is_file()])
+
+    if is_sharded_dataset(input_dir):
+        # Streaming through the shards instead of listing all datapoints first
+        reader = ShardedDatapointReader(input_dir)
+        args = ((datapoint_id, unified_data_string, input_dir, output_dir, num_file_context_tokens, tokenization_type)
+                for datapoint_id, unified_data_string in reader.iter_datapoint_strings()
+                if f"{datapoint_id}.json" not in already_tokenized_files)
+
+        print(f"Num already tokenized files: {len(already_tokenized_files)}")
+
+        with Pool(6) as p:
+            for _ in p.imap_unordered(Pipeline.start_and_run_sharded, args, chunksize=16):
+                pass
+        return
+
     unified_files = [f for f in os.scandir(
         input_dir) if f.is_file() and f.name.endswith(".json")]
-    already_tokenized_files = [f.name for f in os.scandir(
-        output_dir) if f.is_file()]
     unified_files_to_do = [f.path for f in unified_files if f.name not in already_tokenized_files]
 
     print(f"Num unified files: {len(unified_files)}")
@@ -0,0 +1,201 @@
+"""
+This file keeps a manifest of the unified dataset, so that reruns of unifying_raw_dataset.py
+only redo the diffs whose inputs changed. For every unified diff it records the content
+hashes of the diff and its analysis file and the unification version, the content hash of
+every source file it read (also of files without datapoints, or that could not be decoded),
+and its unified outputs (one per patched file with datapoints).
+
+Every datapoint is recorded with its dedupe key. Datapoints that duplicate an earlier one
+(e.g. the same fix of a project included by several solutions) are not written, but
+recorded as a reference to the datapoint that was kept.
+
+The manifest is persisted as SQLite next to the datapoints (unified_dataset/manifest.sqlite).
+Content hashes are cached by file size & modification time, so unchanged files are not
+read again.
+
+"""
+
+import os
+import hashlib
+import sqlite3
+from collections import namedtuple
+from indexing_analysis_files import hash_file_content
+
+
+# Increase whenever the tables change, forces all diffs to be unified again
+MANIFEST_SCHEMA_VERSION = 3
+MANIFEST_FILENAME = "manifest.sqlite"
+
+UnifiedDiffEntry = namedtuple("UnifiedDiffEntry", [
+    "DiffFile", "DiffHash", "AnalysisFile", "AnalysisHash", "UnificationVersion"])
+
+# One per patched file, with datapoint IDs "{OutputHash}-{num}"
+UnifiedOutputEntry = namedtuple("UnifiedOutputEntry", [
+    "OutputHash", "DiffFile", "OutputName", "SourcePath", "SourceHash"])
+
+# Every source file read by the diff, SourceHash is None if it could not be read
+UnifiedSourceEntry = namedtuple("UnifiedSourceEntry", ["DiffFile", "SourcePath", "SourceHash"])
+
+# DuplicateOf is the ID of the datapoint that was kept instead, None if the datapoint was written
+UnifiedDatapointEntry = namedtuple("UnifiedDatapointEntry", [
+    "DatapointID", "DiffFile", "DedupeKey", "DuplicateOf"])
+
+
+def hash_content(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class UnificationManifest:
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.connection = sqlite3.connect(manifest_path)
+
+        schema_version = None
+        try:
+            schema_version = self.connection.execute(
+                "SELECT Value FROM metadata WHERE Key = 'SchemaVersion'").fetchone()
+        except sqlite3.DatabaseError:
+            pass
+        if schema_version is None or int(schema_version[0]) != MANIFEST_SCHEMA_VERSION:
+            self.create_tables()
+
+        # Read once, the manifest is small compared to the dataset
+        self.file_hashes = {row[0]: row[1:] for row in self.connection.execute(
+            "SELECT Path, Size, MtimeNs, Hash FROM file_hashes")}
+        self.diffs = {row[0]: UnifiedDiffEntry(*row) for row in self.connection.execute(
+            "SELECT * FROM unified_diffs")}
+        self.outputs_by_diff = {}
+        for row in self.connection.execute("SELECT * FROM unified_outputs"):
+            output = UnifiedOutputEntry(*row)
+            self.outputs_by_diff.setdefault(output.DiffFile, []).append(output)
+        self.sources_by_diff = {}
+        for row in self.connection.execute("SELECT * FROM unified_sources"):
+            source = UnifiedSourceEntry(*row)
+            self.sources_by_diff.setdefault(source.DiffFile, []).append(source)
+        self.datapoints_by_diff = {}
+        for row in self.connection.execute("SELECT * FROM unified_datapoints ORDER BY rowid"):
+            datapoint = UnifiedDatapointEntry(*row)
+            self.datapoints_by_diff.setdefault(datapoint.DiffFile, []).append(datapoint)
+
+    def create_tables(self):
+        with self.connection:
+            for table in ("metadata", "file_hashes", "unified_diffs", "unified_outputs", "unified_sources",
+                          "unified_datapoints"):
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.execute("CREATE TABLE metadata (Key TEXT PRIMARY KEY, Value TEXT)")
+            self.connection.execute(
+                "CREATE TABLE file_hashes (Path TEXT PRIMARY KEY, Size INTEGER, MtimeNs INTEGER, Hash TEXT)")
+            self.connection.execute(
+                "CREATE TABLE unified_diffs (DiffFile TEXT PRIMARY KEY, DiffHash TEXT, AnalysisFile TEXT, "
+                "AnalysisHash TEXT, UnificationVersion TEXT)")
+            self.connection.execute(
+                "CREATE TABLE unified_outputs (OutputHash TEXT PRIMARY KEY, DiffFile TEXT, OutputName TEXT, "
+                "SourcePath TEXT, SourceHash TEXT)")
+            self.connection.execute(
+                "CREATE TABLE unified_sources (DiffFile TEXT, SourcePath TEXT, SourceHash TEXT, "
+                "PRIMARY KEY (DiffFile, SourcePath))")
+            self.connection.execute(
+                "CREATE TABLE unified_datapoints (DatapointID TEXT PRIMARY KEY, DiffFile TEXT, DedupeKey TEXT, "
+                "DuplicateOf TEXT)")
+            self.connection.execute("CREATE INDEX unified_outputs_diff ON unified_outputs (DiffFile)")
+            self.connection.execute("CREATE INDEX unified_datapoints_diff ON unified_datapoints (DiffFile)")
+            self.connection.execute("INSERT INTO metadata VALUES (?, ?)",
+                                    ("SchemaVersion", str(MANIFEST_SCHEMA_VERSION)))
+
+    def get_file_hash(self, filepath):
+        """Content hash of the file, None if it does not exist. Only hashed again if its size or mtime changed."""
+
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return None
+
+        cached = self.file_hashes.get(filepath)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        file_hash = hash_file_content(filepath)
+        self.set_file_hash(filepath, stat.st_size, stat.st_mtime_ns, file_hash)
+        return file_hash
+
+    def set_file_hash(self, filepath, size, mtime_ns, file_hash):
+        """For files that were already hashed elsewhere; size & mtime have to be taken before reading the file"""
+        self.file_hashes[filepath] = (size, mtime_ns, file_hash)
+        self.connection.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                                (filepath, size, mtime_ns, file_hash))
+
+    def is_up_to_date(self, unified_diff, check_sources=True):
+        """
+        Whether `unified_diff` (UnifiedDiffEntry of the current inputs) was unified before, and
+        none of the source files it read changed since. Sources read at a commit cannot
+        change, so they do not need to be checked.
+        """
+
+        if self.diffs.get(unified_diff.DiffFile) != unified_diff:
+            return False
+        if not check_sources:
+            return True
+        return all([self.get_file_hash(source.SourcePath) == source.SourceHash
+                    for source in self.sources_by_diff.get(unified_diff.DiffFile, [])])
+
+    def get_datapoint_ids(self, diff_file=None):
+        """IDs of the written datapoints of `diff_file`, or of all diffs"""
+        diff_files = self.diffs if diff_file is None else [diff_file]
+        return [datapoint.DatapointID for recorded_diff_file in diff_files
+                for datapoint in self.datapoints_by_diff.get(recorded_diff_file, [])
+                if datapoint.DuplicateOf is None]
+
+    def get_kept_datapoint_ids(self):
+        """{dedupe key: ID of the written datapoint}"""
+        return {datapoint.DedupeKey: datapoint.DatapointID for datapoints in self.datapoints_by_diff.values()
+                for datapoint in datapoints if datapoint.DuplicateOf is None}
+
+    def get_diffs_referencing(self, datapoint_ids):
+        """Diffs with duplicates of any of `datapoint_ids`"""
+        datapoint_ids = set(datapoint_ids)
+        return set([diff_file for diff_file, datapoints in self.datapoints_by_diff.items()
+                    if any([datapoint.DuplicateOf in datapoint_ids for datapoint in datapoints])])
+
+    def get_output_hashes(self):
+        return set([output.OutputHash for outputs in self.outputs_by_diff.values() for output in outputs])
+
+    def get_diff_files(self):
+        return list(self.diffs)
+
+    def remove_diff(self, diff_file):
+        self.diffs.pop(diff_file, None)
+        self.outputs_by_diff.pop(diff_file, None)
+        self.sources_by_diff.pop(diff_file, None)
+        self.datapoints_by_diff.pop(diff_file, None)
+        self.connection.execute("DELETE FROM unified_diffs WHERE DiffFile = ?", (diff_file,))
+        self.connection.execute("DELETE FROM unified_outputs WHERE DiffFile = ?", (diff_file,))
+        self.connection.execute("DELETE FROM unified_sources WHERE DiffFile = ?", (diff_file,))
+        self.connection.execute("DELETE FROM unified_datapoints WHERE DiffFile = ?", (diff_file,))
+
+    def add_diff(self, unified_diff, outputs, datapoints, sources=()):
+        """
+        Records a unified diff with its UnifiedOutputEntry outputs, UnifiedDatapointEntry
+        datapoints and UnifiedSourceEntry sources, replacing previous records
+        """
+
+        self.remove_diff(unified_diff.DiffFile)
+        self.diffs[unified_diff.DiffFile] = unified_diff
+        self.outputs_by_diff[unified_diff.DiffFile] = list(outputs)
+        self.sources_by_diff[unified_diff.DiffFile] = list(sources)
+        self.datapoints_by_diff[unified_diff.DiffFile] = list(datapoints)
+        self.connection.execute("INSERT INTO unified_diffs VALUES (?, ?, ?, ?, ?)", unified_diff)
+        self.connection.executemany("INSERT INTO unified_outputs VALUES (?, ?, ?, ?, ?)", outputs)
+        self.connection.executemany("INSERT INTO unified_sources VALUES (?, ?, ?)", sources)
+        self.connection.executemany("INSERT INTO unified_datapoints VALUES (?, ?, ?, ?)", datapoints)
+
+    def commit(self):
+        """
+        Changes are only persisted here, after the datapoints were written. Datapoints
+        written after the last commit of an interrupted run are therefore not in the manifest,
+        and are removed as stale by the next run.
+        """
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
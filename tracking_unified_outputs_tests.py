@@ -0,0 +1,95 @@
+import unittest
+import os
+import tempfile
+from indexing_analysis_files import hash_file_content
+from tracking_unified_outputs import (UnificationManifest, UnifiedDiffEntry, UnifiedOutputEntry, UnifiedSourceEntry,
+                                      UnifiedDatapointEntry)
+
+
+class TestUnificationManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manifest_path = f"{self.tmp_dir.name}/manifest.sqlite"
+        self.source_path = f"{self.tmp_dir.name}/A.cs"
+        with open(self.source_path, 'w') as f:
+            f.write("int i;\n")
+        self.other_source_path = f"{self.tmp_dir.name}/B.cs"
+        with open(self.other_source_path, 'wb') as f:
+            f.write(b"\xff")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_up_to_date_until_inputs_change(self):
+        unified_diff = UnifiedDiffEntry("a.diff", "diffhash", "a.xml", "analysishash", "1")
+        outputs = [UnifiedOutputEntry("12345678", "a.diff", "a__A.cs", self.source_path, hash_file_content(self.source_path))]
+        datapoints = [UnifiedDatapointEntry("12345678-0", "a.diff", "key0", None),
+                      UnifiedDatapointEntry("12345678-1", "a.diff", "key1", None)]
+
+        # Also sources without outputs, e.g. that could not be decoded
+        sources = [UnifiedSourceEntry("a.diff", self.source_path, hash_file_content(self.source_path)),
+                   UnifiedSourceEntry("a.diff", self.other_source_path, hash_file_content(self.other_source_path))]
+
+        manifest = UnificationManifest(self.manifest_path)
+        self.assertFalse(manifest.is_up_to_date(unified_diff))
+        manifest.add_diff(unified_diff, outputs, datapoints, sources)
+        manifest.commit()
+        manifest.close()
+
+        manifest = UnificationManifest(self.manifest_path)
+        self.assertTrue(manifest.is_up_to_date(unified_diff))
+        self.assertEqual(manifest.get_datapoint_ids(), ["12345678-0", "12345678-1"])
+        self.assertFalse(manifest.is_up_to_date(unified_diff._replace(DiffHash="otherhash")))
+        self.assertFalse(manifest.is_up_to_date(unified_diff._replace(UnificationVersion="2")))
+
+        with open(self.other_source_path, 'w') as f:
+            f.write("int j;\n")
+        self.assertFalse(manifest.is_up_to_date(unified_diff))
+        self.assertTrue(manifest.is_up_to_date(unified_diff, check_sources=False))
+
+        manifest.remove_diff("a.diff")
+        self.assertEqual(manifest.get_datapoint_ids(), [])
+        manifest.close()
+
+    def test_uncommitted_changes_are_discarded(self):
+        manifest = UnificationManifest(self.manifest_path)
+        manifest.add_diff(UnifiedDiffEntry("a.diff", "diffhash", "a.xml", "analysishash", "1"), [], [])
+        manifest.close()
+
+        self.assertEqual(UnificationManifest(self.manifest_path).get_diff_files(), [])
+
+    def test_duplicate_references(self):
+        manifest = UnificationManifest(self.manifest_path)
+        manifest.add_diff(UnifiedDiffEntry("one.diff", "diffhash1", "one.xml", "analysishash1", "1"), [],
+                          [UnifiedDatapointEntry("1-0", "one.diff", "key0", None),
+                           UnifiedDatapointEntry("1-1", "one.diff", "key1", None)])
+        manifest.add_diff(UnifiedDiffEntry("two.diff", "diffhash2", "two.xml", "analysishash2", "1"), [],
+                          [UnifiedDatapointEntry("2-0", "two.diff", "key1", "1-1"),
+                           UnifiedDatapointEntry("2-1", "two.diff", "key2", None)])
+
+        # Duplicates are not written
+        self.assertEqual(manifest.get_datapoint_ids(), ["1-0", "1-1", "2-1"])
+        self.assertEqual(manifest.get_kept_datapoint_ids(), {"key0": "1-0", "key1": "1-1", "key2": "2-1"})
+        self.assertEqual(manifest.get_diffs_referencing(manifest.get_datapoint_ids("one.diff")), {"two.diff"})
+        self.assertEqual(manifest.get_diffs_referencing(manifest.get_datapoint_ids("two.diff")), set())
+        manifest.close()
+
+    def test_file_hash_cache(self):
+        manifest = UnificationManifest(self.manifest_path)
+        self.assertIsNone(manifest.get_file_hash(f"{self.tmp_dir.name}/missing.cs"))
+
+        file_hash = manifest.get_file_hash(self.source_path)
+        self.assertEqual(file_hash, hash_file_content(self.source_path))
+        # Not hashed again while size & mtime are the same
+        stat = os.stat(self.source_path)
+        manifest.set_file_hash(self.source_path, stat.st_size, stat.st_mtime_ns, "cachedhash")
+        self.assertEqual(manifest.get_file_hash(self.source_path), "cachedhash")
+
+        os.utime(self.source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(manifest.get_file_hash(self.source_path), file_hash)
+        manifest.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+This file defines the records of the unified (and tokenized) dataset, see
+sample_unified_data_model.json. The records use __slots__, so that the many
+datapoints of large repositories are small and cheap to create, and are
+converted from/to JSON explicitly instead of copying a sample dict.
+
+Fields keep the names of the JSON keys. Fields in OPTIONAL_FIELDS are left
+out of the JSON if they are None, e.g. the fields added by the tokenization.
+
+"""
+
+from dataclasses import dataclass
+
+
+class Record:
+
+    __slots__ = ()
+    OPTIONAL_FIELDS = ()
+
+    def to_json(self):
+        json_dict = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if value is None and field in self.OPTIONAL_FIELDS:
+                continue
+            json_dict[field] = value.to_json() if isinstance(value, Record) else value
+        return json_dict
+
+    @classmethod
+    def from_json(cls, json_dict):
+        return cls(**{field: json_dict.get(field) for field in cls.__slots__})
+
+
+@dataclass
+class DiagnosticOccurance(Record):
+    __slots__ = ("Message", "Line", "Character", "TokenizedMessage")
+    OPTIONAL_FIELDS = ("TokenizedMessage",)
+
+    Message: str
+    Line: int
+    Character: int
+    TokenizedMessage: list
+
+
+@dataclass
+class ReplaceAction(Record):
+    __slots__ = ("SourceLocations", "TargetLines", "TokenizedTargetLines")
+    OPTIONAL_FIELDS = ("TokenizedTargetLines",)
+
+    SourceLocations: list
+    TargetLines: list
+    TokenizedTargetLines: list
+
+
+@dataclass
+class AddAction(Record):
+    __slots__ = ("PreviousSourceLocation", "TargetStartLocation", "TargetLines", "TokenizedTargetLines")
+    OPTIONAL_FIELDS = ("TokenizedTargetLines",)
+
+    PreviousSourceLocation: int
+    TargetStartLocation: int
+    TargetLines: list
+    TokenizedTargetLines: list
+
+
+@dataclass
+class RemoveAction(Record):
+    __slots__ = ("SourceLocationStart", "SourceLocationEnd")
+
+    SourceLocationStart: int
+    SourceLocationEnd: int
+
+
+ACTION_TYPES = {
+    "REPLACE": ReplaceAction,
+    "ADD": AddAction,
+    "REMOVE": RemoveAction
+}
+
+
+@dataclass
+class ParsedDiff(Record):
+    __slots__ = ("ActionType", "Action")
+
+    ActionType: str
+    Action: Record
+
+    @classmethod
+    def from_json(cls, json_dict):
+        return cls(json_dict["ActionType"], ACTION_TYPES[json_dict["ActionType"]].from_json(json_dict["Action"]))
+
+
+@dataclass
+class UnifiedDatapoint(Record):
+    __slots__ = ("Repo", "RepoURL", "SolutionFile", "FilePath", "NumberFileLines", "Commit", "FileURL",
+                 "DiagnosticID", "AnalyzerNuGet", "Severity", "RequiredLinesStart", "RequiredLinesEnd",
+                 "DiagnosticOccurances", "ParsedDiff", "FileContextStart", "FileContext",
+                 "TokenizedFileContext", "TokenizedFileContextStart")
+    # RepoURL, SolutionFile, FilePath & Commit are removed from tokenized datapoints
+    OPTIONAL_FIELDS = ("RepoURL", "SolutionFile", "FilePath", "Commit",
+                       "TokenizedFileContext", "TokenizedFileContextStart")
+
+    Repo: str
+    RepoURL: str
+    SolutionFile: str
+    FilePath: str
+    NumberFileLines: int
+    Commit: str
+    FileURL: str
+    DiagnosticID: str
+    AnalyzerNuGet: str
+    Severity: str
+    RequiredLinesStart: int
+    RequiredLinesEnd: int
+    DiagnosticOccurances: list
+    ParsedDiff: ParsedDiff
+    FileContextStart: int
+    FileContext: list
+    TokenizedFileContext: list
+    TokenizedFileContextStart: int
+
+    def to_json(self):
+        json_dict = super().to_json()
+        json_dict["DiagnosticOccurances"] = [diagnostic_occurance.to_json()
+                                             for diagnostic_occurance in self.DiagnosticOccurances]
+        return json_dict
+
+    @classmethod
+    def from_json(cls, json_dict):
+        datapoint = super().from_json(json_dict)
+        datapoint.DiagnosticOccurances = [DiagnosticOccurance.from_json(diagnostic_occurance)
+                                          for diagnostic_occurance in json_dict["DiagnosticOccurances"]]
+        datapoint.ParsedDiff = ParsedDiff.from_json(json_dict["ParsedDiff"])
+        return datapoint
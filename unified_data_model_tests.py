@@ -0,0 +1,37 @@
+import unittest
+import json
+import pickle
+from unified_data_model import UnifiedDatapoint
+
+
+class TestUnifiedDataModel(unittest.TestCase):
+
+    def test_round_trip_samples(self):
+        with open("sample_unified_data_model.json") as f:
+            samples = json.load(f)
+
+        for sample in samples.values():
+            datapoint = UnifiedDatapoint.from_json(sample)
+            # Samples predate RequiredLinesStart/RequiredLinesEnd
+            json_dict = {key: value for key, value in datapoint.to_json().items() if key in sample}
+            self.assertEqual(json.dumps(json_dict), json.dumps(sample))
+            self.assertEqual(pickle.loads(pickle.dumps(datapoint)), datapoint)
+
+    def test_tokenized_fields(self):
+        with open("sample_unified_data_model.json") as f:
+            sample = json.load(f)["REMOVE-example"]
+
+        datapoint = UnifiedDatapoint.from_json(sample)
+        datapoint.Commit = None
+        datapoint.TokenizedFileContextStart = 3
+        datapoint.DiagnosticOccurances[0].TokenizedMessage = ["a"]
+
+        json_dict = datapoint.to_json()
+        self.assertNotIn("Commit", json_dict)
+        self.assertEqual(list(json_dict)[-1], "TokenizedFileContextStart")
+        self.assertEqual(json_dict["DiagnosticOccurances"][0]["TokenizedMessage"], ["a"])
+        self.assertFalse(hasattr(datapoint, "__dict__"))
+
+
+if __name__ == '__main__':
+    unittest.main()
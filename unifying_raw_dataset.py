@@ -3,68 +3,65 @@ This file unifies the fixes and the analysis made by Roslynator into single data
 
 """
 
-import xml.etree.ElementTree as ET
 import json
 import os
 import urllib.request
-from unidiff import PatchSet, PatchedFile
-import pandas as pd
 import hashlib
-import copy
-from parsing_diffs import parse_hunk
+import time
+import gc
+import pickle
+import shutil
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+from parsing_diffs import iter_parsed_patched_files, DiffActionArrays, ACTION_REPLACE, ACTION_ADD, ACTION_REMOVE, NO_LINE
+from indexing_analysis_files import load_or_index_analysis_file, hash_file_content
+from cataloging_raw_dataset import load_or_build_catalog
+from compressing_raw_dataset import strip_compression_extension
+from filtering_fixable_diagnostics import FIXABLE_DIAGNOSTICS_PATH, load_fixable_diagnostics, hash_fixable_diagnostic_ids
+from reading_source_files import get_source_file, source_file_cache, git_source_file_cache
+from unified_data_model import UnifiedDatapoint, DiagnosticOccurance, ParsedDiff, ACTION_TYPES
+from sharding_datapoints import ShardedDatapointReader, ShardedDatapointWriter, remove_datapoints
+from tracking_unified_outputs import (UnificationManifest, UnifiedDiffEntry, UnifiedOutputEntry, UnifiedSourceEntry,
+                                      UnifiedDatapointEntry, MANIFEST_FILENAME, hash_content)
+from profiling_unification import UnificationProfile, RssMonitor, profiling, get_rss_bytes, PROFILE_MODES
+from collections import namedtuple
 
 
 diff_dir = "raw_dataset/diffs"
 analysis_dir = "raw_dataset/analysis_files"
+analysis_index_cache_dir = "raw_dataset/analysis_index_cache"
+catalog_path = "raw_dataset/catalog.sqlite"
 unified_dataset_dir = "unified_dataset"
 repositories_dir = "submodule_repos_to_analyze"
-
-
-df_repos = pd.read_csv("github_repos.csv")
-analysis_files = [f.name for f in os.scandir(
-    analysis_dir) if f.is_file() and not f.name == ".DS_Store"]
-unified_data_files = [f.name.split("-")[0] for f in os.scandir(
-    unified_dataset_dir) if f.is_file()]
-
-# Instantiate this multiple times later:
-unified_data_sample = {
-    "Repo": "",
-    "RepoURL": "",
-    "SolutionFile": "",
-    "FilePath": "",
-    "NumberFileLines": "",
-    "Commit": "",
-    "FileURL": "",
-    "DiagnosticID": "",
-    "AnalyzerNuGet": "",
-    "Severity": "",
-    "RequiredLinesStart": None,
-    "RequiredLinesEnd": None,
-    "DiagnosticOccurances": [
-        # {
-        #     "Message": "",
-        #     "Line": 0,
-        #     "Character": 0
-        # },
-    ],
-    "ParsedDiff": {
-        "ReplacedLines": [
-            # {
-            #     "SourceLocations": [4, 5],
-            #     "TargetLines": ["static int i = 0;"]
-            # }
-        ],
-        "RemovedLines": [],
-        "AddedLines": [
-            # {
-            #     "TargetStartLocation": 34,
-            #     "TargetLines": ["static int i = 0;"]
-            # }
-        ]
-    },
-    "FileContextStart": None,
-    "FileContext": [],
-}
+# If it exists, diagnostics without a CodeFixProvider are not indexed (see filtering_fixable_diagnostics.py)
+fixable_diagnostics_path = FIXABLE_DIAGNOSTICS_PATH
+# Read source files at the analysed commit instead of the checked out working tree
+read_sources_at_commit = False
+# Drop datapoints that duplicate an earlier datapoint (see get_dedupe_key)
+drop_duplicate_datapoints = True
+# Stage timings & slowest files of each run, see profiling_unification.py
+report_path = "unification_report.json"
+# Optional profiling of every diff file: None, "cprofile" (stats in profile_dir) or "tracemalloc"
+profile_mode = None
+profile_dir = "unification_profiles"
+# Bounded-memory mode for giant diffs (e.g. fix-all diffs touching thousands of files): workers
+# only load the index of the diff's DiagnosticID and spill the datapoints of every patched file to
+# disk, instead of returning all datapoints of an analysis group at once
+bounded_memory = False
+# RSS ceiling per worker in bounded-memory mode, None for no ceiling. Exceeding it drops the
+# source file caches; if that does not help, the diff is aborted. Aborted diffs are recorded, and
+# only unified again with another ceiling (or once the diff or analysis file changes).
+max_worker_rss_mb = 4096
+
+# Increase whenever the unification changes the datapoints, forces all diffs to be unified again
+UNIFICATION_VERSION = 1
+
+# Outputs of one patched file, also of patched files without datapoints (whose source files are
+# still recorded in the manifest). SourceStat is the (size, mtime_ns) of the source file before
+# it was read, None if it was read at the commit. SourceHash is None if it could not be read at the commit.
+UnifiedPatchedFile = namedtuple("UnifiedPatchedFile", [
+    "Filename", "FilenameHash", "SourcePath", "SourceHash", "SourceStat", "Datapoints"])
 
 
 def hash_filename(filename):
@@ -72,151 +69,156 @@ def hash_filename(filename):
     return f"{str(int(hashlib.sha256(filename.encode('utf-8')).hexdigest(), 16) % 10**8)}"
 
 
-def filter_analysis_files(repo_name, solution_filename, nuget_full_name):
+def get_dedupe_key(unified_datapoint, source_hash):
+    """
+    The same fix of the same file content, which occurs many times since one project can be
+    included by multiple solutions (see filter_useful_datapoints in finalize_tokenized_dataset.py)
+    """
+    key = [unified_datapoint.Repo, unified_datapoint.FilePath, source_hash,
+           unified_datapoint.DiagnosticID, unified_datapoint.ParsedDiff.to_json()]
+    return hash_content(json.dumps(key, ensure_ascii=False, sort_keys=True).encode('utf-8'))
 
-    def filter_func(analysis_filename):
-        """
-        $ANALYSIS_FILEPATH = "${Using:REPO_NAME}__${SOLUTION_FILENAME}__${Using:LAST_COMMIT}__${NUGET_FULL_NAME}.xml"
 
-        Sample ANALYSIS_FILEPATH:
-        raw_dataset\analysis_files\runtime__Common.Tests.sln__dcf816579c616e1d172d587301a0a769aa1c0771__AkzenteIT.Analyzers.1.0.6304.37642.xml
+def match_diff_actions_to_diagnostics(diagnostic_lines, diff_actions):
+    """
+        To which diff action does each diagnostic correspond to? Returns the action number of
+        each diagnostic line of the file, or -1 if it leads to no action.
 
-        Disregarding LAST_COMMIT for now.
-        """
-        REPO_NAME, SOLUTION_FILENAME, LAST_COMMIT, NUGET_FULL_NAME = analysis_filename[:-len(
-            '.xml')].split("__")
-        if repo_name == REPO_NAME and solution_filename == SOLUTION_FILENAME and nuget_full_name == NUGET_FULL_NAME:
-            return True
-        else:
-            return False
+        In some cases, multiple diagnostic occurances may have generated one action. An example
+        would be two occurances in the same line, but at different characters. If the line was
+        deleted in the diff, we would not know which diagnostic occurance caused this to happen.
+        Therefore, these occurances are bundled. One diagnostic occurance can however only have
+        generated a single action. The assumption is that this action will be "at the same line"
+        as the diagnostic occurance. This however also has shortcomings for multi-line diffs (they
+        will be split up).
 
-    return filter_func
+        WARNING: Very hacky code. Trying to align diff actions with diagnostics, which is very speculative.
 
+        Same assignments as the previous scan over all diff batches per diagnostic occurance, see
+        match_diff_batches_to_diagnostics_linear in unifying_raw_dataset_tests.py.
 
-def filter_diagnostic_occurance(new_occurance_dict):
-    def filter_func(existing_occurance_dict):
-        if (
-            existing_occurance_dict["Message"] == new_occurance_dict["Message"] and
-            existing_occurance_dict["Line"] == new_occurance_dict["Line"] and
-            existing_occurance_dict["Character"] == new_occurance_dict["Character"]
-        ):
-            return True
-        return False
-    return filter_func
+        The REPLACE/REMOVE lookups and the ADD candidates of all diagnostics are found with
+        searchsorted. Only the ADD assignment loops over the remaining diagnostics, since
+        it depends on the assignments of the previous diagnostics.
+    """
 
+    diagnostic_lines = np.asarray(diagnostic_lines, dtype=np.int64)
+    matched_actions = np.full(len(diagnostic_lines), -1, dtype=np.int64)
+
+    # The source ranges of one kind do not overlap, so the only candidate is the
+    # last range starting at or before the line
+    for kind in (ACTION_REPLACE, ACTION_REMOVE):
+        action_nums = np.flatnonzero(diff_actions.kinds == kind)
+        action_nums = action_nums[np.argsort(diff_actions.source_starts[action_nums], kind='stable')]
+        idx = np.searchsorted(diff_actions.source_starts[action_nums], diagnostic_lines, side='right') - 1
+        is_inside = (matched_actions == -1) & (idx >= 0)
+        is_inside[is_inside] = diagnostic_lines[is_inside] <= diff_actions.source_ends[action_nums[idx[is_inside]]]
+        matched_actions[is_inside] = action_nums[idx[is_inside]]
+
+    # ADD actions sorted by PreviousSourceLocation, in batch order for the same line
+    add_action_nums = np.flatnonzero((diff_actions.kinds == ACTION_ADD) &
+                                     (diff_actions.previous_source_lines != NO_LINE))
+    unmatched = np.flatnonzero(matched_actions == -1)
+    if len(add_action_nums) == 0 or len(unmatched) == 0:
+        return matched_actions
+
+    add_action_nums = add_action_nums[np.argsort(
+        diff_actions.previous_source_lines[add_action_nums], kind='stable')]
+    previous_source_lines = diff_actions.previous_source_lines[add_action_nums]
+    unmatched_lines = diagnostic_lines[unmatched]
+    above_starts = np.searchsorted(previous_source_lines, unmatched_lines - 1, side='left')
+    above_ends = np.searchsorted(previous_source_lines, unmatched_lines - 1, side='right')
+    beneath_starts = np.searchsorted(previous_source_lines, unmatched_lines, side='left')
+    beneath_ends = np.searchsorted(previous_source_lines, unmatched_lines, side='right')
+
+    add_action_nums = add_action_nums.tolist()
+    add_action_is_above_diagnostic_position = {}
+    for diagnostic_num, above_start, above_end, beneath_start, beneath_end in zip(
+            unmatched.tolist(), above_starts.tolist(), above_ends.tolist(),
+            beneath_starts.tolist(), beneath_ends.tolist()):
+
+        # If added lines are above diagnostic, unless the ADD action already has diagnostics above it
+        for action_num in add_action_nums[above_start:above_end]:
+            if add_action_is_above_diagnostic_position.get(action_num, True):
+                add_action_is_above_diagnostic_position[action_num] = True
+                matched_actions[diagnostic_num] = action_num
+                break
+        else:
+            # If added lines are beneath diagnostic
+            if beneath_start < beneath_end:
+                action_num = add_action_nums[beneath_start]
+                add_action_is_above_diagnostic_position[action_num] = False
+                matched_actions[diagnostic_num] = action_num
 
-def match_diff_batches_to_diagnostics(diagnostics, all_added_lines, all_removed_lines, all_replaced_lines):
-    """
-        To which diff-batch does each diagnostic correspond to?
-        In some cases, multiple diagnostic occurances may have generated
-        one "diff batch". An example would be two occurances in the same line,
-        but at different characters. If the line was deleted in the diff, we would
-        not know which diagnostic occurance caused this to happen. Therefore,
-        these occurances are bundled. 
-        One diagnostic occurance can however only have generated a single 
-        diff batch. The assumption is that this diff batch will be "at the same
-        line" as the diagnostic occurance. This however also has shortcomings
-        for multi-line diffs (they will be split up).
-
-        WARNING: Very hacky code. Trying to align diff batches with diagnostics, which is very speculative.
-
-        Diagnostics that result in multiple diff batches are not handled well; the diff batches will be
-        split up, since one datapoint can only have one diff batch.
-
-        IRL, it would actually make sense that one diagnostic has multiple 
-        diff batches and not the other way around...
-    """
+    return matched_actions
 
-    add_batch_is_above_diagnostic_position = {}
-    diff_batch_to_diagnostics = {}
-    for diagnostic_occurance in unique_diagnostic_occurances:
 
-        diff_key = None
-        for count, value in enumerate(all_replaced_lines):
-            if diagnostic_occurance["Line"] in value["SourceLocations"]:
-                diff_key = f"REPLACE-{count}"
-                break
+def compute_required_lines(diagnostic_lines, matched_actions, diff_actions):
+    """
+        Returns (first diagnostic line, first required line, last required line) per action,
+        i.e. the lines of the action's diagnostics and deleted source lines that have to be
+        inside FileContext. Only meaningful for actions with diagnostics.
+    """
 
-        if not diff_key:
-            for count, value in enumerate(all_removed_lines):
-                if (diagnostic_occurance["Line"] >= value["SourceLocationStart"] and
-                        diagnostic_occurance["Line"] <= value["SourceLocationEnd"]):
-                    diff_key = f"REMOVE-{count}"
-                    break
+    diagnostic_lines = np.asarray(diagnostic_lines, dtype=np.int64)
+    is_matched = matched_actions != -1
 
-        # Do added_lines last, since intuitively, finding deleted lines is easier; diagnostic
-        # will probably be inside one of the deleted/replaced lines?
-        # Adding lines on the other hand is evenly likely to happen before
-        # or after the diagnostic. Here we are prioritising ADD batches that happen above
-        # the diagnostics, unless these already have diagnostics above them.
-
-        if not diff_key:
-            for count, value in enumerate(all_added_lines):
-                # If added lines are above diagnostic
-                if (diagnostic_occurance["Line"] - 1) == value["PreviousSourceLocation"]:
-                    diff_key = f"ADD-{count}"
-
-                    # If a ADD diff batch already has diagnostics above it, then it more
-                    # likely to find the correct diff batch underneath the current diagnostic.
-                    if diff_key in add_batch_is_above_diagnostic_position:
-                        if not add_batch_is_above_diagnostic_position[diff_key]:
-                            diff_key = None
-                            continue
-                    else:
-                        add_batch_is_above_diagnostic_position[diff_key] = True
+    first_diagnostic_lines = np.full(len(diff_actions), np.iinfo(np.int64).max, dtype=np.int64)
+    last_diagnostic_lines = np.full(len(diff_actions), np.iinfo(np.int64).min, dtype=np.int64)
+    np.minimum.at(first_diagnostic_lines, matched_actions[is_matched], diagnostic_lines[is_matched])
+    np.maximum.at(last_diagnostic_lines, matched_actions[is_matched], diagnostic_lines[is_matched])
 
-                    break
+    # ADD actions delete no lines, only the line above the added lines is required
+    is_add = diff_actions.kinds == ACTION_ADD
+    first_diff_lines = np.where(is_add, diff_actions.previous_source_lines, diff_actions.source_starts)
+    first_required_lines = np.minimum(first_diagnostic_lines, first_diff_lines)
+    last_required_lines = np.where(is_add, last_diagnostic_lines,
+                                   np.maximum(last_diagnostic_lines, diff_actions.source_ends))
 
-        if not diff_key:
-            for count, value in enumerate(all_added_lines):
-                # If added lines are beneath diagnostic
-                if diagnostic_occurance["Line"] == value["PreviousSourceLocation"]:
-                    diff_key = f"ADD-{count}"
-                    add_batch_is_above_diagnostic_position[diff_key] = False
-                    break
+    return first_diagnostic_lines, first_required_lines, last_required_lines
 
-        # Diagnostic occurance leads to no obvious diff batch
-        if not diff_key:
-            continue
 
-        if diff_key not in diff_batch_to_diagnostics:
-            diff_batch_to_diagnostics[diff_key] = []
-        diff_batch_to_diagnostics[diff_key].append(
-            diagnostic_occurance)
+# Read-only state of each worker process, set by init_worker
+worker_repo_urls = {}
+worker_unified_data_files = set()
+worker_spill_dir = None
+worker_fixable_diagnostics = None
 
-    return diff_batch_to_diagnostics
 
+def init_worker(repo_urls, unified_data_files, spill_dir=None, fixable_diagnostics=None):
+    global worker_repo_urls, worker_unified_data_files, worker_spill_dir, worker_fixable_diagnostics
+    worker_repo_urls = repo_urls
+    worker_unified_data_files = unified_data_files
+    worker_spill_dir = spill_dir
+    worker_fixable_diagnostics = fixable_diagnostics
+    # Source files mapped by an earlier run in this process may have changed since
+    source_file_cache.clear()
+    git_source_file_cache.clear()
 
-diff_files = [f.name for f in os.scandir(diff_dir) if f.is_file()]
-for diff_file in diff_files:
 
-    print("diff_file: ", diff_file)
+def get_fixable_diagnostic_ids(analyzer_nuget, fixable_diagnostics):
+    """None if all diagnostics are indexed"""
+    if fixable_diagnostics is None:
+        return None
+    return fixable_diagnostics.get(analyzer_nuget)
 
-    # $ANALYSIS_FILEPATH = "${Using:REPO_NAME}__${SOLUTION_FILENAME}__${Using:LAST_COMMIT}__${NUGET_FULL_NAME}__${DIAGNOSTIC_ID}.diff"
-    REPO_NAME, SOLUTION_FILENAME, LAST_COMMIT, NUGET_FULL_NAME, DIAGNOSTIC_ID = diff_file[:-len(
-        '.diff')].split("__")
 
-    # Prepare XML analysis file
-    analysis_file_for_diff = list(filter(filter_analysis_files(
-        REPO_NAME, SOLUTION_FILENAME, NUGET_FULL_NAME), analysis_files))
-    print("analysis_file_for_diff: ", analysis_file_for_diff)
-    if len(analysis_file_for_diff) != 1:
-        print("More than one analysis_file_for_diff!")
-        # input("Press Enter to continue...")
-    analysis_file_for_diff = analysis_file_for_diff[0]
-    # Generated by Roslynator as 'Filepath'
-    analyzed_file_prefix = f"C:\\Users\\vlohse\Desktop\\neural-repair-static-analysis\\submodule_repos_to_analyze\\{REPO_NAME}\\"
+def iter_unified_patched_files(diff_entry, diagnostic_index, profile):
+    """Yields one UnifiedPatchedFile per patched file whose source file was read, one patched file at a time"""
 
-    tree = ET.parse(f"{analysis_dir}/{analysis_file_for_diff}")
-    root = tree.getroot()  # <Roslynator></Roslynator> is root
-    projects_analysed = root.find('CodeAnalysis').find('Projects')
+    diff_file = diff_entry.Filename
+    print("diff_file: ", diff_file)
 
-    patch_set = PatchSet.from_filename(f"{diff_dir}/{diff_file}")
+    REPO_NAME = diff_entry.Repo
+    SOLUTION_FILENAME = diff_entry.SolutionFile
+    LAST_COMMIT = diff_entry.Commit
+    NUGET_FULL_NAME = diff_entry.AnalyzerNuGet
+    DIAGNOSTIC_ID = diff_entry.DiagnosticID
 
     repo_dir = f"{repositories_dir}/{REPO_NAME}"
 
     # One patch per file
-    for patched_file in patch_set:
+    for patched_file in profile.time_iterator("parse_diff", iter_parsed_patched_files(f"{diff_dir}/{diff_file}")):
         if patched_file.is_added_file or patched_file.is_removed_file:
             continue
 
@@ -224,167 +226,96 @@ for diff_file in diff_files:
 
         parsed_file_path = patched_file.path.replace(
             "/", "--").replace("\\", "--")
-        unified_data_filename = f"{diff_file[:-len('.diff')]}__{parsed_file_path}"
+        # Without compression extension, so that compressing the raw dataset keeps the datapoint IDs
+        unified_data_filename = f"{strip_compression_extension(diff_file)[:-len('.diff')]}__{parsed_file_path}"
         unified_data_filename_hash = f"{hash_filename(unified_data_filename)}"
-        if unified_data_filename_hash in unified_data_files:
+        if unified_data_filename_hash in worker_unified_data_files:
             print(
                 f"unified_data_filename_hash already exists! file: {unified_data_filename}")
-            # Appending unified_data_filename_hash to unified_data_files later on
             continue
 
-        unified_data_file = copy.deepcopy(unified_data_sample)
-
-        repo_row = df_repos.loc[df_repos['RepoName'] == REPO_NAME].iloc[0]
-
-        unified_data_file["Repo"] = REPO_NAME
-        unified_data_file["RepoURL"] = repo_row["RepoURL"]
-        unified_data_file["SolutionFile"] = SOLUTION_FILENAME
-        unified_data_file["FilePath"] = patched_file.path
-        unified_data_file["Commit"] = LAST_COMMIT
-        unified_data_file["DiagnosticID"] = DIAGNOSTIC_ID
-        unified_data_file["AnalyzerNuGet"] = NUGET_FULL_NAME
-
-        repo_url = repo_row["RepoURL"]
+        file_url = ""
+        repo_url = worker_repo_urls[REPO_NAME]
         if "https://github.com" in repo_url:
             repo_url = repo_url[:-len('.git')
                                 ] if repo_url.endswith('.git') else repo_url
-            unified_data_file["FileURL"] = f"{repo_url}/blob/{LAST_COMMIT}/{patched_file.path}"
+            file_url = f"{repo_url}/blob/{LAST_COMMIT}/{patched_file.path}"
 
+        source_path = f"{repo_dir}/{patched_file.path}"
         try:
-            with open(f"{repo_dir}/{patched_file.path}") as f:
-                unified_data_file["NumberFileLines"] = len(list(f))
-        except UnicodeDecodeError as e:
+            with profile.stage("read_source"):
+                source_stat = None
+                if not read_sources_at_commit:
+                    stat = os.stat(source_path)
+                    source_stat = (stat.st_size, stat.st_mtime_ns)
+                source_file = get_source_file(
+                    repo_dir, LAST_COMMIT, patched_file.path, read_sources_at_commit)
+                number_file_lines = source_file.num_lines
+        except (UnicodeDecodeError, KeyError) as e:
             print(f"Error reading file: {repo_dir}/{patched_file.path}; Error: {e}")
+            profile.count("SourceReadErrors")
+            # Recorded anyway, so that the diff is unified again once the file changes
+            source_hash = hash_file_content(source_path) if source_stat is not None else None
+            yield UnifiedPatchedFile(
+                unified_data_filename, unified_data_filename_hash, source_path, source_hash, source_stat, [])
             continue
 
-        all_replaced_lines = []
-        all_added_lines = []
-        all_removed_lines = []
-        for hunk in patched_file:
-            replaced_lines, added_lines, removed_lines = parse_hunk(hunk)
-            all_replaced_lines += replaced_lines
-            all_added_lines += added_lines
-            all_removed_lines += removed_lines
-
-        count = 0
-        project_filepaths = []
-        unique_diagnostic_occurances = []
-        for xml_project in projects_analysed:
-
-            # TODO: Check whether some analysis is based on target framework
-            # Occasionally, Roslynator may perform the same analysis multiple times (due to multiple target frameworks in sln file, etc.)
-            cs_proj_path = xml_project.get('FilePath')
-            if cs_proj_path in project_filepaths:
-                print(
-                    f"This .csproj has been analysed multiple times! cs_proj_path: {cs_proj_path}")
-                continue
-            else:
-                project_filepaths.append(cs_proj_path)
-
-            for xml_diagnostic in xml_project.find('Diagnostics'):
-
-                if not hasattr(xml_diagnostic.find('FilePath'), 'text'):
-                    # Happens rarely. Example:
-                    # CA9998; FxCopAnalyzers package has been deprecated in favor of 'Microsoft.CodeAnalysis.NetAnalyzers'
-
-                    # Cannot be sure that this diagnostic led to fix in our file
-                    continue
-
-                analyzed_file_filepath = xml_diagnostic.find(
-                    'FilePath').text[len(analyzed_file_prefix):].replace("\\", "/")
-
-                if xml_diagnostic.get('Id') != DIAGNOSTIC_ID or analyzed_file_filepath != patched_file.path:
-                    continue
-
-                # Just do this once
-                if count == 0:
-                    unified_data_file["Severity"] = xml_diagnostic.find(
-                        'Severity').text
-                    count += 1
-
-                new_occurance_dict = {
-                    "Message": xml_diagnostic.find('Message').text,
-                    "Line": int(xml_diagnostic.find('Location').get('Line')),
-                    "Character": int(xml_diagnostic.find('Location').get('Character'))
-                }
-
-                # Even though already checking for .csproj duplicates earlier, one file may be referenced
-                # in multiple different projects as well.
-                # Example: SA1642 for <Location Line="55" Character="16" /> in analysis file
-                # Druntime__Microsoft.Bcl.AsyncInterfaces.sln__e98d043d7d293c88a346b632d8fc12564a8ef0ce__Documentation.Analyser.1.1.1.xml
-                occurance_duplicates = filter(filter_diagnostic_occurance(
-                    new_occurance_dict), unique_diagnostic_occurances)
-                if len(list(occurance_duplicates)) != 0:
-                    print(
-                        f"Duplicate DiagnosticOccurance! new_occurance_dict: {new_occurance_dict}")
-                    # input("Press Enter to continue...")
-                    continue
-
-                unique_diagnostic_occurances.append(new_occurance_dict)
+        match_start_time = time.perf_counter()
+        diff_actions = DiffActionArrays.from_parsed_patched_file(patched_file)
 
-        num_diff_batches_in_file = len(
-            all_replaced_lines) + len(all_removed_lines) + len(all_added_lines)
+        severity = ""
+        unique_diagnostic_occurances = []
+        indexed_diagnostics = diagnostic_index.get(
+            (DIAGNOSTIC_ID, patched_file.path))
+        if indexed_diagnostics:
+            severity = indexed_diagnostics["Severity"]
+            # Already deduplicated while indexing the analysis file
+            unique_diagnostic_occurances = indexed_diagnostics["DiagnosticOccurances"]
+
+        num_diff_batches_in_file = len(diff_actions)
         num_diagnostics = len(unique_diagnostic_occurances)
         if num_diff_batches_in_file != num_diagnostics:
             print(
                 f"Num diff batches ({num_diff_batches_in_file}) != diagnostics ({num_diagnostics})")
 
-        diff_batch_to_diagnostic_occurances_dict = match_diff_batches_to_diagnostics(
-            unique_diagnostic_occurances, all_added_lines, all_removed_lines, all_replaced_lines)
+        diagnostic_lines = [diag_occurance["Line"]
+                            for diag_occurance in unique_diagnostic_occurances]
+        matched_actions = match_diff_actions_to_diagnostics(
+            diagnostic_lines, diff_actions)
+        # Find range of lines that are required to be inside FileContext
+        first_diag_lines, first_required_lines, last_required_lines = compute_required_lines(
+            diagnostic_lines, matched_actions, diff_actions)
+
+        # Diagnostic occurances of each action, in the order of their first occurance
+        action_to_diagnostic_occurances = {}
+        for diag_occurance, action_num in zip(unique_diagnostic_occurances, matched_actions.tolist()):
+            if action_num != -1:
+                action_to_diagnostic_occurances.setdefault(action_num, []).append(diag_occurance)
+
+        profile.add_stage_time("match_diagnostics", time.perf_counter() - match_start_time)
+        profile.count("PatchedFiles")
+        profile.count("DiffActions", num_diff_batches_in_file)
+        profile.count("Diagnostics", num_diagnostics)
+        build_start_time = time.perf_counter()
 
         num_diff_datapoint = 0
+        unified_datapoints = []
         # Creating one datapoint per diff action (add/delete/replace)
-        for key, value in diff_batch_to_diagnostic_occurances_dict.items():
+        for action_num, value in action_to_diagnostic_occurances.items():
 
             # TODO: Comment this out for full dataset
             # For a more heterogenuous dataset
             if num_diff_datapoint > 3:
                 continue
 
-            unified_data = copy.deepcopy(unified_data_file)
-            unified_data["DiagnosticOccurances"] = value
-
-            diff_action, action_num = key.split("-")
-            unified_data["ParsedDiff"] = {}
-            unified_data["ParsedDiff"]["ActionType"] = diff_action
-            if diff_action == "REPLACE":
-                unified_data["ParsedDiff"]["Action"] = all_replaced_lines[int(
-                    action_num)]
-            elif diff_action == "ADD":
-                unified_data["ParsedDiff"]["Action"] = all_added_lines[int(
-                    action_num)]
-            elif diff_action == "REMOVE":
-                unified_data["ParsedDiff"]["Action"] = all_removed_lines[int(
-                    action_num)]
-
-            # Find range of lines that are required to be inside FileContext
-
-            diag_occurance_lines = [diag_occurance["Line"]
-                                    for diag_occurance in value]
-            # Roslynator & diff hunks start at index 1
-            first_diag_line = min(diag_occurance_lines)
+            diff_key, action_json = diff_actions.get_action(action_num)
+            diff_action = diff_key.split("-")[0]
+            action = ACTION_TYPES[diff_action].from_json(action_json)
+
             # Roslynator & diff hunks start at index 1
-            last_diag_line = max(diag_occurance_lines)
-
-            # Take into account that all deleted lines have to be in FileContext as well
-            first_diff_line = None
-            last_diff_line = None
-            actionType = unified_data["ParsedDiff"]["ActionType"]
-            if actionType == "REPLACE":
-                first_diff_line = unified_data["ParsedDiff"]["Action"]["SourceLocations"][0]
-                last_diff_line = unified_data["ParsedDiff"]["Action"]["SourceLocations"][-1]
-            elif actionType == "ADD":
-                first_diff_line = unified_data["ParsedDiff"]["Action"]["PreviousSourceLocation"]
-            else:  # actionType == REMOVE
-                first_diff_line = unified_data["ParsedDiff"]["Action"]["SourceLocationStart"]
-                last_diff_line = unified_data["ParsedDiff"]["Action"]["SourceLocationEnd"]
-
-            first_required_line = min(first_diag_line, first_diff_line)
-            last_required_line = max(
-                last_diag_line, last_diff_line) if last_diff_line else last_diag_line
-
-            unified_data["RequiredLinesStart"] = first_required_line
-            unified_data["RequiredLinesEnd"] = last_required_line
+            first_diag_line = int(first_diag_lines[action_num])
+            first_required_line = int(first_required_lines[action_num])
+            last_required_line = int(last_required_lines[action_num])
 
             # Add context around required lines. This is only for intermediate readability
             # since context is added later as a fixed amount of tokens.
@@ -396,20 +327,426 @@ for diff_file in diff_files:
             else:
                 starting_line = 1
 
-            if last_required_line < unified_data_file["NumberFileLines"] - LINE_DELTA:
+            if last_required_line < number_file_lines - LINE_DELTA:
                 ending_line = last_required_line + LINE_DELTA
             else:
-                ending_line = unified_data_file["NumberFileLines"]
-
-            with open(f"{repo_dir}/{patched_file.path}") as f:
-                file_list = list(f)
+                ending_line = number_file_lines
+
+            unified_datapoints.append(UnifiedDatapoint(
+                Repo=REPO_NAME,
+                RepoURL=worker_repo_urls[REPO_NAME],
+                SolutionFile=SOLUTION_FILENAME,
+                FilePath=patched_file.path,
+                NumberFileLines=number_file_lines,
+                Commit=LAST_COMMIT,
+                FileURL=file_url,
+                DiagnosticID=DIAGNOSTIC_ID,
+                AnalyzerNuGet=NUGET_FULL_NAME,
+                Severity=severity,
+                RequiredLinesStart=first_required_line,
+                RequiredLinesEnd=last_required_line,
+                DiagnosticOccurances=[DiagnosticOccurance.from_json(diag_occurance)
+                                      for diag_occurance in value],
+                ParsedDiff=ParsedDiff(diff_action, action),
+                FileContextStart=starting_line,
                 # Also want to include ending_line
-                unified_data["FileContext"] = file_list[starting_line - 1:ending_line]
+                FileContext=source_file.lines(starting_line - 1, ending_line),
+                TokenizedFileContext=None,
+                TokenizedFileContextStart=None))
+            num_diff_datapoint += 1
 
-            unified_data["FileContextStart"] = starting_line
+        unified_patched_file = UnifiedPatchedFile(
+            unified_data_filename, unified_data_filename_hash, source_path,
+            hash_content(source_file.content), source_stat, unified_datapoints)
+        profile.add_stage_time("build_datapoints", time.perf_counter() - build_start_time)
 
-            with open(f"{unified_dataset_dir}/{unified_data_filename_hash}-{num_diff_datapoint}.json", 'w', encoding='utf-8') as f:
-                json.dump(unified_data, f, ensure_ascii=False, indent=2)
-            print("Created unified_data_filename: ", unified_data_filename)
-            unified_data_files.append(unified_data_filename_hash)
-            num_diff_datapoint += 1
+        yield unified_patched_file
+
+
+def unify_diff_file_bounded(diff_entry, analysis_entry, profile, rss_monitor):
+    """
+    Bounded-memory mode: writes the UnifiedPatchedFiles of the diff to a spill file as soon as
+    they are created. Returns (spill path, num patched files, num datapoints), with spill path
+    None if the diff was aborted at the RSS ceiling.
+    """
+
+    with profile.stage("index_analysis_file"):
+        diagnostic_index, _, _ = load_or_index_analysis_file(
+            f"{analysis_dir}/{analysis_entry.Filename}", analysis_entry.Repo, analysis_index_cache_dir,
+            diagnostic_ids={diff_entry.DiagnosticID},
+            fixable_diagnostic_ids=get_fixable_diagnostic_ids(analysis_entry.AnalyzerNuGet, worker_fixable_diagnostics))
+
+    num_patched_files = 0
+    num_datapoints = 0
+    spill_path = f"{worker_spill_dir}/{hash_filename(diff_entry.Filename)}.pickle"
+    with open(spill_path, 'wb') as f:
+        for unified_patched_file in iter_unified_patched_files(diff_entry, diagnostic_index, profile):
+            pickle.dump(unified_patched_file, f, protocol=pickle.HIGHEST_PROTOCOL)
+            num_patched_files += 1
+            num_datapoints += len(unified_patched_file.Datapoints)
+
+            # Sampled after every patched file that was read, also those without datapoints
+            if rss_monitor.is_above_ceiling():
+                print(f"WARNING: RSS above {max_worker_rss_mb} MB, dropping source file caches. "
+                      f"diff_file: {diff_entry.Filename}")
+                source_file_cache.clear()
+                git_source_file_cache.clear()
+                gc.collect()
+
+                if rss_monitor.is_above_ceiling():
+                    print(f"WARNING: RSS still above {max_worker_rss_mb} MB, aborting diff_file: {diff_entry.Filename}")
+                    profile.count("DiffFilesAbortedAtRssCeiling")
+                    break
+        else:
+            return spill_path, num_patched_files, num_datapoints
+
+    os.remove(spill_path)
+    return None, num_patched_files, num_datapoints
+
+
+def iter_spilled_patched_files(spill_path):
+    """Reads the UnifiedPatchedFiles back one at a time, and removes the spill file afterwards"""
+    with open(spill_path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+    os.remove(spill_path)
+
+
+def unify_analysis_group(diff_file_group):
+    """
+    Worker: indexes one analysis file and unifies all diffs that share it. Returns the
+    UnifiedPatchedFiles of each diff, or in bounded-memory mode the path of its spill file.
+    """
+
+    analysis_entry, diff_entries = diff_file_group
+    profile = UnificationProfile()
+
+    start_time = time.perf_counter()
+    with profile.stage("index_analysis_file"):
+        # In bounded-memory mode, only the duplicate counts are loaded here
+        diagnostic_index, duplicate_counts, num_unfixable_diagnostics = load_or_index_analysis_file(
+            f"{analysis_dir}/{analysis_entry.Filename}", analysis_entry.Repo, analysis_index_cache_dir,
+            diagnostic_ids=set() if bounded_memory else None,
+            fixable_diagnostic_ids=get_fixable_diagnostic_ids(analysis_entry.AnalyzerNuGet, worker_fixable_diagnostics))
+    profile.add_analysis_file(analysis_entry, time.perf_counter() - start_time,
+                              NumDiffFiles=len(diff_entries), NumIndexedKeys=len(diagnostic_index))
+
+    unified_diff_files = []
+    for diff_entry in diff_entries:
+        start_time = time.perf_counter()
+        rss_monitor = RssMonitor(max_worker_rss_mb * 2**20 if bounded_memory and max_worker_rss_mb else None)
+        with profiling(profile_mode, f"{profile_dir}/{hash_filename(diff_entry.Filename)}.prof") as details:
+            if bounded_memory:
+                spill_path, num_patched_files, num_datapoints = unify_diff_file_bounded(
+                    diff_entry, analysis_entry, profile, rss_monitor)
+                unified_diff_files.append((diff_entry, spill_path))
+            else:
+                unified_patched_files = list(iter_unified_patched_files(diff_entry, diagnostic_index, profile))
+                num_patched_files = len(unified_patched_files)
+                num_datapoints = sum([len(unified_patched_file.Datapoints)
+                                      for unified_patched_file in unified_patched_files])
+                unified_diff_files.append((diff_entry, unified_patched_files))
+        rss_monitor.sample()
+        profile.add_diff_file(diff_entry, time.perf_counter() - start_time,
+                              NumPatchedFiles=num_patched_files, NumDatapoints=num_datapoints,
+                              PeakRssBytes=rss_monitor.peak_rss_bytes, **details)
+
+    return duplicate_counts, num_unfixable_diagnostics, unified_diff_files, profile
+
+
+def get_unification_version(sharded_output, fixable_diagnostic_ids=None):
+    """Everything besides the inputs that changes the unified outputs"""
+    unification_version = (f"{UNIFICATION_VERSION}-{'commit' if read_sources_at_commit else 'worktree'}-"
+                           f"{'shards' if sharded_output else 'files'}{'-dedupe' if drop_duplicate_datapoints else ''}")
+    if fixable_diagnostic_ids is not None:
+        unification_version += f"-fixable-{hash_fixable_diagnostic_ids(fixable_diagnostic_ids)[:16]}"
+    return unification_version
+
+
+def get_aborted_unification_version(unification_version):
+    """Recorded for diffs aborted at the RSS ceiling, which would almost always be aborted again"""
+    return f"{unification_version}-aborted-at-{max_worker_rss_mb}mb"
+
+
+def get_existing_datapoint_ids(sharded_output):
+    if sharded_output:
+        return ShardedDatapointReader(unified_dataset_dir).get_datapoint_ids()
+    return [f.name[:-len(".json")] for f in os.scandir(unified_dataset_dir)
+            if f.is_file() and f.name.endswith(".json")]
+
+
+def remove_existing_datapoints(sharded_output, datapoint_ids):
+    """Removes the datapoints in the given layout, returns the number of removed datapoints"""
+    if sharded_output:
+        return remove_datapoints(unified_dataset_dir, datapoint_ids)
+
+    num_removed = 0
+    for datapoint_id in datapoint_ids:
+        if os.path.isfile(f"{unified_dataset_dir}/{datapoint_id}.json"):
+            os.remove(f"{unified_dataset_dir}/{datapoint_id}.json")
+            num_removed += 1
+    return num_removed
+
+
+def find_diff_files_to_unify(catalog, manifest, sharded_output, fixable_diagnostics=None):
+    """
+    Compares the current inputs with the manifest. Returns the groups of diffs that have to be
+    unified (again), the UnifiedDiffEntry of each of these diffs, and the previously unified diffs
+    whose outputs are stale, i.e. that changed or are no longer in the raw dataset.
+    """
+
+    diff_file_groups = catalog.group_diff_files_by_analysis_file()
+    current_unified_diffs = {}
+    for analysis_entry, diff_entries in diff_file_groups:
+        unification_version = get_unification_version(
+            sharded_output, get_fixable_diagnostic_ids(analysis_entry.AnalyzerNuGet, fixable_diagnostics))
+        analysis_hash = manifest.get_file_hash(f"{analysis_dir}/{analysis_entry.Filename}")
+        for diff_entry in diff_entries:
+            current_unified_diffs[diff_entry.Filename] = UnifiedDiffEntry(
+                diff_entry.Filename, manifest.get_file_hash(f"{diff_dir}/{diff_entry.Filename}"),
+                analysis_entry.Filename, analysis_hash, unification_version)
+
+    unified_diffs = {diff_file: unified_diff for diff_file, unified_diff in current_unified_diffs.items()
+                     if not manifest.is_up_to_date(unified_diff, check_sources=not read_sources_at_commit) and
+                     not (bounded_memory and manifest.is_up_to_date(unified_diff._replace(
+                         UnificationVersion=get_aborted_unification_version(unified_diff.UnificationVersion))))}
+    stale_diff_files = set([diff_file for diff_file in manifest.get_diff_files()
+                            if diff_file in unified_diffs or diff_file not in current_unified_diffs])
+
+    # Duplicates of removed datapoints have to be written after all, so their diffs are unified again
+    referencing_diff_files = manifest.get_diffs_referencing(
+        [datapoint_id for diff_file in stale_diff_files for datapoint_id in manifest.get_datapoint_ids(diff_file)])
+    while not referencing_diff_files.issubset(stale_diff_files):
+        new_stale_diff_files = referencing_diff_files - stale_diff_files
+        stale_diff_files |= new_stale_diff_files
+        for diff_file in new_stale_diff_files:
+            if diff_file in current_unified_diffs:
+                unified_diffs[diff_file] = current_unified_diffs[diff_file]
+        referencing_diff_files = manifest.get_diffs_referencing(
+            [datapoint_id for diff_file in stale_diff_files for datapoint_id in manifest.get_datapoint_ids(diff_file)])
+
+    diff_file_groups_to_do = []
+    for analysis_entry, diff_entries in diff_file_groups:
+        diff_entries_to_do = [diff_entry for diff_entry in diff_entries if diff_entry.Filename in unified_diffs]
+        if diff_entries_to_do:
+            diff_file_groups_to_do.append((analysis_entry, diff_entries_to_do))
+
+    return diff_file_groups_to_do, unified_diffs, sorted(stale_diff_files)
+
+
+def main(num_workers, sharded_output=True):
+    """
+    With `sharded_output`, datapoints are appended to JSONL shards (see sharding_datapoints.py),
+    otherwise each datapoint is written to its own pretty-printed JSON file.
+
+    Only diffs whose diff, analysis file or source files changed since the last run are unified
+    again (see tracking_unified_outputs.py). Their previous datapoints are removed, as well as the
+    datapoints of diffs that are no longer in the raw dataset.
+    """
+
+    start_time = time.monotonic()
+
+    if profile_mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile_mode: {profile_mode}")
+    if profile_mode == "cprofile":
+        os.makedirs(profile_dir, exist_ok=True)
+    profile = UnificationProfile()
+
+    with profile.stage("load_catalog"):
+        catalog = load_or_build_catalog(
+            diff_dir, analysis_dir, "github_repos.csv", catalog_path)
+    repo_urls = catalog.get_repo_urls()
+    fixable_diagnostics = None
+    if os.path.isfile(fixable_diagnostics_path):
+        fixable_diagnostics = load_fixable_diagnostics(fixable_diagnostics_path)
+    manifest = UnificationManifest(f"{unified_dataset_dir}/{MANIFEST_FILENAME}")
+
+    with profile.stage("hash_inputs"):
+        diff_file_groups, unified_diffs, stale_diff_files = find_diff_files_to_unify(
+            catalog, manifest, sharded_output, fixable_diagnostics)
+
+    # Removed from the manifest first, so that an interrupted run never leaves
+    # missing datapoints in the manifest
+    stale_datapoint_ids = set()
+    for diff_file in stale_diff_files:
+        stale_datapoint_ids.update(manifest.get_datapoint_ids(diff_file))
+        manifest.remove_diff(diff_file)
+    manifest.commit()
+
+    with profile.stage("remove_stale_datapoints"):
+        # Also datapoints that were never recorded, e.g. of an interrupted run
+        recorded_datapoint_ids = set(manifest.get_datapoint_ids())
+        unrecorded_datapoint_ids = [datapoint_id for datapoint_id in get_existing_datapoint_ids(sharded_output)
+                                    if datapoint_id not in recorded_datapoint_ids]
+        if unrecorded_datapoint_ids and not recorded_datapoint_ids:
+            print(f"WARNING: None of the {len(unrecorded_datapoint_ids)} datapoints in {unified_dataset_dir} are "
+                  f"in the manifest (e.g. unified before the manifest existed), removing them and unifying all diffs "
+                  f"again")
+        stale_datapoint_ids.update(unrecorded_datapoint_ids)
+        num_stale_datapoints = remove_existing_datapoints(sharded_output, stale_datapoint_ids)
+
+        # All datapoints of the other layout are stale, since the unification version changes with the layout.
+        # Left behind, shards would even be preferred over the JSON files by the tokenization.
+        num_stale_datapoints += remove_existing_datapoints(
+            not sharded_output, get_existing_datapoint_ids(not sharded_output))
+
+    unified_data_files = manifest.get_output_hashes()
+    kept_datapoint_ids = manifest.get_kept_datapoint_ids()
+    if sharded_output:
+        sharded_writer = ShardedDatapointWriter(unified_dataset_dir)
+
+    num_diff_files_to_do = sum([len(diff_entries) for _, diff_entries in diff_file_groups])
+    print(f"Num diff files: {len(catalog.diff_files)}")
+    print(f"Num diff files up to date: {len(manifest.get_diff_files())}")
+    print(f"Num diff files to unify: {num_diff_files_to_do}")
+    print(f"Num analysis files to index: {len(diff_file_groups)}")
+    if bounded_memory and max_worker_rss_mb and get_rss_bytes() is None:
+        print(f"WARNING: The RSS cannot be measured on this platform, the RSS ceiling of {max_worker_rss_mb} MB "
+              f"is not enforced")
+
+    # Spill files of an interrupted run are of no use
+    for f in os.scandir(unified_dataset_dir):
+        if f.is_dir() and f.name.startswith("spill-"):
+            shutil.rmtree(f.path)
+    spill_dir = tempfile.mkdtemp(prefix="spill-", dir=unified_dataset_dir) if bounded_memory else None
+    if num_workers > 1 and diff_file_groups:
+        pool = Pool(num_workers, initializer=init_worker,
+                    initargs=(repo_urls, unified_data_files, spill_dir, fixable_diagnostics))
+        results = pool.imap(unify_analysis_group, diff_file_groups)
+    else:
+        pool = None
+        init_worker(repo_urls, unified_data_files, spill_dir, fixable_diagnostics)
+        results = map(unify_analysis_group, diff_file_groups)
+
+    # Only the main process writes, in the (sorted) order of the groups, so that
+    # output names and the unified_data_files dedupe stay deterministic.
+    num_diff_files_done = 0
+    num_datapoints = 0
+    num_csproj_duplicates = 0
+    num_shared_file_duplicates = 0
+    num_unfixable_diagnostics = 0
+    num_duplicate_datapoints = 0
+    num_duplicate_file_context_lines = 0
+    num_duplicate_bytes = 0
+    num_aborted_diff_files = 0
+    # With a single worker, waiting includes the unification itself
+    for duplicate_counts, group_num_unfixable_diagnostics, unified_diff_files, group_profile in \
+            profile.time_iterator("wait_for_workers", results):
+        profile.merge(group_profile)
+        write_start_time = time.perf_counter()
+        num_csproj_duplicates += duplicate_counts["CsprojDuplicates"]
+        num_shared_file_duplicates += duplicate_counts["SharedFileDuplicates"]
+        num_unfixable_diagnostics += group_num_unfixable_diagnostics
+
+        for diff_entry, unified_patched_files in unified_diff_files:
+            if bounded_memory:
+                if unified_patched_files is None:
+                    num_aborted_diff_files += 1
+                    unified_diff = unified_diffs[diff_entry.Filename]
+                    manifest.add_diff(unified_diff._replace(
+                        UnificationVersion=get_aborted_unification_version(unified_diff.UnificationVersion)), [], [])
+                    continue
+                unified_patched_files = iter_spilled_patched_files(unified_patched_files)
+            num_diff_files_done += 1
+            unified_outputs = []
+            unified_sources = []
+            unified_datapoint_entries = []
+            for unified_patched_file in unified_patched_files:
+                unified_sources.append(UnifiedSourceEntry(
+                    diff_entry.Filename, unified_patched_file.SourcePath, unified_patched_file.SourceHash))
+                if unified_patched_file.SourceStat is not None:
+                    manifest.set_file_hash(unified_patched_file.SourcePath, *unified_patched_file.SourceStat,
+                                           unified_patched_file.SourceHash)
+                if not unified_patched_file.Datapoints:
+                    continue
+
+                if unified_patched_file.FilenameHash in unified_data_files:
+                    print(
+                        f"unified_data_filename_hash already exists! file: {unified_patched_file.Filename}")
+                    continue
+
+                for num_diff_datapoint, unified_data in enumerate(unified_patched_file.Datapoints):
+                    datapoint_id = f"{unified_patched_file.FilenameHash}-{num_diff_datapoint}"
+
+                    dedupe_key = get_dedupe_key(unified_data, unified_patched_file.SourceHash)
+                    if drop_duplicate_datapoints and dedupe_key in kept_datapoint_ids:
+                        # Not written, so no tokenization etc. later on
+                        unified_datapoint_entries.append(UnifiedDatapointEntry(
+                            datapoint_id, diff_entry.Filename, dedupe_key, kept_datapoint_ids[dedupe_key]))
+                        num_duplicate_datapoints += 1
+                        num_duplicate_file_context_lines += len(unified_data.FileContext)
+                        num_duplicate_bytes += len(json.dumps(unified_data.to_json(), ensure_ascii=False).encode('utf-8'))
+                        continue
+                    kept_datapoint_ids.setdefault(dedupe_key, datapoint_id)
+                    unified_datapoint_entries.append(UnifiedDatapointEntry(
+                        datapoint_id, diff_entry.Filename, dedupe_key, None))
+
+                    if sharded_output:
+                        sharded_writer.write(datapoint_id, unified_data.to_json())
+                    else:
+                        with open(f"{unified_dataset_dir}/{datapoint_id}.json", 'w', encoding='utf-8') as f:
+                            json.dump(unified_data.to_json(), f, ensure_ascii=False, indent=2)
+                    print("Created unified_data_filename: ", unified_patched_file.Filename)
+                    num_datapoints += 1
+                unified_data_files.add(unified_patched_file.FilenameHash)
+
+                unified_outputs.append(UnifiedOutputEntry(
+                    unified_patched_file.FilenameHash, diff_entry.Filename, unified_patched_file.Filename,
+                    unified_patched_file.SourcePath, unified_patched_file.SourceHash))
+
+            manifest.add_diff(unified_diffs[diff_entry.Filename], unified_outputs, unified_datapoint_entries,
+                              unified_sources)
+
+        # Recorded after every group, so that an interrupted run only has to redo the groups it didn't finish
+        if sharded_output:
+            sharded_writer.flush()
+        manifest.commit()
+        profile.add_stage_time("write_datapoints", time.perf_counter() - write_start_time)
+
+    if pool:
+        pool.close()
+        pool.join()
+    with profile.stage("write_datapoints"):
+        if sharded_output:
+            sharded_writer.close()
+        manifest.commit()
+        manifest.close()
+    if spill_dir is not None:
+        shutil.rmtree(spill_dir)
+
+    elapsed_seconds = max(time.monotonic() - start_time, 1e-9)
+    profile.count("Datapoints", num_datapoints)
+    profile.count("DuplicateDatapoints", num_duplicate_datapoints)
+    profile.count("StaleDatapoints", num_stale_datapoints)
+    profile.write_report(report_path, elapsed_seconds, num_workers)
+    print("########")
+    profile.print_summary()
+    print(f"Report: {report_path}")
+    print(f"Num workers: {num_workers}")
+    print(f"Num diff files: {num_diff_files_done}")
+    print(f"Num datapoints: {num_datapoints}")
+    print(f"Num stale datapoints removed: {num_stale_datapoints}")
+    if bounded_memory:
+        print(f"Num diff files aborted at the RSS ceiling of {max_worker_rss_mb} MB: {num_aborted_diff_files}")
+    print(f"Num duplicate datapoints dropped: {num_duplicate_datapoints} "
+          f"({100 * num_duplicate_datapoints / max(num_datapoints + num_duplicate_datapoints, 1):.1f}%)")
+    print(f"    FileContext lines not written & tokenized: {num_duplicate_file_context_lines}")
+    print(f"    MB of JSON not written: {num_duplicate_bytes / 2**20:.2f}")
+    print(f"Num duplicate diagnostics from repeated .csproj analysis: {num_csproj_duplicates}")
+    print(f"Num duplicate diagnostics from files shared across projects: {num_shared_file_duplicates}")
+    if fixable_diagnostics is not None:
+        print(f"Num diagnostics without CodeFixProvider, not indexed: {num_unfixable_diagnostics}")
+    print(f"Elapsed seconds: {elapsed_seconds:.1f}")
+    print(f"Diffs/s: {num_diff_files_done / elapsed_seconds:.2f}")
+    print(f"Datapoints/s: {num_datapoints / elapsed_seconds:.2f}")
+
+
+if __name__ == '__main__':
+
+    num_workers = 6
+    sharded_output = True  # False: One JSON file per datapoint, for debugging
+
+    main(num_workers, sharded_output)
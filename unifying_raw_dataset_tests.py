@@ -0,0 +1,385 @@
+import unittest
+import io
+import os
+import json
+import shutil
+import random
+import tempfile
+import contextlib
+import unifying_raw_dataset
+from parsing_diffs import DiffActionArrays
+from sharding_datapoints import is_sharded_dataset
+from indexing_analysis_files import get_analyzed_file_prefix
+from profiling_unification import get_rss_bytes
+from unifying_raw_dataset import match_diff_actions_to_diagnostics, compute_required_lines, get_existing_datapoint_ids
+
+
+def match_diff_batches_to_diagnostics_linear(diagnostics, all_added_lines, all_removed_lines, all_replaced_lines):
+    """
+        Previous implementation of match_diff_actions_to_diagnostics, on the diff batches of
+        parse_hunk, which scans all diff batches for every diagnostic occurance, i.e. O(D x B)
+        per file. Kept as the reference of the regression tests.
+    """
+
+    add_batch_is_above_diagnostic_position = {}
+    diff_batch_to_diagnostics = {}
+    for diagnostic_occurance in diagnostics:
+
+        diff_key = None
+        for count, value in enumerate(all_replaced_lines):
+            if diagnostic_occurance["Line"] in value["SourceLocations"]:
+                diff_key = f"REPLACE-{count}"
+                break
+
+        if not diff_key:
+            for count, value in enumerate(all_removed_lines):
+                if (diagnostic_occurance["Line"] >= value["SourceLocationStart"] and
+                        diagnostic_occurance["Line"] <= value["SourceLocationEnd"]):
+                    diff_key = f"REMOVE-{count}"
+                    break
+
+        # Do added_lines last, since intuitively, finding deleted lines is easier; diagnostic
+        # will probably be inside one of the deleted/replaced lines?
+        # Adding lines on the other hand is evenly likely to happen before
+        # or after the diagnostic. Here we are prioritising ADD batches that happen above
+        # the diagnostics, unless these already have diagnostics above them.
+
+        if not diff_key:
+            for count, value in enumerate(all_added_lines):
+                # If added lines are above diagnostic
+                if (diagnostic_occurance["Line"] - 1) == value["PreviousSourceLocation"]:
+                    diff_key = f"ADD-{count}"
+
+                    # If a ADD diff batch already has diagnostics above it, then it more
+                    # likely to find the correct diff batch underneath the current diagnostic.
+                    if diff_key in add_batch_is_above_diagnostic_position:
+                        if not add_batch_is_above_diagnostic_position[diff_key]:
+                            diff_key = None
+                            continue
+                    else:
+                        add_batch_is_above_diagnostic_position[diff_key] = True
+
+                    break
+
+        if not diff_key:
+            for count, value in enumerate(all_added_lines):
+                # If added lines are beneath diagnostic
+                if diagnostic_occurance["Line"] == value["PreviousSourceLocation"]:
+                    diff_key = f"ADD-{count}"
+                    add_batch_is_above_diagnostic_position[diff_key] = False
+                    break
+
+        # Diagnostic occurance leads to no obvious diff batch
+        if not diff_key:
+            continue
+
+        if diff_key not in diff_batch_to_diagnostics:
+            diff_batch_to_diagnostics[diff_key] = []
+        diff_batch_to_diagnostics[diff_key].append(
+            diagnostic_occurance)
+
+    return diff_batch_to_diagnostics
+
+
+def random_diff_batches(rng, num_source_lines):
+    """Non-overlapping REPLACE/REMOVE/ADD batches, like parse_hunk produces them for one file"""
+
+    all_replaced_lines = []
+    all_added_lines = []
+    all_removed_lines = []
+
+    line = 1
+    while line <= num_source_lines:
+        action = rng.random()
+        length = rng.randint(1, 4)
+        if action < 0.1:
+            all_replaced_lines.append({
+                "SourceLocations": list(range(line, line + length)),
+                "TargetLines": ["x\n"]
+            })
+            line += length
+        elif action < 0.2:
+            all_removed_lines.append({
+                "SourceLocationStart": line,
+                "SourceLocationEnd": line + length - 1
+            })
+            line += length
+        elif action < 0.35:
+            # Occasionally several ADD batches after the same source line
+            for _ in range(rng.choice([1, 1, 1, 2])):
+                all_added_lines.append({
+                    "PreviousSourceLocation": line,
+                    "TargetStartLocation": line + 1,
+                    "TargetLines": ["x\n"] * length
+                })
+        line += 1
+
+    return all_replaced_lines, all_added_lines, all_removed_lines
+
+
+def match_with_diff_actions(diagnostics, all_added_lines, all_removed_lines, all_replaced_lines):
+    """match_diff_actions_to_diagnostics in the output format of match_diff_batches_to_diagnostics_linear"""
+
+    diff_actions = DiffActionArrays.from_batches(all_replaced_lines, all_added_lines, all_removed_lines)
+    matched_actions = match_diff_actions_to_diagnostics(
+        [diagnostic["Line"] for diagnostic in diagnostics], diff_actions)
+
+    diff_batch_to_diagnostics = {}
+    for diagnostic, action_num in zip(diagnostics, matched_actions.tolist()):
+        if action_num != -1:
+            diff_key, _ = diff_actions.get_action(action_num)
+            diff_batch_to_diagnostics.setdefault(diff_key, []).append(diagnostic)
+    return diff_batch_to_diagnostics
+
+
+class TestMatchDiffBatchesToDiagnostics(unittest.TestCase):
+
+    def test_golden(self):
+        all_replaced_lines = [{"SourceLocations": [10, 11], "TargetLines": ["a\n"]}]
+        all_removed_lines = [{"SourceLocationStart": 20, "SourceLocationEnd": 22}]
+        all_added_lines = [
+            {"PreviousSourceLocation": 30, "TargetStartLocation": 31, "TargetLines": ["b\n"]},
+            {"PreviousSourceLocation": 40, "TargetStartLocation": 41, "TargetLines": ["c\n"]}
+        ]
+        diagnostics = [
+            {"Message": "m", "Line": 11, "Character": 1},
+            {"Message": "m", "Line": 10, "Character": 5},
+            {"Message": "m", "Line": 21, "Character": 1},
+            {"Message": "m", "Line": 31, "Character": 1},  # ADD-0 is above it
+            {"Message": "m", "Line": 30, "Character": 1},  # ADD-0 is beneath it
+            {"Message": "m", "Line": 40, "Character": 1},  # ADD-1 is beneath it
+            {"Message": "m", "Line": 41, "Character": 1},  # ADD-1 is above it, but already has a diagnostic above itself
+            {"Message": "m", "Line": 50, "Character": 1}
+        ]
+
+        expected = {
+            "REPLACE-0": [diagnostics[0], diagnostics[1]],
+            "REMOVE-0": [diagnostics[2]],
+            "ADD-0": [diagnostics[3], diagnostics[4]],
+            "ADD-1": [diagnostics[5]]
+        }
+        self.assertEqual(match_diff_batches_to_diagnostics_linear(
+            diagnostics, all_added_lines, all_removed_lines, all_replaced_lines), expected)
+        self.assertEqual(match_with_diff_actions(
+            diagnostics, all_added_lines, all_removed_lines, all_replaced_lines), expected)
+
+    def test_same_as_linear(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            num_source_lines = rng.randint(1, 200)
+            all_replaced_lines, all_added_lines, all_removed_lines = random_diff_batches(
+                rng, num_source_lines)
+            diagnostics = [{"Message": "m", "Line": rng.randint(1, num_source_lines + 2), "Character": i}
+                           for i in range(rng.randint(0, 100))]
+
+            expected = match_diff_batches_to_diagnostics_linear(
+                diagnostics, all_added_lines, all_removed_lines, all_replaced_lines)
+            self.assertEqual(match_with_diff_actions(
+                diagnostics, all_added_lines, all_removed_lines, all_replaced_lines), expected)
+
+    def test_compute_required_lines(self):
+        all_replaced_lines = [{"SourceLocations": [10, 11], "TargetLines": ["a\n"]}]
+        all_added_lines = [{"PreviousSourceLocation": 30, "TargetStartLocation": 31, "TargetLines": ["b\n"]}]
+        all_removed_lines = [{"SourceLocationStart": 20, "SourceLocationEnd": 22}]
+        diff_actions = DiffActionArrays.from_batches(all_replaced_lines, all_added_lines, all_removed_lines)
+
+        diagnostic_lines = [11, 21, 31, 30]
+        matched_actions = match_diff_actions_to_diagnostics(diagnostic_lines, diff_actions)
+        self.assertEqual(matched_actions.tolist(), [0, 2, 1, 1])
+
+        first_diagnostic_lines, first_required_lines, last_required_lines = compute_required_lines(
+            diagnostic_lines, matched_actions, diff_actions)
+        self.assertEqual(first_diagnostic_lines.tolist(), [11, 30, 21])
+        # The deleted lines are required as well
+        self.assertEqual(first_required_lines.tolist(), [10, 30, 20])
+        self.assertEqual(last_required_lines.tolist(), [11, 31, 22])
+
+
+RAW_DATASET_NAME = "demo__Demo.sln__abc123__Some.Analyzers.1.0.0"
+
+
+def write_raw_dataset(sources, raw_dataset_names=(RAW_DATASET_NAME,)):
+    """
+    Raw dataset of the repo "demo" in the current directory: the diff of SA1101 replaces the second line
+    of every source file ({path: content bytes}), and the analysis file has a diagnostic at that line.
+    Both are written for each of the raw_dataset_names.
+    """
+
+    for dataset_dir in ("raw_dataset/diffs", "raw_dataset/analysis_files", "unified_dataset"):
+        os.makedirs(dataset_dir, exist_ok=True)
+    with open("github_repos.csv", 'w') as f:
+        f.write("RepoName,RepoURL\ndemo,https://github.com/example/demo.git\n")
+
+    diff = ""
+    diagnostics = ""
+    for path, content in sources.items():
+        os.makedirs(os.path.dirname(f"submodule_repos_to_analyze/demo/{path}"), exist_ok=True)
+        with open(f"submodule_repos_to_analyze/demo/{path}", 'wb') as f:
+            f.write(content)
+        diff += (f"diff --git a/{path} b/{path}\n--- a/{path}\n+++ b/{path}\n"
+                 f"@@ -1,3 +1,3 @@\n class A\n-    int i;\n+    int j;\n }}\n")
+        diagnostics += (f'<Diagnostic Id="SA1101"><Severity>Warning</Severity><Message>m</Message>'
+                        f'<FilePath>{get_analyzed_file_prefix("demo")}{path.replace("/", chr(92))}</FilePath>'
+                        f'<Location Line="2" Character="5" /></Diagnostic>\n')
+
+    for raw_dataset_name in raw_dataset_names:
+        with open(f"raw_dataset/diffs/{raw_dataset_name}__SA1101.diff", 'w') as f:
+            f.write(diff)
+        with open(f"raw_dataset/analysis_files/{raw_dataset_name}.xml", 'w') as f:
+            f.write(f'<Roslynator><CodeAnalysis><Projects><Project Name="Demo" FilePath="Demo.csproj">'
+                    f'<Diagnostics>\n{diagnostics}</Diagnostics></Project></Projects></CodeAnalysis></Roslynator>\n')
+
+
+class TestUnifyRawDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.config = (unifying_raw_dataset.bounded_memory, unifying_raw_dataset.max_worker_rss_mb)
+
+    def tearDown(self):
+        unifying_raw_dataset.bounded_memory, unifying_raw_dataset.max_worker_rss_mb = self.config
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def unify(self, sharded_output=True, num_workers=1):
+        """Returns the output of unifying_raw_dataset.main"""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            unifying_raw_dataset.main(num_workers, sharded_output)
+        return output.getvalue()
+
+    def test_unify_changed_sources(self):
+        source = b"class A\n    int i;\n}\n"
+        write_raw_dataset({"src/A.cs": source, "src/B.cs": b"class A\n    int i; \xff\n}\n"})
+        self.unify()
+        self.assertEqual(len(get_existing_datapoint_ids(True)), 1)
+        self.assertIn("Num diff files to unify: 0", self.unify())
+
+        # A file that could not be read is unified once it changes
+        with open("submodule_repos_to_analyze/demo/src/B.cs", 'wb') as f:
+            f.write(source)
+        self.assertIn("Num diff files to unify: 1", self.unify())
+        self.assertEqual(len(get_existing_datapoint_ids(True)), 2)
+
+    def test_switch_layout(self):
+        write_raw_dataset({"src/A.cs": b"class A\n    int i;\n}\n"})
+        self.unify(sharded_output=True)
+        self.assertTrue(is_sharded_dataset("unified_dataset"))
+
+        # Datapoints of the other layout are removed
+        self.unify(sharded_output=False)
+        self.assertFalse(is_sharded_dataset("unified_dataset"))
+        self.assertEqual(len(get_existing_datapoint_ids(False)), 1)
+        self.unify(sharded_output=True)
+        self.assertEqual(get_existing_datapoint_ids(False), [])
+        self.assertEqual(len(get_existing_datapoint_ids(True)), 1)
+
+    def read_datapoints(self):
+        datapoints = {}
+        for datapoint_id in get_existing_datapoint_ids(False):
+            with open(f"unified_dataset/{datapoint_id}.json", 'r', encoding='utf-8') as f:
+                datapoints[datapoint_id] = json.load(f)
+        return datapoints
+
+    def test_process_pool(self):
+        # One group per analysis file, each unified by a worker
+        write_raw_dataset({"src/A.cs": b"class A\n    int i;\n}\n", "src/B.cs": b"class B\n    int i;\n}\n"},
+                          [f"demo__Demo.sln__abc123__Analyzers{i}.1.0.0" for i in range(4)])
+        self.unify(sharded_output=False)
+        datapoints = self.read_datapoints()
+        # The same fixes in every group are only kept once, in the first group
+        self.assertEqual(len(datapoints), 2)
+        self.assertEqual(set([datapoint["AnalyzerNuGet"] for datapoint in datapoints.values()]),
+                         {"Analyzers0.1.0.0"})
+
+        shutil.rmtree("unified_dataset")
+        os.makedirs("unified_dataset")
+        self.assertIn("Num diff files to unify: 4", self.unify(sharded_output=False, num_workers=3))
+        self.assertEqual(self.read_datapoints(), datapoints)
+        self.assertIn("Num diff files to unify: 0", self.unify(sharded_output=False, num_workers=3))
+
+    def test_resume_interrupted_run(self):
+        write_raw_dataset({"src/A.cs": b"class A\n    int i;\n}\n"},
+                          ["demo__Demo.sln__abc123__Analyzers0.1.0.0", "demo__Other.sln__abc123__Analyzers0.1.0.0"])
+        unify_analysis_group = unifying_raw_dataset.unify_analysis_group
+        unified_groups = []
+
+        def unify_first_group(diff_file_group):
+            if unified_groups:
+                raise KeyboardInterrupt()
+            unified_groups.append(diff_file_group)
+            return unify_analysis_group(diff_file_group)
+
+        unifying_raw_dataset.unify_analysis_group = unify_first_group
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                self.unify()
+        finally:
+            unifying_raw_dataset.unify_analysis_group = unify_analysis_group
+        datapoint_ids = get_existing_datapoint_ids(True)
+        self.assertEqual(len(datapoint_ids), 1)
+
+        # Only the group that did not finish is unified again, the datapoints of the other are kept
+        output = self.unify()
+        self.assertIn("Num diff files to unify: 1", output)
+        self.assertNotIn("WARNING", output)
+        self.assertEqual(get_existing_datapoint_ids(True)[:1], datapoint_ids)
+
+    def test_bounded_memory(self):
+        write_raw_dataset({"src/A.cs": b"class A\n    int i;\n}\n", "src/B.cs": b"class A\n    int i; \xff\n}\n",
+                           "src/C.cs": b"class A\n    int i;\n}\n"})
+        self.unify(sharded_output=False)
+        datapoints = self.read_datapoints()
+        self.assertEqual(len(datapoints), 2)
+
+        # Same datapoints from the spill files
+        shutil.rmtree("unified_dataset")
+        os.makedirs("unified_dataset")
+        unifying_raw_dataset.bounded_memory = True
+        unifying_raw_dataset.max_worker_rss_mb = None
+        self.unify(sharded_output=False)
+        self.assertEqual(self.read_datapoints(), datapoints)
+        self.assertEqual([f.name for f in os.scandir("unified_dataset") if f.is_dir()], [])
+
+    @unittest.skipIf(get_rss_bytes() is None, "RSS is unknown on this platform")
+    def test_abort_at_rss_ceiling(self):
+        # Also checked after patched files without datapoints
+        write_raw_dataset({"src/A.cs": b"class A\n    int i; \xff\n}\n"})
+        unifying_raw_dataset.bounded_memory = True
+        unifying_raw_dataset.max_worker_rss_mb = 1
+        self.assertIn("Num diff files aborted at the RSS ceiling of 1 MB: 1", self.unify())
+        self.assertEqual([f.name for f in os.scandir("unified_dataset") if f.is_dir()], [])
+
+        # Not tried again with the same ceiling
+        self.assertIn("Num diff files to unify: 0", self.unify())
+        unifying_raw_dataset.max_worker_rss_mb = None
+        output = self.unify()
+        self.assertIn("Num diff files to unify: 1", output)
+        self.assertNotIn("aborting", output)
+
+    def test_warn_about_unknown_rss(self):
+        write_raw_dataset({"src/A.cs": b"class A\n    int i;\n}\n"})
+        unifying_raw_dataset.bounded_memory = True
+        get_rss_bytes = unifying_raw_dataset.get_rss_bytes
+        unifying_raw_dataset.get_rss_bytes = lambda: None
+        try:
+            output = self.unify()
+        finally:
+            unifying_raw_dataset.get_rss_bytes = get_rss_bytes
+        self.assertIn(f"WARNING: The RSS cannot be measured on this platform, the RSS ceiling of "
+                      f"{unifying_raw_dataset.max_worker_rss_mb} MB is not enforced", output)
+        if get_rss_bytes() is not None:
+            self.assertNotIn("WARNING", self.unify())
+
+    def test_warn_about_unrecorded_dataset(self):
+        write_raw_dataset({"src/A.cs": b"class A\n    int i;\n}\n"})
+        self.assertNotIn("WARNING", self.unify())
+        os.remove(f"unified_dataset/{unifying_raw_dataset.MANIFEST_FILENAME}")
+        self.assertIn("WARNING: None of the 1 datapoints", self.unify())
+        self.assertEqual(len(get_existing_datapoint_ids(True)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
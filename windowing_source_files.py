@@ -0,0 +1,151 @@
+"""
+This file lexes only the part of a source file a datapoint needs, the required lines and the
+context tokens around them, instead of the whole file. The tokens are exactly the ones of
+lexing the whole file.
+
+The compiled lexer (see compiling_regex_lexers.py) can start lexing at any position where
+lexing the whole file is in the root state and between two tokens. Such line starts are found
+by a scan for the comments, strings and char literals above the required lines, with the regexes
+of the lexer's own states, since these are the only tokens of the C# lexers' root state that can
+contain their start characters (see regex_lexer.py). A line start in the root state is between
+two tokens, unless the previous line can be part of a multi-line method signature or "extern
+alias" token: only line starts after a line ending with punctuation are used.
+
+The window's first line number is the number of newlines before it, which is only the number of
+NEWLINE tokens if none of the tokens before it contains a newline, or is the word NEWLINE. Only
+line starts before anything that could be lexed to such tokens are used.
+
+The window is lexed again from further above (or further below) until it has enough context tokens.
+
+"""
+
+import re
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate
+from caching_lexed_tokens import get_line_offsets
+
+
+# Windows start this many lines above the required lines per context token (at first)
+LINES_PER_CONTEXT_TOKEN = 1 / 16
+
+# Derived from the rules of the C# lexers, test_lexer_rules_unchanged in windowing_source_files_tests.py fails
+# when those change.
+# Root tokens that contain all characters these start with: the states they enter, and char literals
+STATE_ENTRIES = {"//": "line-comments", "/*": "block-comments", '@"': "verbatim-strings", '"': "other-strings"}
+CONSTRUCT_START_PATTERN = r"""//|/\*|@"|"|'\\.'|'[^\\]'"""
+
+# Text that could be lexed to a token containing a newline (besides NEWLINE), or the word NEWLINE
+NEWLINE_HAZARD_REGEX = re.compile(r"NEWLINE|\\\n|extern\s*\n")
+# Quoted words in comments & strings (see LanguageLexer) can span lines
+QUOTED_WORD_HAZARD_REGEX = re.compile(r"\s'[^']*\n")
+
+# A method signature or "extern alias" token can't contain any of them
+LINE_END_PUNCTUATION = frozenset(";{}()=,<>+-*/&|!?:.%^~\"'")
+
+LexedWindow = namedtuple("LexedWindow", ["Tokens", "LineOffsets", "FirstLine"])
+
+
+def scan_constructs(lexer, text, end_pos):
+    """
+    ((start, end) of the comments, strings and char literals of the text that start before end_pos, the
+    position of the first one or other text that could be lexed to a token with a newline, len(text) if none)
+    """
+    construct_start_match = re.compile(CONSTRUCT_START_PATTERN, lexer.lexer.flags).search
+    hazard_match = NEWLINE_HAZARD_REGEX.search(text)
+    hazard_pos = len(text) if hazard_match is None else hazard_match.start()
+
+    spans = []
+    pos = 0
+    while True:
+        m = construct_start_match(text, pos)
+        if m is None or m.start() >= end_pos:
+            break
+
+        start, end = m.span()
+        state_name = STATE_ENTRIES.get(m.group())
+        if state_name is not None:
+            state_match = lexer.states[state_name].rules[0].Regex.match(text, end)
+            if state_match is None:
+                # Error tokens up to the end of the line, where the lexer resets to root with a newline
+                # token that is not NEWLINE
+                end = text.index('\n', end) + 1
+                hazard_pos = min(hazard_pos, start)
+            else:
+                end = state_match.end()
+
+        if '\n' in text[start:end] and (state_name is None or QUOTED_WORD_HAZARD_REGEX.search(text, start, end) or
+                                        (state_name == "other-strings" and text[end - 1] == '\n')):
+            hazard_pos = min(hazard_pos, start)
+        spans.append((start, end))
+        pos = end
+    return spans, hazard_pos
+
+
+def remove_last_token(tokens, line_offsets):
+    """As Pipeline.remove_last_token"""
+    if tokens[-1][1] == "NEWLINE":
+        line_offsets = line_offsets[:-1]
+    return tokens[:-1], line_offsets
+
+
+def lex_window(lexer, text, start_line, end_line, num_context_tokens):
+    """
+    LexedWindow of the lines start_line to end_line of the text (lines of Pipeline.split_tokens_by_line), with at
+    least num_context_tokens tokens before and after them, or up to the start and end of the file. Tokens and
+    LineOffsets are the ones of the whole text (after Pipeline.remove_last_token), from line FirstLine on.
+    None if the lines are not within the text.
+    """
+
+    text = lexer.preprocess(text)
+    line_starts = list(accumulate([0] + [len(line) + 1 for line in text.split('\n')[:-1]]))
+    if not 0 <= start_line < len(line_starts) - 1:
+        return None
+    spans, hazard_pos = scan_constructs(lexer, text, line_starts[start_line])
+    span_starts = [start for start, _ in spans]
+
+    def is_window_start(line):
+        pos = line_starts[line]
+        if pos == 0:
+            return True
+        if pos > hazard_pos:
+            return False
+        i = bisect_right(span_starts, pos - 1) - 1
+        if i >= 0 and spans[i][1] > pos - 1:
+            # Only right after a line comment (or string) that ended with the line
+            return spans[i][1] == pos
+        last_pos = pos - 2
+        while last_pos >= 0 and text[last_pos] in " \t":
+            last_pos -= 1
+        return last_pos >= 0 and text[last_pos] in LINE_END_PUNCTUATION
+
+    lines_before = lines_after = int(num_context_tokens * LINES_PER_CONTEXT_TOKEN)
+    first_line = start_line + 1
+    while True:
+        first_line = max(min(first_line - 1, start_line - lines_before), 0)
+        while not is_window_start(first_line):
+            first_line -= 1
+        start_idx = start_line - first_line
+        # Context tokens after the required lines start at the line after them
+        after_idx = max(start_idx, end_line - first_line + 1)
+
+        tokens = []
+        pos = line_starts[first_line]
+        while True:
+            stop_pos = max(line_starts[min(end_line + 1 + lines_after, len(line_starts) - 1)], pos + 1)
+            stopped_at = lexer.lex(text, tokens, pos=pos, checkpoints=[],
+                                   stop=lambda checkpoint: checkpoint.Position >= stop_pos)
+            line_offsets = get_line_offsets(tokens)
+            if stopped_at is None:
+                tokens, line_offsets = remove_last_token(tokens, line_offsets)
+                break
+            if after_idx < len(line_offsets) and len(tokens) - line_offsets[after_idx] >= num_context_tokens:
+                break
+            pos = stopped_at.Position
+            lines_after = 2 * lines_after + 1
+
+        if start_idx >= len(line_offsets):
+            return None
+        if first_line == 0 or line_offsets[start_idx] >= num_context_tokens:
+            return LexedWindow(tokens, line_offsets, first_line)
+        lines_before = 2 * lines_before + 1
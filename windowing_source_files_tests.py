@@ -0,0 +1,151 @@
+import unittest
+import os
+import json
+import random
+import hashlib
+from regex_lexer import CSharpAndCommentsLexer
+from regex_lexer_camelcase import CSharpAndCommentsCamelcaseLexer
+from compiling_regex_lexers import get_compiled_lexer, GROUPS_ACTION, USING_ACTION
+from generating_synthetic_inputs import load_csharp_corpus, fuzz_csharp_code, edit_csharp_code
+from caching_lexed_tokens import get_line_offsets
+from windowing_source_files import lex_window, remove_last_token, STATE_ENTRIES
+from sharding_datapoints import is_sharded_dataset, ShardedDatapointReader
+from unified_data_model import UnifiedDatapoint
+from reading_source_files import get_source_file
+
+
+# The rules of the lexers that STATE_ENTRIES, NEWLINE_HAZARD_REGEX and LINE_END_PUNCTUATION were derived
+# from. Update them only after checking those against the changed rules.
+WINDOWED_LEXER_RULES_DIGESTS = {
+    "CSharpAndCommentsLexer": "d4db04e193c1d4395a98603b49ccd7f8b89fc654697aab8414a5a22f40181eeb",
+    "CSharpAndCommentsCamelcaseLexer": "6727c1c67fa36a7ef4fe9fb5c4c8a68e6a39611542a6dc1f58b0415bd3ec4ad1",
+}
+
+# The windows are also compared on the source files of the datapoints of this unified dataset, if it
+# exists, e.g. after running unifying_raw_dataset.py
+UNIFIED_DATASET_DIR = "unified_dataset"
+MAX_UNIFIED_DATAPOINTS = 500
+
+
+def describe_action(action_type, action):
+    if action_type == GROUPS_ACTION:
+        return action_type, [(group, describe_action(*group_action)) for group, group_action in action]
+    if action_type == USING_ACTION:
+        # The other lexer (None for this one) and its stack
+        other_lexer, stack = action
+        return action_type, other_lexer and other_lexer.lexer_class.__name__, stack
+    return action_type, str(action)
+
+
+def get_rules_digest(lexer):
+    rules = [(state_name, [(rule.Regex.pattern, rule.Regex.flags, describe_action(rule.ActionType, rule.Action),
+                            rule.NewState) for rule in state.rules])
+             for state_name, state in sorted(lexer.states.items())]
+    return hashlib.sha256(repr(rules).encode('utf-8')).hexdigest()
+
+
+def iter_unified_datapoints(dataset_dir):
+    if is_sharded_dataset(dataset_dir):
+        for _, datapoint in ShardedDatapointReader(dataset_dir).iter_datapoints():
+            yield UnifiedDatapoint.from_json(datapoint)
+        return
+    for f in sorted(os.scandir(dataset_dir), key=lambda f: f.name):
+        if f.name.endswith(".json"):
+            with open(f.path, encoding='utf-8') as datapoint_file:
+                yield UnifiedDatapoint.from_json(json.load(datapoint_file))
+
+
+class TestWindowingSourceFiles(unittest.TestCase):
+
+    def assert_same_as_whole_file(self, lexer, code, start_line, end_line, num_context_tokens):
+        tokens = list(lexer.get_tokens(code))
+        tokens, line_offsets = remove_last_token(tokens, get_line_offsets(tokens))
+        window = lex_window(lexer, code, start_line, end_line, num_context_tokens)
+        if window is None:
+            self.assertFalse(0 <= start_line < len(line_offsets))
+            return window
+
+        window_start = line_offsets[window.FirstLine]
+        window_end = window_start + len(window.Tokens)
+        self.assertEqual(window.Tokens, tokens[window_start:window_end])
+        self.assertEqual(window.LineOffsets, [line_offset - window_start for line_offset in line_offsets
+                                              if window_start <= line_offset <= window_end][:len(window.LineOffsets)])
+        # Enough context tokens, unless at the start or end of the file
+        self.assertTrue(window.FirstLine == 0 or line_offsets[start_line] - window_start >= num_context_tokens)
+        after_line = max(start_line, end_line + 1)
+        self.assertTrue(window_end == len(tokens) or window_end - line_offsets[after_line] >= num_context_tokens)
+        return window
+
+    def test_same_tokens_as_whole_file(self):
+        corpus = load_csharp_corpus()
+        rand = random.Random(0)
+        num_partial_windows = 0
+
+        for lexer_class in (CSharpAndCommentsLexer, CSharpAndCommentsCamelcaseLexer):
+            lexer = get_compiled_lexer(lexer_class)
+            for i in range(300):
+                code = rand.choice(corpus) if i % 3 == 0 else fuzz_csharp_code(corpus, rand)
+                if i % 2:
+                    code = edit_csharp_code(code, rand)
+                start_line = rand.randrange(-1, code.count("\n") + 2)
+                end_line = start_line + rand.randrange(-1, 5)
+                window = self.assert_same_as_whole_file(lexer, code, start_line, end_line,
+                                                        rand.choice([0, 1, 20, 115]))
+                if window is not None and window.FirstLine > 0:
+                    num_partial_windows += 1
+        # Most windows don't start at the start of the file
+        self.assertGreater(num_partial_windows, 300)
+
+    def test_same_tokens_on_unified_dataset(self):
+        lexers = [get_compiled_lexer(lexer_class)
+                  for lexer_class in (CSharpAndCommentsLexer, CSharpAndCommentsCamelcaseLexer)]
+
+        with open("sample_unified_data_model.json") as f:
+            for datapoint in json.load(f).values():
+                code = "".join(datapoint["FileContext"])
+                for lexer in lexers:
+                    for line in range(code.count("\n")):
+                        self.assert_same_as_whole_file(lexer, code, line, line + 2, 20)
+
+        if not os.path.isdir(UNIFIED_DATASET_DIR):
+            self.skipTest(f"No unified dataset in {UNIFIED_DATASET_DIR}")
+        num_compared = 0
+        for datapoint in iter_unified_datapoints(UNIFIED_DATASET_DIR):
+            try:
+                code = get_source_file(f"./submodule_repos_to_analyze/{datapoint.Repo}", datapoint.Commit,
+                                       datapoint.FilePath, False).text()
+            except (OSError, UnicodeDecodeError):
+                continue
+            for lexer in lexers:
+                self.assert_same_as_whole_file(lexer, code, datapoint.RequiredLinesStart - 1,
+                                               datapoint.RequiredLinesEnd - 1, 115)
+            num_compared += 1
+            if num_compared == MAX_UNIFIED_DATAPOINTS:
+                break
+
+    def test_lexer_rules_unchanged(self):
+        for lexer_class in (CSharpAndCommentsLexer, CSharpAndCommentsCamelcaseLexer):
+            lexer = get_compiled_lexer(lexer_class)
+            for state_entry, state_name in STATE_ENTRIES.items():
+                # The root rule of the entry is the one that enters the state
+                rule = next(rule for rule in lexer.states['root'].rules if rule.Regex.match(state_entry))
+                self.assertEqual(rule.NewState, (state_name,))
+                self.assertEqual(rule.Regex.match(state_entry).group(), state_entry)
+            self.assertEqual(get_rules_digest(lexer), WINDOWED_LEXER_RULES_DIGESTS[lexer_class.__name__],
+                             f"The rules of {lexer_class.__name__} changed, check the tables of windowing_source_files.py")
+
+    def test_window_start(self):
+        lexer = get_compiled_lexer(CSharpAndCommentsLexer)
+        code = "int a;\n/* x\ny; */\nint b;\npublic static\nvoid Foo() {}\n"
+
+        self.assertEqual(lex_window(lexer, code, 3, 3, 0).FirstLine, 3)
+        # Not in the comment
+        self.assertEqual(lex_window(lexer, code, 2, 2, 0).FirstLine, 1)
+        # Not in the method signature
+        self.assertEqual(lex_window(lexer, code, 5, 5, 0).FirstLine, 4)
+        # Nor after a newline token that isn't NEWLINE
+        self.assertEqual(lex_window(lexer, "x = '\n';\ny;\n", 1, 1, 0).FirstLine, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()